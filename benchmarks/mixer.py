@@ -0,0 +1,105 @@
+"""
+Benchmark of the station mixer.
+
+Mixes synthetic PCM for a number of simulated stations, each one
+crossfading songs every few seconds with voice-over promotions on
+top, and reports the cost of a block and how many stations one core
+mixes in real time. Decoding and encoding run in ffmpeg processes
+and are not included.
+
+    python -m benchmarks.mixer --stations 50 --seconds 60
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from config import CROSSFADE_SECONDS, MIXER_FRAME, PACING_CHUNK_SECONDS
+from streamer.mixer import Mixer, RATE, CHANNELS
+
+
+class SyntheticTrack:
+    def __init__(self, audio: np.ndarray, duration: float) -> None:
+        """
+        Track reading `duration` seconds of looped `audio`.
+        """
+        self.audio = audio
+        self.frames = int(duration * RATE)
+        self.read_frames = 0
+        self.done = False
+
+    @property
+    def remaining(self) -> float:
+        return 0.0 if self.done else (self.frames - self.read_frames) / RATE
+
+    def read(self, frames: int) -> np.ndarray:
+        start = self.read_frames % len(self.audio)
+        count = min(frames, self.frames - self.read_frames, len(self.audio) - start)
+        self.read_frames += count
+        if self.read_frames >= self.frames:
+            self.done = True
+        return self.audio[start : start + count]
+
+    def close(self):
+        self.done = True
+
+
+def run(stations: int, seconds: float, song_seconds: float, promotion_every: int) -> dict:
+    rng = np.random.default_rng(0)
+    audio = (rng.standard_normal((RATE * 10, CHANNELS)) * 0.1).astype(np.float32)
+    frames = max(1, round(PACING_CHUNK_SECONDS * RATE / MIXER_FRAME))
+    mixers = [Mixer(MIXER_FRAME, frames) for _ in range(stations)]
+    tracks = [None] * stations
+    played = [0] * stations
+    block = mixers[0].seconds
+    blocks = int(seconds / block)
+    timings = []
+    voices = 0
+
+    for _ in range(blocks):
+        began = time.perf_counter()
+        for i, mixer in enumerate(mixers):
+            track = tracks[i]
+            if track is None or track.remaining <= CROSSFADE_SECONDS:
+                tracks[i] = SyntheticTrack(audio, song_seconds)
+                mixer.start(tracks[i], CROSSFADE_SECONDS)
+                played[i] += 1
+                if played[i] % promotion_every == 0:
+                    mixer.overlay(SyntheticTrack(audio, song_seconds / 2), duck=True)
+            mixer.mix()
+            voices += mixer.voices
+        timings.append(time.perf_counter() - began)
+
+    timings = np.array(timings) / stations
+    return {
+        "stations": stations,
+        "block_seconds": block,
+        "blocks": blocks,
+        "avg_voices": voices / (blocks * stations),
+        "block_cost_avg_ms": float(timings.mean() * 1000),
+        "block_cost_p99_ms": float(np.percentile(timings, 99) * 1000),
+        "block_cost_max_ms": float(timings.max() * 1000),
+        # Share of one core a station's mixer needs in real time
+        "core_share_per_station": float(timings.mean() / block),
+        "stations_per_core": float(block / timings.mean()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--stations", type=int, default=50)
+    parser.add_argument("--seconds", type=float, default=60.0)
+    parser.add_argument("--song-seconds", type=float, default=8.0)
+    parser.add_argument("--promotion-every", type=int, default=3)
+    args = parser.parse_args()
+    print(
+        json.dumps(
+            run(args.stations, args.seconds, args.song_seconds, args.promotion_every),
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,363 @@
+"""
+Offline benchmark of the streaming pipeline.
+
+Generates synthetic songs, serves them from a local HTTP server
+standing in for the media storage and runs real stations against
+fakeredis (or the redis at --redis-url), with the encoder publishing
+to a null or file sink instead of RTSP. Reports as JSON:
+
+- get_from_url latency with a cold and a warm cache
+- time to first audio after the first playlist is announced
+- gaps of silence between tracks
+- switch latency after CURRENT_PLAY changes
+- cpu per station and peak resident memory
+
+    python -m benchmarks.pipeline --stations 4 --seconds 30 --output results.json
+"""
+import argparse
+import atexit
+import functools
+import json
+import os
+import resource
+import shutil
+import subprocess as sp
+import sys
+import tempfile
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Peak below which a block of the mix counts as silence
+SILENCE = 1e-4
+
+
+class Handler(SimpleHTTPRequestHandler):
+    # Seconds added to every request, simulating the storage latency
+    latency = 0.0
+
+    def do_GET(self):
+        if self.latency:
+            time.sleep(self.latency)
+        super().do_GET()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(directory: str, latency: float) -> ThreadingHTTPServer:
+    """
+    Serve `directory` on a free local port.
+    """
+    handler = type("Handler", (Handler,), {"latency": latency})
+    server = ThreadingHTTPServer(
+        ("127.0.0.1", 0), functools.partial(handler, directory=directory)
+    )
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def synthesize(directory: str, name: str, frequency: float, seconds: float, extension: str):
+    """
+    Write a `seconds` long tone with some noise, like music
+    it never is silent.
+    """
+    path = os.path.join(directory, f"{name}.{extension}")
+    sp.run(
+        [
+            "ffmpeg",
+            "-v",
+            "error",
+            "-y",
+            "-f",
+            "lavfi",
+            "-i",
+            f"sine=f={frequency}:d={seconds}",
+            "-f",
+            "lavfi",
+            "-i",
+            f"anoisesrc=d={seconds}:a=0.02",
+            "-filter_complex",
+            "amix=inputs=2",
+            "-ac",
+            "2",
+            path,
+        ],
+        check=True,
+    )
+    return path
+
+
+def percentiles(values) -> dict:
+    if not values:
+        return {}
+    values = np.array(values)
+    return {
+        "avg": float(values.mean()),
+        "p50": float(np.percentile(values, 50)),
+        "p95": float(np.percentile(values, 95)),
+        "max": float(values.max()),
+    }
+
+
+class Probe:
+    def __init__(self, station) -> None:
+        """
+        Record when each block written by `station` is heard
+        and whether it is silent.
+        """
+        self.station = station
+        self.blocks = []
+        write = station.pacer.write
+
+        def _write(chunk, seconds, stop=None):
+            written = write(chunk, seconds, stop)
+            if written:
+                pacer = station.pacer
+                audible = pacer.clock + pacer.position - seconds
+                peak = float(np.abs(np.frombuffer(chunk, dtype="<f4")).max())
+                self.blocks.append((audible, peak < SILENCE))
+            return written
+
+        station.pacer.write = _write
+
+    def first_audio(self, after: float):
+        for audible, silent in list(self.blocks):
+            if audible >= after and not silent:
+                return audible
+        return None
+
+    def gaps(self, after: float, before: float) -> list:
+        """
+        Seconds of each run of silence heard between `after`
+        and `before`.
+        """
+        gaps = []
+        run = 0.0
+        seconds = self.station.mixer.seconds
+        for audible, silent in list(self.blocks):
+            if audible < after or audible > before:
+                continue
+            if silent:
+                run += seconds
+            elif run:
+                gaps.append(run)
+                run = 0.0
+        return gaps
+
+
+def switch_stats(name: str):
+    from streamer.metrics import SWITCH_SECONDS
+
+    counts, total = SWITCH_SECONDS.values.get((name,), ([0], 0.0))
+    return sum(counts), total
+
+
+def run(args) -> dict:
+    work = tempfile.mkdtemp(prefix="radio-bench-")
+    media = os.path.join(work, "media")
+    os.mkdir(media)
+    # The streamer keeps its cache relative to the working directory
+    os.chdir(work)
+
+    from common import redis as redis_module
+
+    if args.redis_url:
+        import redis
+
+        redis_module.redis_backend.instance = redis.from_url(args.redis_url)
+    else:
+        import fakeredis
+
+        redis_module.redis_backend.instance = fakeredis.FakeRedis(
+            server=fakeredis.FakeServer()
+        )
+
+    from streamer import streamer
+    from streamer.station import Station
+    from common.redis import station_key
+    from config import PLAYLIST_CHANNEL
+
+    import logging
+
+    logging.getLogger().setLevel(logging.WARNING)
+    backend = redis_module.redis_backend
+
+    # Two playlists, songs for get_from_url and a promotion
+    for i in range(args.songs * 3 + 1):
+        synthesize(media, f"song{i}", 220 + 20 * i, args.song_seconds, args.format)
+    server = serve(media, args.latency)
+    base = f"http://127.0.0.1:{server.server_address[1]}/"
+
+    def entry(i):
+        return [f"song{i}", f"{base}song{i}.{args.format}", f"thumb{i}", 0.0]
+
+    first = [entry(i) for i in range(args.songs)]
+    second = [entry(i) for i in range(args.songs, args.songs * 2)]
+    promotions = [entry(args.songs * 3)]
+
+    def sink(name):
+        output = ["-f", "null", "-"]
+        if args.sink == "file":
+            output = ["-f", "ogg", os.path.join(work, f"{name or 'default'}.ogg")]
+        return streamer.COMMAND[:1] + ["-v", "error"] + streamer.COMMAND[1:-3] + output
+
+    names = [f"bench{i}" for i in range(args.stations)]
+    stations = [
+        Station(
+            name,
+            sink(name),
+            streamer.prepare_song,
+            streamer.durations,
+            streamer.clips,
+            streamer.cache.unpin,
+        )
+        for name in names
+    ]
+    probes = [Probe(station) for station in stations]
+    started = time.monotonic()
+    usage_before = resource.getrusage(resource.RUSAGE_SELF)
+    for station in stations:
+        station.start()
+
+    peak_encoder_rss = 0
+    stop = threading.Event()
+
+    def sample():
+        nonlocal peak_encoder_rss
+        while not stop.wait(0.5):
+            for station in stations:
+                peak_encoder_rss = max(peak_encoder_rss, station.stats()["encoder_rss"])
+
+    threading.Thread(target=sample, daemon=True).start()
+
+    announced = time.monotonic()
+    for name in names:
+        backend.set_fields(
+            station_key("CURRENT_PLAY", name),
+            {"playlist": "first", "songs": first, "promotions": promotions},
+        )
+        backend.publish(station_key(PLAYLIST_CHANNEL, name), "first")
+
+    time.sleep(args.seconds / 2)
+    before_switch = {name: switch_stats(name) for name in names}
+    for name in names:
+        backend.set_fields(
+            station_key("CURRENT_PLAY", name), {"playlist": "second", "songs": second}
+        )
+        backend.publish(station_key(PLAYLIST_CHANNEL, name), "second")
+    time.sleep(args.seconds / 2)
+    stop.set()
+    finished = time.monotonic()
+    wall = finished - started
+
+    results = []
+    for name, station, probe in zip(names, stations, probes):
+        stats = station.stats()
+        first_audio = probe.first_audio(announced)
+        count, total = switch_stats(name)
+        count -= before_switch[name][0]
+        total -= before_switch[name][1]
+        gaps = probe.gaps(first_audio or finished, finished)
+        results.append(
+            {
+                "station": name,
+                "time_to_first_audio": first_audio - announced if first_audio else None,
+                "switch_latency": total / count if count else None,
+                "gaps": len(gaps),
+                "max_gap": max(gaps, default=0.0),
+                "silence": sum(gaps),
+                "underruns": stats["underruns"],
+                "overruns": stats["overruns"],
+                "restarts": stats["restarts"],
+                "loop_cpu_share": stats["loop_cpu"] / wall,
+                "encoder_cpu_share": stats["encoder_cpu"] / wall,
+            }
+        )
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    process_cpu = (usage.ru_utime - usage_before.ru_utime) + (
+        usage.ru_stime - usage_before.ru_stime
+    )
+    encoders_cpu = sum(r["encoder_cpu_share"] for r in results) * wall
+
+    # get_from_url on songs no station has played yet, then again
+    cold, warm = [], []
+    for i in range(args.songs * 2, args.songs * 3):
+        url = f"{base}song{i}.{args.format}"
+        for timings in (cold, warm):
+            began = time.perf_counter()
+            path = streamer.get_from_url("bench", f"song{i}", url)
+            timings.append(time.perf_counter() - began)
+            streamer.cache.unpin(path)
+
+    server.shutdown()
+    if not args.keep:
+        # Nothing left to save the indexes to
+        atexit.unregister(streamer.cache.save)
+        atexit.unregister(streamer.durations.save)
+        shutil.rmtree(work, ignore_errors=True)
+
+    return {
+        "config": {
+            "stations": args.stations,
+            "seconds": args.seconds,
+            "songs": args.songs,
+            "song_seconds": args.song_seconds,
+            "format": args.format,
+            "sink": args.sink,
+            "latency": args.latency,
+        },
+        "get_from_url": {"cold": percentiles(cold), "warm": percentiles(warm)},
+        "time_to_first_audio": percentiles(
+            [r["time_to_first_audio"] for r in results if r["time_to_first_audio"] is not None]
+        ),
+        "switch_latency": percentiles(
+            [r["switch_latency"] for r in results if r["switch_latency"] is not None]
+        ),
+        "max_gap": max((r["max_gap"] for r in results), default=0.0),
+        "underruns": sum(r["underruns"] for r in results),
+        # Streamer process (mixing, pacing, downloads) plus its encoders,
+        # decoders and transcodes that ran in ffmpeg
+        "cpu_share_per_station": (process_cpu + encoders_cpu + children.ru_utime + children.ru_stime)
+        / wall
+        / args.stations,
+        "peak_rss": usage.ru_maxrss * 1024,
+        "peak_encoder_rss": peak_encoder_rss,
+        "stations": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--stations", type=int, default=2)
+    parser.add_argument("--seconds", type=float, default=30.0)
+    parser.add_argument("--songs", type=int, default=3)
+    parser.add_argument("--song-seconds", type=float, default=8.0)
+    parser.add_argument("--format", default="wav", help="wav to transcode, opus for renditions")
+    parser.add_argument("--sink", choices=["null", "file"], default="null")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added per request")
+    parser.add_argument("--redis-url", help="use this redis instead of fakeredis")
+    parser.add_argument("--output", help="write the results to this file")
+    parser.add_argument("--keep", action="store_true", help="keep the working directory")
+    args = parser.parse_args()
+    if args.output:
+        # run() changes the working directory
+        args.output = os.path.abspath(args.output)
+
+    results = json.dumps(run(args), indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(results)
+    print(results)
+
+
+if __name__ == "__main__":
+    main()
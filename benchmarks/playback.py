@@ -0,0 +1,94 @@
+"""
+Benchmark of playing a repeated clip.
+
+Plays a synthetic promotion over and over the way a station does,
+decoded by ffmpeg on every play and from the clip cache, and reports
+the cpu time and wall time to the first block per play along with
+the memory allocated while mixing it.
+
+    python -m benchmarks.playback --plays 20 --clip-seconds 30
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.pipeline import synthesize
+from config import MIXER_FRAME, PACING_CHUNK_SECONDS
+from streamer.clips import ClipCache
+from streamer.mixer import Mixer, Track, RATE
+
+
+def cpu() -> float:
+    """
+    Cpu seconds of this process and its finished children.
+    """
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime + children.ru_utime + children.ru_stime
+
+
+def play(mixer: Mixer, make) -> dict:
+    """
+    Mix the track `make()` returns to the end, returns the seconds
+    to its first block and the most memory allocated at once while
+    mixing the following blocks.
+    """
+    began = time.perf_counter()
+    track = make()
+    mixer.start(track)
+    mixer.mix()
+    first = time.perf_counter() - began
+    tracemalloc.start()
+    while mixer.voices:
+        mixer.mix()
+    allocated = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"track": type(track).__name__, "first_block": first, "peak_allocated": allocated}
+
+
+def run(args) -> dict:
+    work = tempfile.mkdtemp(prefix="radio-bench-")
+    clip = synthesize(work, "promotion", 440, args.clip_seconds, "opus")
+    frames = max(1, round(PACING_CHUNK_SECONDS * RATE / MIXER_FRAME))
+    mixer = Mixer(MIXER_FRAME, frames)
+    clips = ClipCache(os.path.join(work, "clips"), 1024 * 1024 * 1024, args.clip_seconds + 1)
+
+    results = {"config": vars(args)}
+    for name, make in (
+        ("decoded", lambda: Track(clip, args.clip_seconds)),
+        ("clip_cache", lambda: clips.track(clip, args.clip_seconds)),
+    ):
+        if name == "clip_cache":
+            # Played enough to be decoded once and cached
+            for _ in range(clips.min_plays):
+                make().close()
+            clips.executor.submit(lambda: None).result()
+        runs = []
+        began = cpu()
+        for _ in range(args.plays):
+            runs.append(play(mixer, make))
+        results[name] = {
+            "track": runs[0]["track"],
+            "cpu_per_play": (cpu() - began) / args.plays,
+            "first_block_avg": sum(r["first_block"] for r in runs) / len(runs),
+            "peak_allocated_bytes": max(r["peak_allocated"] for r in runs),
+        }
+    shutil.rmtree(work, ignore_errors=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--plays", type=int, default=20)
+    parser.add_argument("--clip-seconds", type=float, default=30.0)
+    args = parser.parse_args()
+    print(json.dumps(run(args), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""
+Microbenchmark of the redis data access layer.
+
+Compares common/redis.py with the wrappers it replaced, which
+serialized with json and sent one command per round trip, on the
+operations the streamer and the API run: serializing a playlist,
+reading and writing what a station plays, reading the stats of all
+stations and a cached read. Runs against fakeredis with a simulated
+round trip time, or the redis at --redis-url. Reports as JSON the
+microseconds and round trips per operation.
+
+    python -m benchmarks.redis_layer --rtt 0.0005 --stations 24
+"""
+import argparse
+import json
+import time
+
+import redis
+
+from common import redis as layer
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class LegacyRedis:
+    """
+    The wrapper common/redis.py and api/commons/redis.py had.
+    """
+
+    def __init__(self, instance) -> None:
+        self.instance = instance
+
+    def set(self, key, data, ex=None):
+        self.instance.set(key, json.dumps(data), ex=ex)
+
+    def publish(self, channel, data):
+        self.instance.publish(channel, json.dumps(data))
+
+    def get(self, key):
+        serialized_data = self.instance.get(key)
+        if not serialized_data:
+            return ""
+        return json.loads(serialized_data)
+
+
+class RoundTrips:
+    def __init__(self, rtt: float) -> None:
+        """
+        Count the commands, or pipelines of commands, sent to
+        redis and delay each one by `rtt` seconds.
+        """
+        self.rtt = rtt
+        self.count = 0
+        send = redis.connection.Connection.send_packed_command
+
+        def _send(connection, command, check_health=True):
+            self.count += 1
+            if self.rtt:
+                time.sleep(self.rtt)
+            return send(connection, command, check_health)
+
+        redis.connection.Connection.send_packed_command = _send
+
+
+def measure(function, iterations: int, trips: RoundTrips) -> dict:
+    function()
+    before = trips.count
+    began = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    elapsed = time.perf_counter() - began
+    return {
+        "us": elapsed / iterations * 1e6,
+        "round_trips": (trips.count - before) / iterations,
+    }
+
+
+def run(args) -> dict:
+    if args.redis_url:
+        instance = redis.from_url(args.redis_url)
+    else:
+        import fakeredis
+
+        instance = fakeredis.FakeRedis(server=fakeredis.FakeServer())
+    trips = RoundTrips(args.rtt)
+    legacy = LegacyRedis(instance)
+    backend = layer.Redis(args.redis_url or "redis://localhost")
+    backend.instance = instance
+
+    entry = [
+        "A song title",
+        "https://ik.imagekit.io/radio/playlist/a-song-title.opus",
+        "https://ik.imagekit.io/radio/playlist/a-song-title.jpg",
+        -3.2,
+        215.4,
+    ]
+    songs = [entry] * args.songs
+    promotions = [entry] * 4
+    play = {"playlist": "bench", "songs": songs}
+    stats = {
+        "loop_cpu": 12.5,
+        "encoder_cpu": 80.1,
+        "encoder_rss": 25000000,
+        "restarts": 0,
+        "voices": 1,
+        "underruns": 0,
+        "overruns": 3,
+        "buffered": 1.9,
+    }
+    stations = [f"bench{i}:STATION_STATS" for i in range(args.stations)]
+    n = args.iterations
+    results = {"config": vars(args)}
+
+    serializers = {
+        "json": (lambda: json.dumps(play).encode(), json.loads),
+        "orjson": (lambda: layer.dumps(play), layer.loads),
+    }
+    if msgpack is not None:
+        serializers["msgpack"] = (lambda: msgpack.packb(play), msgpack.unpackb)
+    results["serialize"] = {}
+    for name, (dumps, loads) in serializers.items():
+        data = dumps()
+        results["serialize"][name] = {
+            "bytes": len(data),
+            "dumps_us": measure(dumps, n, trips)["us"],
+            "loads_us": measure(lambda: loads(data), n, trips)["us"],
+        }
+
+    def legacy_write():
+        legacy.set("CURRENT_PROMOTIONS", promotions)
+        legacy.set("CURRENT_PLAY", play)
+        legacy.publish("CURRENT_PLAY_CHANGED", "bench")
+
+    def layer_write():
+        with backend.batch() as batch:
+            batch.set_fields("PLAY", {**play, "promotions": promotions}, replace=True)
+            batch.publish("CURRENT_PLAY_CHANGED", "bench")
+
+    def legacy_read():
+        return legacy.get("CURRENT_PLAY"), legacy.get("CURRENT_PROMOTIONS")
+
+    def layer_read():
+        return backend.get_fields("PLAY")
+
+    for key in stations:
+        legacy.set(key, stats)
+
+    def legacy_stats():
+        return [legacy.get(key) for key in stations]
+
+    def layer_stats():
+        return backend.get_many(stations)
+
+    results["write_play"] = {
+        "legacy": measure(legacy_write, n, trips),
+        "layer": measure(layer_write, n, trips),
+    }
+    results["read_play"] = {
+        "legacy": measure(legacy_read, n, trips),
+        "layer": measure(layer_read, n, trips),
+    }
+    results["read_stats"] = {
+        "legacy": measure(legacy_stats, n, trips),
+        "layer": measure(layer_stats, n, trips),
+    }
+    results["read_play_cached"] = {
+        "legacy": results["read_play"]["legacy"],
+        "layer": measure(lambda: backend.get_fields("PLAY", ttl=1.0), n, trips),
+    }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--songs", type=int, default=40, help="songs in the playlist")
+    parser.add_argument("--stations", type=int, default=24, help="stats read at once")
+    parser.add_argument(
+        "--rtt", type=float, default=0.0, help="seconds added per round trip"
+    )
+    parser.add_argument("--redis-url", help="use this redis instead of fakeredis")
+    args = parser.parse_args()
+    print(json.dumps(run(args), indent=2))
+
+
+if __name__ == "__main__":
+    main()
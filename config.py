@@ -1,3 +1,94 @@
+import os
+
 RTSP_STREAM = "rtsp://rtsp-server:8554/mystream"
 REDIS_URL = "redis://redis:6379"
+# Redis connections shared by the stations, each playlist watcher
+# holds one for its subscription
+REDIS_POOL_SIZE = 64
+# Seconds to wait for a free connection when all are in use
+REDIS_POOL_TIMEOUT = 5.0
+# Most values kept by the in-process redis read cache
+REDIS_CACHE_SIZE = 10000
+# Directory holding transcoded media
+CACHE_DIR = "static/"
+# Directory holding decoded audio of short clips played repeatedly
+CLIP_DIR = "static/clips/"
+# Byte budget of decoded clips, a minute of audio is 23MB
+CLIP_MAX_BYTES = 512 * 1024 * 1024
+# Longest file (seconds) kept decoded, e.g. promotions and jingles
+CLIP_MAX_SECONDS = 60.0
+# Plays after which a clip is kept decoded
+CLIP_MIN_PLAYS = 2
+# Seconds before a cached url is revalidated with the origin
 CACHE_FILE_TIME = 1200
+# Byte budget of the media cache, least recently used files are evicted
+CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+# Seconds after a change the media cache and duration indexes are
+# written to disk
+CACHE_SAVE_INTERVAL = 5.0
+# Bytes read per chunk when downloading media and feeding the encoder
+CHUNK_SIZE = 64 * 1024
+
+# Connections kept alive per media host
+HTTP_POOL_SIZE = 10
+# Seconds to connect to a media host and between bytes received
+HTTP_TIMEOUT = (5.0, 30.0)
+# Attempts per request, with jittered exponential backoff from
+# HTTP_BACKOFF seconds up to HTTP_BACKOFF_MAX between them
+HTTP_RETRIES = 5
+HTTP_BACKOFF = 0.5
+HTTP_BACKOFF_MAX = 30.0
+# Media of at least this many bytes is downloaded as parallel ranges
+RANGE_MIN_BYTES = 8 * 1024 * 1024
+RANGE_PARTS = 4
+
+# Number of upcoming songs downloaded and transcoded ahead of play
+PREFETCH_DEPTH = 3
+# Concurrent background downloads/transcodes
+PREFETCH_WORKERS = 2
+# Upper bound (bytes) of prefetched audio waiting on disk to be played
+PREFETCH_MAX_BYTES = 256 * 1024 * 1024
+# Sidecar file memoizing opus durations by path and mtime
+DURATION_INDEX = "static/durations.json"
+# Seconds of audio fed to the encoder ahead of what is being heard
+PACING_LOOKAHEAD = 2.0
+# Seconds of audio written to the encoder at a time
+PACING_CHUNK_SECONDS = 0.25
+# Seconds the end of a song overlaps the start of the next
+CROSSFADE_SECONDS = 2.0
+# Samples per mixer frame, 20ms at 48kHz
+MIXER_FRAME = 960
+# Level the music is lowered to under voice-over promotions
+DUCK_LEVEL = 0.25
+# Seconds taken to lower the music and bring it back up
+DUCK_SECONDS = 0.5
+# Play promotions over the start of the next song instead of between songs
+PROMOTION_VOICE_OVER = False
+# Opus bitrate of the broadcast stream, also the one songs are transcoded
+# to and the on air rendition made by the API (RENDITION_BITRATES)
+STREAM_BITRATE = "64K"
+# Pub/sub channel the API announces playlist changes on
+PLAYLIST_CHANNEL = "CURRENT_PLAY_CHANGED"
+# Pub/sub channel schedule updates are announced on
+SCHEDULE_CHANNEL = "SCHEDULE_CHANGED"
+# Seconds a track may start off its scheduled time before the
+# rest of the schedule is published again
+SCHEDULE_TOLERANCE = 1.0
+# Seconds of past schedule kept for "what played at" lookups
+SCHEDULE_HISTORY = 24 * 60 * 60
+# Stations played by the streamer as (name, rtsp url) pairs. Redis keys
+# of a named station are prefixed with "<name>:", the unnamed station
+# uses the plain keys.
+STATIONS = [("", RTSP_STREAM)]
+# Port of the Prometheus metrics endpoint
+METRICS_PORT = 8080
+# Seconds between per station resource usage reports
+STATS_INTERVAL = 30
+# Transcodes run at once, one per core by default
+TRANSCODE_WORKERS = os.cpu_count() or 1
+# Directory HLS playlists and segments are written to, one sub
+# directory per station and variant, for a static server or CDN to
+# serve. None publishes RTSP only.
+HLS_DIR = "hls/"
+# HLS variants as name: (segment seconds, segments kept in the playlist)
+HLS_VARIANTS = {"standard": (6, 6), "low-latency": (1, 6)}
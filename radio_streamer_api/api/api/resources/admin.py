@@ -1,23 +1,30 @@
+import os
 from email import message
 import requests
-from sqlalchemy import and_
 from flask import request, jsonify
 from flask_restful import Resource, abort, current_app
-from flask_jwt_extended import jwt_required, current_user
+from flask_jwt_extended import jwt_required
 
-from api.commons.redis import redis_backend
+from api.commons.redis import redis_backend, station_key
 
 from api.api.schemas.admin import (
   AddPlaylistSchema,
+  PlaylistEntrySchema,
   PlayFromPlaylistSchema,
   DeletePlaylistSchema)
 from api.models import User, Media
 from api.extensions import db
-from api.config import STORAGE_URL
+from api.config import STORAGE_URL, PLAYLIST_CHANNEL
 from api.commons.pagination import paginate
-from api.auth.helpers import admin_required
+from api.commons.playlists import (
+  get_playlists,
+  playlist_entries,
+  add_to_playlist,
+  remove_entries)
+from api.auth.helpers import admin_required, current_user
 
 from api.commons import storage
+from api.commons.ingest import save_upload, schedule_ingest, on_air_url, on_air_gain
 
 
 class Play(Resource):
@@ -37,6 +44,9 @@ class Play(Resource):
               properties:
                 playlist:
                   type: string
+                station:
+                  type: string
+                  description: station to play on, defaults to the main station
 
       responses:
         200:
@@ -62,23 +72,37 @@ class Play(Resource):
         # in_schema = PlayFromPlaylistRequestSchema()
         media = request.json
         playlist = media["playlist"]
+        station = media.get("station", "")
         out = {"playlist": playlist}
         out_songs = []
-        medias = Media.query.filter(Media.playlist==playlist).all()
+        entries = playlist_entries(playlist).all()
         promos = []
-        promotions = Media.query.filter(Media.playlist=='promotion').all()
+        promotions = playlist_entries('promotion').all()
         
         # set promotions to be played
         for p in promotions:
-            promos.append((p.audio_name, p.audio_url, p.thumbnail_image_url))
-        redis_backend.set("CURRENT_PROMOTIONS", promos)
-        if not medias:
+            m = p.media
+            promos.append(
+                (p.title, on_air_url(m), m.thumbnail_image_url, on_air_gain(m), m.duration)
+            )
+        if not entries:
               abort(404, message="playlist not found")
-        for m in medias:
-            out_songs.append((m.title, m.audio_url, m.thumbnail_image_url))
+        for e in entries:
+            m = e.media
+            out_songs.append(
+                (e.title, on_air_url(m), m.thumbnail_image_url, on_air_gain(m), m.duration)
+            )
         out["songs"] = out_songs
-        redis_backend.set("CURRENT_PLAY", out)
-        redis_backend.set("CURRENT_THUMB", out[1][0][-1])
+        # The streamer reads the playlist and promotions together,
+        # the change is announced in the same transaction
+        with redis_backend.batch() as batch:
+            batch.set_fields(
+                station_key("CURRENT_PLAY", station),
+                {"playlist": playlist, "songs": out_songs, "promotions": promos},
+                replace=True,
+            )
+            # Wake the streamer so it switches right away
+            batch.publish(station_key(PLAYLIST_CHANNEL, station), playlist)
         return jsonify(out)
 
 
@@ -109,7 +133,7 @@ class PlayList(Resource):
                       results:
                         type: array
                         items:
-                          schema: AddPlaylistSchema
+                          schema: PlaylistEntrySchema
     post:
       tags:
         - playlist
@@ -144,11 +168,11 @@ class PlayList(Resource):
     def get(self, playlist, title=''):
         """
         """
-        schema = AddPlaylistSchema(many=True)
-        query = Media.query
-        query = query.filter_by(playlist=playlist)
+        schema = PlaylistEntrySchema(many=True)
         if title and title != '*':
-              query = query.filter_by(title=title)
+              query = playlist_entries(playlist, title)
+        else:
+              query = playlist_entries(playlist)
         return paginate(query, schema)
 
     def post(self):
@@ -157,12 +181,11 @@ class PlayList(Resource):
         """
         schema = AddPlaylistSchema()
         media_load = schema.load(request.json)
-        media = Media(playlist = media_load["playlist"],
-                      title=media_load["title"],
+        media = Media(title=media_load["title"],
                       audio_url=media_load["audio_url"],
                       thumbnail_image_url=media_load["thumbnail_image_url"],
                       setter_id = current_user.id)
-        db.session.add(media)
+        add_to_playlist(media_load["playlist"], media)
         db.session.commit()
         return "", 201
     
@@ -172,11 +195,13 @@ class PlayList(Resource):
         """
         schema = DeletePlaylistSchema()
         if title == "*":
-              query = Media.query.filter(Media.playlist==playlist)
+              query = playlist_entries(playlist)
         else:
-          query = Media.query.filter(and_(Media.title==title, Media.playlist==playlist))
-        query.first_or_404()
-        query.delete()
+          query = playlist_entries(playlist, title)
+        entries = query.all()
+        if not entries:
+              abort(404)
+        remove_entries(entries)
         db.session.commit()
 
         return
@@ -200,27 +225,19 @@ class PlayListAll(Resource):
                 properties:
                   playlists:
                     type: array
+                    description: index, name, number of songs and total duration in seconds
                     items:
-                      type: string
+                      type: array
+                      items: {}
+                    example: [[0, "rock", 12, 2841.5]]
     """
 
     method_decorators = [admin_required, jwt_required()]
 
-    def get(self, playlist, title=''):
+    def get(self):
         """
         """
-        query = Media.query
-        all = query.all()
-        playlists = []
-        already = []
-        i = 0
-        for pl in all:
-              plist = pl.playlist
-              if plist not in already:  
-                already.append(plist)
-                playlists.append([i, plist])
-                i += 1
-        return {"playlists": list(playlists)}
+        return {"playlists": get_playlists()}
 
 
 class MediaResource(Resource):
@@ -235,14 +252,14 @@ class MediaResource(Resource):
             Put resource represented by title into database and
             cloud storage.
         """
-        media = Media.query.filter_by(title=title, playlist=playlist).first()
+        entry = playlist_entries(playlist, title).first()
         
         # Update or Create
-        if media:
-            media.title = title
-            media.playlist = playlist
+        if entry:
+            media = entry.media
         else:
-            media = Media(title=title, playlist=playlist)
+            media = Media(title=title)
+            add_to_playlist(playlist, media)
         files  = request.files
         thumbnail = files.get("thumbnail")
         
@@ -251,15 +268,25 @@ class MediaResource(Resource):
         except KeyError:
             abort(400, message="audio file must be provided")
         
-        aud_upload = storage.upload_media(audio, title, playlist=playlist)
-        thumb_upload = storage.upload_media(thumbnail, title, "jpg", playlist=playlist)
+        # Kept for encoding the broadcast renditions after the response
+        source = save_upload(audio)
+        try:
+            aud_upload = storage.upload_media(audio, title, playlist=playlist)
+            thumb_upload = storage.upload_media(thumbnail, title, "jpg", playlist=playlist)
+        except Exception:
+            os.remove(source)
+            raise
         
         misc = {"aud_id": aud_upload["id"], "thumb_id": thumb_upload["id"]}
+        if media.misc and "renditions" in media.misc:
+            # Replaced once the new upload is encoded
+            misc["renditions"] = media.misc["renditions"]
         media.misc = misc
         media.audio_url = aud_upload["url"]
         media.thumbnail_image_url = thumb_upload["url"]
         db.session.add(media)
         db.session.commit()
+        schedule_ingest(media, source, playlist)
         return {"thumb_url": media.thumbnail_image_url,
                 "media_url": media.audio_url}, 201
     
@@ -273,24 +300,25 @@ class MediaResource(Resource):
             abort(400)
 
         if title:
-            query = Media.query.filter_by(title=title, playlist=playlist)
-            media = query.all()
+            entries = playlist_entries(playlist, title).all()
         else:
-            query = Media.query.filter_by(playlist=playlist)
-            media = query.all()
+            entries = playlist_entries(playlist).all()
+        if not entries:
+            abort(404, message="resource not found")
+        # Media still in other playlists keep their files
+        media = remove_entries(entries)
         
         for item in media:
             misc = item.misc
             try:
                 storage.delete_media(misc["aud_id"])
                 storage.delete_media(misc["thumb_id"])
+                for rendition in misc.get("renditions", {}).values():
+                    storage.delete_media(rendition["id"])
             except Exception as e:
                 logger.error(e)
 
-        if not media:
-            abort(404, message="resource not found")
         try:
-            query.delete()
             db.session.commit()
         except Exception as e:
             db.session.rollback()
@@ -308,15 +336,15 @@ class MediaResource(Resource):
         
         if title and title != '*':
             # request single song
-            items = Media.query.filter_by(title=title, playlist=playlist).all()
+            items = playlist_entries(playlist, title).all()
         else:
             # request playlist
-            items = Media.query.filter_by(playlist=playlist).all()
+            items = playlist_entries(playlist).all()
         if not items:
             abort(404, message="resource not found")
         return [{
-                "title": media.title, 
-                "thumbnail": media.thumbnail_image_url,
-                "media": media.audio_url,
-                "playlist": media.playlist
-                } for media in items]
\ No newline at end of file
+                "title": entry.title, 
+                "thumbnail": entry.media.thumbnail_image_url,
+                "media": entry.media.audio_url,
+                "playlist": playlist
+                } for entry in items]
\ No newline at end of file
@@ -1,12 +1,14 @@
-from flask import request
+from flask import redirect, request, Response
 from flask_restful import Resource, abort, current_app
-from flask_jwt_extended import jwt_required, get_current_user
+from flask_jwt_extended import jwt_required
 from api.api.schemas import UserSchema
 from api.models import User
-from api.auth.helpers import admin_only, admin_required
+from api.auth.helpers import admin_only, admin_required, get_current_user
 from api.extensions import db
 from api.commons.pagination import paginate
-from api.commons.redis import redis_backend
+from api.commons.schedule import parse_time, now_playing, up_next
+from api.commons import events
+from api.config import MAX_UP_NEXT
 
 
 class UserList(Resource):
@@ -110,6 +112,16 @@ class CurrentPlay(Resource):
         summary: Get currently playing song.
         tags:
           - current_play
+        parameters:
+          - in: query
+            name: station
+            schema:
+              type: string
+          - in: query
+            name: at
+            description: epoch seconds or ISO 8601 date, defaults to now
+            schema:
+              type: string
         responses:
           200:
             content:
@@ -121,10 +133,127 @@ class CurrentPlay(Resource):
                       type: string
                     thumbnail: 
                       type: string
+                    playlist:
+                      type: string
+                    started_at:
+                      type: number
+          400:
+            description: invalid time
+    """
+
+    def get(self):
+        station = request.args.get("station", "")
+        try:
+            at = parse_time(request.args.get("at"))
+        except ValueError:
+            abort(400, message="invalid time")
+        return now_playing(station, at)
+
+
+class CurrentPlayEvents(Resource):
+    """
+      Stream currently playing song data
+      ---
+      get:
+        summary: Stream now playing updates.
+        description: Server-sent events, a now-playing event with the
+          data of the current play endpoint on connect and then each
+          time a song or promotion starts or ends.
+        tags:
+          - current_play
+        parameters:
+          - in: query
+            name: station
+            schema:
+              type: string
+        responses:
+          307:
+            description: served by the event stream process
+          200:
+            content:
+              text/event-stream:
+                schema:
+                  type: string
+          404:
+            description: unknown station
+    """
+
+    def get(self):
+        events_url = current_app.config.get("EVENTS_URL")
+        if events_url:
+            query = request.query_string.decode()
+            return redirect(f"{events_url}?{query}" if query else events_url, 307)
+        station = request.args.get("station", "")
+        hub = events.hub
+        feed = hub.follow(station)
+        if feed is None:
+            abort(404, message="unknown station")
+        return Response(
+            events.stream(hub, feed),
+            mimetype="text/event-stream",
+            # Proxies must pass events on as they come
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+
+class UpNext(Resource):
+    """
+      Get the songs and promotions scheduled next
+      ---
+      get:
+        summary: Get upcoming songs.
+        tags:
+          - current_play
+        parameters:
+          - in: query
+            name: station
+            schema:
+              type: string
+          - in: query
+            name: at
+            description: epoch seconds or ISO 8601 date, defaults to now
+            schema:
+              type: string
+          - in: query
+            name: count
+            schema:
+              type: integer
+              default: 5
+        responses:
+          200:
+            content:
+              application/json:
+                schema:
+                  type: object
+                  properties:
+                    upcoming:
+                      type: array
+                      items:
+                        type: object
+                        properties:
+                          title:
+                            type: string
+                          thumbnail:
+                            type: string
+                          playlist:
+                            type: string
+                          promotion:
+                            type: boolean
+                          start:
+                            type: number
+                          duration:
+                            type: number
+          400:
+            description: invalid time or count
     """
 
     def get(self):
-        curr_song = redis_backend.get("CURRENT_SONG")
-        curr_thumb = redis_backend.get("CURRENT_THUMB")
-        return {"song_name": curr_song, "thumbnail": curr_thumb}
-        
\ No newline at end of file
+        station = request.args.get("station", "")
+        try:
+            at = parse_time(request.args.get("at"))
+            count = int(request.args.get("count", 5))
+        except ValueError:
+            abort(400, message="invalid time or count")
+        if not 0 < count <= MAX_UP_NEXT:
+            abort(400, message="invalid time or count")
+        return {"upcoming": up_next(station, at, count)}
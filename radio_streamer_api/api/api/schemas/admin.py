@@ -9,6 +9,14 @@ class AddPlaylistSchema(ma.SQLAlchemyAutoSchema):
     audio_url = ma.String(required=True)
     thumbnail_image_url = ma.String(required=True)
 
+class PlaylistEntrySchema(ma.Schema):
+    id = ma.Int(attribute="media_id", dump_only=True)
+    playlist = ma.String(attribute="playlist.name", dump_only=True)
+    title = ma.String(dump_only=True)
+    position = ma.Int(dump_only=True)
+    audio_url = ma.String(attribute="media.audio_url", dump_only=True)
+    thumbnail_image_url = ma.String(attribute="media.thumbnail_image_url", dump_only=True)
+
 class PlayFromPlaylistSchema(ma.Schema):
     playlist = ma.String(required=True)
     name = ma.String(required=True)
@@ -2,7 +2,7 @@ from flask import Blueprint, current_app, jsonify
 from flask_restful import Api
 from marshmallow import ValidationError
 from api.extensions import apispec
-from api.api.resources.resources import UserList, CurrentPlay
+from api.api.resources.resources import UserList, CurrentPlay, CurrentPlayEvents, UpNext
 from api.api.resources.admin import MediaResource, PlayList, Play, PlayListAll
 from api.api.schemas.admin import AddPlaylistSchema
 
@@ -14,6 +14,8 @@ api = Api(blueprint)
 # Resource
 api.add_resource(UserList, "/users", "/users/<int:user_id>", endpoint="users")
 api.add_resource(CurrentPlay, "/current-play", endpoint="current_play")
+api.add_resource(CurrentPlayEvents, "/current-play/events", endpoint="current_play_events")
+api.add_resource(UpNext, "/up-next", endpoint="up_next")
 
 # Admin resources
 api.add_resource(MediaResource, "/media", "/media/<title>", 
@@ -29,6 +31,8 @@ def register_views():
     apispec.spec.path(view=PlayList, app=current_app)
     apispec.spec.path(view=Play, app=  current_app)
     apispec.spec.path(view=CurrentPlay, app=current_app)
+    apispec.spec.path(view=CurrentPlayEvents, app=current_app)
+    apispec.spec.path(view=UpNext, app=current_app)
     apispec.spec.path(view=PlayListAll, app=current_app)
     apispec.spec.path(view=MediaResource, app=current_app)
 
@@ -7,6 +7,7 @@ from api.extensions import apispec
 from api.extensions import db
 from api.extensions import jwt
 from api.extensions import migrate
+from api.commons import timing
 from api.models import User
 
 
@@ -26,8 +27,12 @@ def create_app(testing=False):
     register_blueprints(app)
 
     with app.app_context():
-        db.create_all()
-        if not User.query.filter_by(is_admin=True).all():
+        if testing is True:
+            db.create_all()
+        # Otherwise the schema is created by `flask db upgrade`,
+        # which also loads the app
+        created = db.inspect(db.engine).has_table(User.__tablename__)
+        if created and not User.query.filter_by(is_admin=True).all():
             admin_mail = os.environ.get("ADMIN_EMAIL") or "admin@admin.com"
             admin_pass = os.environ.get("ADMIN_PASS") or "admin"
             admin = User(email=admin_mail, password=admin_pass, is_admin=True)
@@ -47,6 +52,7 @@ def configure_extensions(app):
     db.init_app(app)
     jwt.init_app(app)
     migrate.init_app(app, db)
+    timing.init_app(app)
 
 
 def configure_cli(app):
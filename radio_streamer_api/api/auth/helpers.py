@@ -3,49 +3,278 @@
 Heavily inspired by
 https://github.com/vimalloc/flask-jwt-extended/blob/master/examples/blocklist_database.py
 """
+import threading
+import time
+import uuid
 from datetime import datetime
 
+from flask import current_app, g
 from flask_restful import abort
-from flask_jwt_extended import decode_token, get_current_user
+from flask_jwt_extended import decode_token, get_jwt, get_jwt_header
 from flask_jwt_extended import get_jwt_identity
+from flask_jwt_extended.exceptions import UserLookupError
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
 from sqlalchemy.orm.exc import NoResultFound
+from redis import WatchError
+from werkzeug.local import LocalProxy
 
 from api.extensions import db
 from api.models import TokenBlocklist, User
+from api.commons.redis import redis_backend
+from api.commons.timing import timed
+from api.config import REVOCATION_CACHE_TTL, TOKEN_FLUSH_BATCH
 
+# Tokens issued but not yet written to the database, oldest first
+TOKEN_QUEUE = "TOKEN_QUEUE"
+# Held by the worker writing queued tokens to the database
+TOKEN_FLUSH_LOCK = "TOKEN_FLUSH_LOCK"
+TOKEN_FLUSH_LOCK_TTL = 60
 
-def add_token_to_database(encoded_token, identity_claim):
-    """
-    Adds a new token to the database. It is not revoked when it is added.
 
-    :param identity_claim: configured key to get user identity
+def revocation_key(jti):
+    return f"TOKEN_REVOKED:{jti}"
+
+
+def cache_revocation(jti, revoked, expires):
+    """
+    Store whether the token `jti` is revoked in redis until it
+    expires at `expires` (epoch seconds). Errors are only logged,
+    the database stays the reference.
     """
+    ttl = int(expires - time.time()) + 1
+    if ttl <= 0:
+        return
+    try:
+        redis_backend.set(revocation_key(jti), revoked, ex=ttl)
+    except Exception as e:
+        current_app.logger.error(f"Could not cache revocation of {jti}: {e}")
+
+
+def token_entry(encoded_token, identity_claim):
     decoded_token = decode_token(encoded_token)
-    jti = decoded_token["jti"]
-    token_type = decoded_token["type"]
-    user_identity = decoded_token[identity_claim]
-    expires = datetime.fromtimestamp(decoded_token["exp"])
-    revoked = False
-
-    db_token = TokenBlocklist(
-        jti=jti,
-        token_type=token_type,
-        user_id=user_identity,
-        expires=expires,
+    return {
+        "jti": decoded_token["jti"],
+        "token_type": decoded_token["type"],
+        "user_id": decoded_token[identity_claim],
+        "expires": decoded_token["exp"],
+    }
+
+
+def token_row(entry, revoked=False):
+    return TokenBlocklist(
+        jti=entry["jti"],
+        token_type=entry["token_type"],
+        user_id=entry["user_id"],
+        expires=datetime.fromtimestamp(entry["expires"]),
         revoked=revoked,
     )
-    db.session.add(db_token)
+
+
+def add_tokens_to_database(entries):
+    """
+    Adds new tokens to the database in one transaction. They are not
+    revoked when they are added.
+    """
+    db.session.add_all([token_row(entry) for entry in entries])
     db.session.commit()
+    for entry in entries:
+        cache_revocation(entry["jti"], False, entry["expires"])
 
 
-def is_token_revoked(jwt_payload):
+def register_tokens(encoded_tokens, identity_claim):
+    """
+    Registers new tokens as not revoked. They are queued in redis along
+    with their revocation state in one transaction, and written to the
+    database in bulk by the TokenWriter of some worker. Without redis,
+    or with a TOKEN_FLUSH_INTERVAL of 0, they are added to the database
+    in one transaction.
+
+    :param identity_claim: configured key to get user identity
+    """
+    entries = [token_entry(token, identity_claim) for token in encoded_tokens]
+    if not current_app.config.get("TOKEN_FLUSH_INTERVAL"):
+        add_tokens_to_database(entries)
+        return
+    try:
+        with redis_backend.batch() as batch:
+            for entry in entries:
+                ttl = int(entry["expires"] - time.time()) + 1
+                batch.set(revocation_key(entry["jti"]), False, ex=ttl)
+            batch.push(TOKEN_QUEUE, *entries)
+    except Exception as e:
+        current_app.logger.error(f"Could not queue tokens: {e}")
+        add_tokens_to_database(entries)
+        return
+    writer.start(current_app._get_current_object())
+
+
+def flush_tokens(limit=TOKEN_FLUSH_BATCH):
+    """
+    Writes up to `limit` queued tokens to the database in one
+    transaction, returns how many were taken from the queue.
+
+    Tokens are stored with the revocation state found in redis, and
+    tokens revoked while they were written are revoked again after the
+    commit, as revoke_token updates redis before the database. Tokens
+    already stored, by a writer that failed before dropping them from
+    the queue, are skipped.
+    """
+    lock = uuid.uuid4().hex
+    if not redis_backend.instance.set(
+        TOKEN_FLUSH_LOCK, lock, nx=True, ex=TOKEN_FLUSH_LOCK_TTL
+    ):
+        return 0
+    try:
+        entries = redis_backend.queued(TOKEN_QUEUE, limit)
+        if not entries:
+            return 0
+        # Tokens of users deleted while queued were revoked with them
+        users = {
+            user_id
+            for (user_id,) in db.session.query(User.id).filter(
+                User.id.in_({entry["user_id"] for entry in entries})
+            )
+        }
+        dropped = len(entries)
+        entries = [entry for entry in entries if entry["user_id"] in users]
+        jtis = [entry["jti"] for entry in entries]
+        keys = [revocation_key(jti) for jti in jtis]
+        stored = {
+            jti
+            for (jti,) in db.session.query(TokenBlocklist.jti).filter(
+                TokenBlocklist.jti.in_(jtis)
+            )
+        }
+        # A token whose state is gone is treated as revoked
+        db.session.add_all(
+            [
+                token_row(entry, revoked is not False)
+                for entry, revoked in zip(entries, redis_backend.get_many(keys))
+                if entry["jti"] not in stored
+            ]
+        )
+        db.session.commit()
+        redis_backend.dequeue(TOKEN_QUEUE, dropped)
+        revoked = [
+            jti
+            for jti, state in zip(jtis, redis_backend.get_many(keys))
+            if state is True
+        ]
+        if revoked:
+            TokenBlocklist.query.filter(TokenBlocklist.jti.in_(revoked)).update(
+                {"revoked": True}, synchronize_session=False
+            )
+            db.session.commit()
+        return dropped
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        release_flush_lock(lock)
+
+
+def release_flush_lock(lock):
+    """
+    Deletes TOKEN_FLUSH_LOCK if it is still held as `lock`, a flush
+    outliving TOKEN_FLUSH_LOCK_TTL leaves the lock taken since by
+    another writer in place.
+    """
+    with redis_backend.instance.pipeline() as pipe:
+        try:
+            pipe.watch(TOKEN_FLUSH_LOCK)
+            if pipe.get(TOKEN_FLUSH_LOCK) == lock.encode():
+                pipe.multi()
+                pipe.delete(TOKEN_FLUSH_LOCK)
+                pipe.execute()
+        except WatchError:
+            # Expired and taken by another writer meanwhile
+            pass
+
+
+def revoke_user_tokens(session, user_id, delete=False):
+    """
+    Revokes every token of the user `user_id`, stored or still
+    queued, in redis right away and in the database with the changes
+    pending in `session`. With `delete` the stored tokens are deleted
+    instead, a token unknown to the database is considered revoked.
+    """
+    tokens = session.query(TokenBlocklist).filter_by(user_id=user_id).all()
+    expiries = {token.jti: token.expires.timestamp() for token in tokens}
+    try:
+        for entry in redis_backend.queued(TOKEN_QUEUE):
+            if entry["user_id"] == user_id:
+                expiries[entry["jti"]] = entry["expires"]
+    except Exception as e:
+        current_app.logger.error(f"Could not read queued tokens: {e}")
+    for jti, expires in expiries.items():
+        cache_revocation(jti, True, expires)
+    for token in tokens:
+        if delete:
+            session.delete(token)
+        else:
+            token.revoked = True
+
+
+@event.listens_for(Session, "before_flush")
+def revoke_on_user_change(session, flush_context, instances):
+    """
+    Tokens carry whether their user is an admin, they are revoked
+    when the user is deleted or loses or gains the admin role.
+    """
+    for user in list(session.deleted):
+        if isinstance(user, User):
+            revoke_user_tokens(session, user.id, delete=True)
+    for user in list(session.dirty):
+        if isinstance(user, User) and inspect(user).attrs.is_admin.history.has_changes():
+            revoke_user_tokens(session, user.id)
+
+
+class TokenWriter:
+    def __init__(self) -> None:
+        """
+        Background thread writing the queued tokens to the database
+        every TOKEN_FLUSH_INTERVAL seconds. The queue is shared by all
+        workers so tokens one worker queued are written even if it
+        exits before flushing them.
+        """
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self, app):
+        """Start writing in the background unless already started"""
+        interval = app.config["TOKEN_FLUSH_INTERVAL"]
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(
+                target=self.run, args=(app, interval), name="token-writer", daemon=True
+            )
+            self.thread.start()
+
+    def run(self, app, interval):
+        while True:
+            time.sleep(interval)
+            with app.app_context():
+                try:
+                    while flush_tokens() == TOKEN_FLUSH_BATCH:
+                        pass
+                except Exception as e:
+                    app.logger.error(f"Could not write queued tokens: {e}")
+                finally:
+                    db.session.remove()
+
+
+writer = TokenWriter()
+
+
+def is_token_revoked_in_database(jti):
     """
     Checks if the given token is revoked or not. Because we are adding all the
     tokens that we create into this database, if the token is not present
     in the database we are going to consider it revoked, as we don't know where
     it was created.
     """
-    jti = jwt_payload["jti"]
     try:
         token = TokenBlocklist.query.filter_by(jti=jti).one()
         return token.revoked
@@ -53,38 +282,107 @@ def is_token_revoked(jwt_payload):
         return True
 
 
-def revoke_token(token_jti, user):
+def is_token_revoked(jwt_payload):
+    """
+    Checks if the given token is revoked, from the state cached in redis
+    when the token was issued or revoked. Answers are kept in the worker
+    for REVOCATION_CACHE_TTL seconds, so a token revoked through another
+    worker may be accepted that long. Tokens redis does not know about
+    are looked up in the database.
+    """
+    jti = jwt_payload["jti"]
+    try:
+        revoked = redis_backend.get(revocation_key(jti), ttl=REVOCATION_CACHE_TTL)
+    except Exception as e:
+        current_app.logger.error(f"Could not read revocation of {jti}: {e}")
+        return is_token_revoked_in_database(jti)
+    if revoked is None:
+        revoked = is_token_revoked_in_database(jti)
+        cache_revocation(jti, revoked, jwt_payload["exp"])
+    return revoked
+
+
+def revoke_token(token_jti, user, expires=None):
     """Revokes the given token
 
     Since we use it only on logout that already require a valid access token,
     if token is not found we raise an exception
+
+    Given the token expiry `expires` (epoch seconds), redis is updated
+    before the database so a token still queued for the database is
+    stored revoked, see flush_tokens.
     """
+    queued = False
+    if expires is not None:
+        try:
+            queued = redis_backend.get(revocation_key(token_jti)) is not None
+        except Exception as e:
+            current_app.logger.error(f"Could not read revocation of {token_jti}: {e}")
+        cache_revocation(token_jti, True, expires)
     try:
         token = TokenBlocklist.query.filter_by(jti=token_jti, user_id=user).one()
         token.revoked = True
         db.session.commit()
+        cache_revocation(token_jti, True, token.expires.timestamp())
     except NoResultFound:
-        raise Exception("Could not find the token {}".format(token_jti))
+        if not queued:
+            raise Exception("Could not find the token {}".format(token_jti))
+
+def get_current_user():
+    """
+    The user the request is authenticated as, None without a token.
+    It is read from the database on first use and kept for the rest
+    of the request.
+    """
+    if "user" not in g:
+        identity = get_jwt_identity()
+        if identity is None:
+            return None
+        with timed("auth"):
+            user = User.query.get(identity)
+        if user is None:
+            raise UserLookupError(
+                "user_lookup returned None for {}".format(identity),
+                get_jwt_header(),
+                get_jwt(),
+            )
+        g.user = user
+    return g.user
+
+
+current_user = LocalProxy(get_current_user)
+
+
+def forget_current_user():
+    g.pop("user", None)
+
+
+def is_admin():
+    """
+    Whether the request is authenticated as an admin, from the claim
+    signed in the token. Tokens issued without it are checked against
+    the database.
+    """
+    claims = get_jwt()
+    if not claims:
+        return False
+    if "is_admin" in claims:
+        return claims["is_admin"]
+    return get_current_user().is_admin
+
 
 def admin_only():
     """Raise Error if current user is not admin"""
-    user_id = get_current_user()
-    if user_id:
-        user = User.query.filter_by(id=user_id)
-        if user:
-            if user.is_admin:
-                return True
-    abort(401)
+    if not is_admin():
+        abort(401)
+    return True
+
 
 def admin_required(func):
     """
         Decorator for restricting resource access to admins only.
     """
     def _admin_required(*args, **kwargs):
-        current_user = get_jwt_identity()
-        print("user_id", current_user)
-        user = User.query.get_or_404(current_user)
-        if not user.is_admin:
-            abort(401)
+        admin_only()
         return func(*args, **kwargs)
     return _admin_required
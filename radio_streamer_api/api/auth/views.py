@@ -9,7 +9,9 @@ from flask_jwt_extended import (
 
 from api.models import User
 from api.extensions import pwd_context, jwt, apispec
-from api.auth.helpers import revoke_token, is_token_revoked, add_token_to_database
+from api.auth.helpers import revoke_token, is_token_revoked, register_tokens
+from api.auth.helpers import get_current_user, forget_current_user
+from api.commons.timing import timed
 
 
 blueprint = Blueprint("auth", __name__, url_prefix="/auth")
@@ -68,10 +70,9 @@ def login():
     if user is None or not pwd_context.verify(password, user.password):
         return jsonify({"msg": "Bad credentials"}), 400
 
-    access_token = create_access_token(identity=user.id)
-    refresh_token = create_refresh_token(identity=user.id)
-    add_token_to_database(access_token, app.config["JWT_IDENTITY_CLAIM"])
-    add_token_to_database(refresh_token, app.config["JWT_IDENTITY_CLAIM"])
+    access_token = create_access_token(identity=user)
+    refresh_token = create_refresh_token(identity=user)
+    register_tokens([access_token, refresh_token], app.config["JWT_IDENTITY_CLAIM"])
 
     ret = {"access_token": access_token, "refresh_token": refresh_token}
     return jsonify(ret), 200
@@ -103,10 +104,9 @@ def refresh():
         401:
           description: unauthorized
     """
-    current_user = get_jwt_identity()
-    access_token = create_access_token(identity=current_user)
+    access_token = create_access_token(identity=get_current_user())
     ret = {"access_token": access_token}
-    add_token_to_database(access_token, app.config["JWT_IDENTITY_CLAIM"])
+    register_tokens([access_token], app.config["JWT_IDENTITY_CLAIM"])
     return jsonify(ret), 200
 
 
@@ -136,9 +136,9 @@ def revoke_access_token():
         401:
           description: unauthorized
     """
-    jti = get_jwt()["jti"]
+    token = get_jwt()
     user_identity = get_jwt_identity()
-    revoke_token(jti, user_identity)
+    revoke_token(token["jti"], user_identity, token["exp"])
     return jsonify({"message": "token revoked"}), 200
 
 
@@ -168,23 +168,33 @@ def revoke_refresh_token():
         401:
           description: unauthorized
     """
-    jti = get_jwt()["jti"]
+    token = get_jwt()
     user_identity = get_jwt_identity()
-    revoke_token(jti, user_identity)
+    revoke_token(token["jti"], user_identity, token["exp"])
     return jsonify({"message": "token revoked"}), 200
 
 
-@jwt.user_lookup_loader
-def user_loader_callback(jwt_headers, jwt_payload):
-    identity = jwt_payload["sub"]
-    return User.query.get(identity)
+@jwt.user_identity_loader
+def user_identity_lookup(user):
+    return user.id
+
+
+@jwt.additional_claims_loader
+def add_claims_to_token(user):
+    return {"is_admin": bool(user.is_admin)}
 
 
 @jwt.token_in_blocklist_loader
+@timed("auth")
 def check_if_token_revoked(jwt_headers, jwt_payload):
     return is_token_revoked(jwt_payload)
 
 
+@blueprint.before_app_request
+def reset_current_user():
+    forget_current_user()
+
+
 @blueprint.before_app_first_request
 def register_views():
     apispec.spec.path(view=login, app=app)
@@ -0,0 +1,213 @@
+"""Now playing updates pushed to listeners
+
+Each API worker keeps a single redis subscription to the schedule
+updates of all stations and a copy of the schedule of every station
+listened to around now. A clock thread wakes when a track starts or
+ends and hands the new now playing data to all the listeners waiting
+on that station, so the cost per worker does not grow with listeners.
+Only stations with a schedule get a feed, and it is dropped once its
+last listener leaves.
+"""
+import json
+import logging
+import threading
+import time
+
+from api.commons.redis import redis_backend, station_key
+from api.commons.schedule import CANDIDATES, describe
+from api.config import SCHEDULE_CHANNEL, EVENTS_KEEPALIVE
+
+# Upcoming schedule entries kept per station
+LOOKAHEAD = 50
+
+
+class Feed:
+    def __init__(self, station: str) -> None:
+        """Now playing data of `station` shared by its listeners"""
+        self.station = station
+        # Schedule entries around now, by start time
+        self.entries = []
+        # Whether more entries follow the last one kept
+        self.truncated = False
+        self.current = None
+        self.version = 0
+        # Streams following the feed, counted by the hub
+        self.listeners = 0
+        self.condition = threading.Condition()
+
+    def load(self, backend, at: float):
+        """Read the schedule around `at` from `backend`"""
+        key = station_key("SCHEDULE", self.station)
+        started = backend.schedule_at(key, at, CANDIDATES)
+        upcoming = backend.schedule_after(key, at, LOOKAHEAD)
+        with self.condition:
+            self.entries = started[::-1] + upcoming
+            self.truncated = len(upcoming) == LOOKAHEAD
+        self.update(at)
+
+    def update(self, at: float):
+        """Work out what plays at `at`, waking listeners on a change"""
+        with self.condition:
+            started = [entry for entry in self.entries if entry["start"] <= at]
+            current = describe(started[: -CANDIDATES - 1 : -1], at)
+            if current != self.current:
+                self.current = current
+                self.version += 1
+                self.condition.notify_all()
+
+    def next_change(self, at: float):
+        """Time after `at` a track starts or ends, None when unknown"""
+        with self.condition:
+            times = [entry["start"] for entry in self.entries]
+            times += [
+                entry["start"] + entry["duration"]
+                for entry in self.entries
+                if entry["duration"]
+            ]
+        return min((moment for moment in times if moment > at), default=None)
+
+    def exhausted(self, at: float) -> bool:
+        """Whether entries past the ones kept have to be read"""
+        with self.condition:
+            return self.truncated and self.entries[-1]["start"] <= at
+
+    def wait(self, version: int, timeout: float = None):
+        """Block until the data differs from `version` or `timeout`
+        seconds passed, return (data, version)"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.version != version, timeout)
+            return self.current, self.version
+
+
+class NowPlayingHub:
+    def __init__(self, backend, channel: str) -> None:
+        """Feeds of the stations listened to in this worker, updated
+        from the schedule update announcements on `channel`"""
+        self.backend = backend
+        self.channel = channel
+        self.feeds = {}
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.threads = []
+
+    def start(self):
+        for target in (self.listen, self.clock):
+            thread = threading.Thread(
+                target=target, name=f"now-playing-{target.__name__}", daemon=True
+            )
+            thread.start()
+            self.threads.append(thread)
+
+    def followed(self, station: str):
+        """Feed of `station` with one more listener when there is one,
+        the caller holds the lock"""
+        feed = self.feeds.get(station)
+        if feed is not None:
+            feed.listeners += 1
+        return feed
+
+    def follow(self, station: str = "") -> Feed:
+        """Feed of `station` for one more listener, read from redis on
+        first use. None when nothing was ever scheduled on `station`.
+        Each feed followed is given back with unfollow"""
+        with self.lock:
+            if not self.threads:
+                self.start()
+            feed = self.followed(station)
+        if feed is not None:
+            return feed
+        if not self.backend.has_schedule(station_key("SCHEDULE", station)):
+            return None
+        with self.lock:
+            feed = self.followed(station)
+            if feed is not None:
+                return feed
+            feed = self.feeds[station] = Feed(station)
+            feed.listeners = 1
+        try:
+            feed.load(self.backend, time.time())
+        except Exception:
+            self.unfollow(feed)
+            raise
+        self.wake.set()
+        return feed
+
+    def unfollow(self, feed: Feed):
+        """Remove a listener of `feed`, dropping it with the last one"""
+        with self.lock:
+            feed.listeners -= 1
+            if feed.listeners == 0 and self.feeds.get(feed.station) is feed:
+                del self.feeds[feed.station]
+
+    def reload(self, feeds):
+        for feed in feeds:
+            try:
+                feed.load(self.backend, time.time())
+            except Exception as e:
+                logging.exception(e)
+        self.wake.set()
+
+    def listen(self):
+        """Subscribe to the update channels of all stations,
+        reconnecting on errors"""
+        reconnect = False
+        while True:
+            try:
+                pubsub = self.backend.instance.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                pubsub.psubscribe(station_key(self.channel, "*"))
+                if reconnect:
+                    # Updates may have been missed while disconnected
+                    with self.lock:
+                        feeds = list(self.feeds.values())
+                    self.reload(feeds)
+                reconnect = True
+                for message in pubsub.listen():
+                    channel = message["channel"]
+                    if isinstance(channel, bytes):
+                        channel = channel.decode()
+                    station = channel[: -len(self.channel)].rstrip(":")
+                    feed = self.feeds.get(station)
+                    if feed is not None:
+                        self.reload([feed])
+            except Exception as e:
+                logging.exception(e)
+                time.sleep(1)
+
+    def clock(self):
+        """Update the feeds each time a track starts or ends"""
+        while True:
+            self.wake.clear()
+            now = time.time()
+            with self.lock:
+                feeds = list(self.feeds.values())
+            upcoming = []
+            for feed in feeds:
+                if feed.exhausted(now):
+                    self.reload([feed])
+                feed.update(now)
+                upcoming.append(feed.next_change(now))
+            upcoming = [moment for moment in upcoming if moment is not None]
+            timeout = max(0.0, min(upcoming) - time.time()) if upcoming else None
+            self.wake.wait(timeout)
+
+
+def stream(hub: NowPlayingHub, feed: Feed, keepalive: float = EVENTS_KEEPALIVE):
+    """Server-sent events with the now playing data of `feed`, once
+    on connect and then on every change. Comments are sent every
+    `keepalive` seconds otherwise so closed connections are noticed.
+    The feed is given back to `hub` when the stream is closed"""
+    version = 0
+    try:
+        while True:
+            current, latest = feed.wait(version, keepalive)
+            if latest == version:
+                yield ": keepalive\n\n"
+                continue
+            version = latest
+            yield f"event: now-playing\ndata: {json.dumps(current)}\n\n"
+    finally:
+        hub.unfollow(feed)
+
+
+hub = NowPlayingHub(redis_backend, SCHEDULE_CHANNEL)
@@ -0,0 +1,121 @@
+"""Background processing of uploaded media
+
+Uploaded audio is encoded once to broadcast ready opus renditions,
+so the streamer only downloads and plays them instead of running
+ffmpeg on air.
+"""
+import os
+import subprocess as sp
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+from api.commons import storage
+from api.commons.loudness import measure, gain_for
+from api.config import RENDITION_BITRATES, INGEST_WORKERS
+from api.extensions import db
+from api.models import Media
+
+executor = ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix="ingest")
+
+
+def encode(source, bitrate, gain=0.0):
+    """Encode `source` to opus at `bitrate`, `gain` dB louder,
+    into a temporary file"""
+    fd, path = tempfile.mkstemp(suffix=".opus")
+    os.close(fd)
+    filters = ["-af", f"volume={gain}dB"] if gain else []
+    try:
+        sp.run(
+            ["ffmpeg", "-y", "-i", source, "-vn", *filters, "-c:a", "libopus", "-b:a", bitrate, path],
+            stdout=sp.DEVNULL,
+            stderr=sp.PIPE,
+            check=True,
+        )
+    except Exception:
+        os.remove(path)
+        raise
+    return path
+
+
+def ingest(app, media_id, source, folder=""):
+    """Measure, encode, upload and record the renditions of a media item,
+    to the storage `folder` its source was uploaded to
+
+    The loudness gain is applied while encoding, so renditions
+    are played on air as they are.
+    """
+    with app.app_context():
+        try:
+            media = Media.query.get(media_id)
+            if media is None:
+                return
+            loudness, peak, duration = measure(source)
+            gain = gain_for(loudness, peak)
+            renditions = {}
+            for bitrate in RENDITION_BITRATES:
+                path = encode(source, bitrate, gain)
+                try:
+                    with open(path, "rb") as f:
+                        upload = storage.upload_media(
+                            f, f"{media.title}-{bitrate}", "opus", playlist=folder
+                        )
+                finally:
+                    os.remove(path)
+                renditions[bitrate] = {"id": upload["id"], "url": upload["url"]}
+
+            misc = dict(media.misc or {})
+            old = misc.get("renditions", {})
+            misc["renditions"] = renditions
+            media.misc = misc
+            media.duration = duration
+            media.loudness = loudness
+            media.peak = peak
+            media.gain = gain
+            db.session.commit()
+
+            # Drop renditions of a previous upload of this media
+            for rendition in old.values():
+                try:
+                    storage.delete_media(rendition["id"])
+                except Exception as e:
+                    app.logger.error(e)
+        except Exception as e:
+            db.session.rollback()
+            app.logger.exception(e)
+        finally:
+            os.remove(source)
+
+
+def save_upload(audio):
+    """Copy the uploaded `audio` to a temporary file for ingest"""
+    fd, source = tempfile.mkstemp()
+    with os.fdopen(fd, "wb") as f:
+        audio.save(f)
+    audio.stream.seek(0)
+    return source
+
+
+def schedule_ingest(media, source, folder=""):
+    """Process `source`, the audio of `media` uploaded to `folder`,
+    in the background"""
+    return executor.submit(
+        ingest, current_app._get_current_object(), media.id, source, folder
+    )
+
+
+def on_air_url(media):
+    """Return the url the streamer should play for `media`"""
+    renditions = (media.misc or {}).get("renditions", {})
+    rendition = renditions.get(RENDITION_BITRATES[0])
+    return rendition["url"] if rendition else media.audio_url
+
+
+def on_air_gain(media):
+    """Return the gain (dB) the streamer should apply to `media`,
+    renditions already have it applied"""
+    renditions = (media.misc or {}).get("renditions", {})
+    if RENDITION_BITRATES[0] in renditions:
+        return 0.0
+    return media.gain or 0.0
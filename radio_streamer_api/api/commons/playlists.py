@@ -0,0 +1,152 @@
+"""Playlists of the media catalog and their index
+
+A playlist orders its media through entries addressed by the playlist
+and the title of the media, lookups and reads in order are range
+scans of the indexes on the entries.
+
+The playlists, with the number of songs and the total duration of
+each, are aggregated by the database in one GROUP BY query and kept
+in redis for all the workers. Any committed change to the media or
+the playlists drops the cached index, whether it comes from the API
+or from ingest.
+"""
+import logging
+
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+
+from api.commons.redis import redis_backend
+from api.config import PLAYLISTS_CACHE_TTL
+from api.extensions import db
+from api.models import Media, Playlist, PlaylistEntry
+
+PLAYLISTS_KEY = "PLAYLISTS"
+
+
+def playlist_entries(playlist, title=None):
+    """Query of the entries of `playlist` in order, or of those of
+    `title` when given"""
+    query = PlaylistEntry.query.join(Playlist).filter(Playlist.name == playlist)
+    if title is not None:
+        # Found from the (playlist, title) index, rather than read in
+        # order from the (playlist, position) one
+        return query.filter(PlaylistEntry.title == title)
+    return query.order_by(PlaylistEntry.position)
+
+
+def add_to_playlist(playlist, media):
+    """Add `media` at the end of `playlist`, created when missing"""
+    found = Playlist.query.filter_by(name=playlist).with_for_update().first()
+    if found is None:
+        found = Playlist(name=playlist)
+        db.session.add(found)
+        db.session.flush()
+    last = (
+        db.session.query(func.max(PlaylistEntry.position))
+        .filter(PlaylistEntry.playlist_id == found.id)
+        .scalar()
+    )
+    entry = PlaylistEntry(
+        playlist=found,
+        media=media,
+        position=0 if last is None else last + 1,
+        title=media.title or "",
+    )
+    db.session.add(entry)
+    return entry
+
+
+def remove_entries(entries):
+    """Remove `entries` from their playlists along with the media and
+    playlists left in none or empty, returns the media removed"""
+    removed = {entry.id for entry in entries}
+    media = {entry.media for entry in entries}
+    playlists = {entry.playlist for entry in entries}
+    for entry in entries:
+        db.session.delete(entry)
+    orphans = [
+        item
+        for item in media
+        if all(entry.id in removed for entry in item.entries)
+    ]
+    for item in orphans:
+        db.session.delete(item)
+    for playlist in playlists:
+        if all(entry.id in removed for entry in playlist.entries):
+            db.session.delete(playlist)
+    return orphans
+
+
+def load_playlists():
+    """Playlists as [index, name, songs, duration] in the order they
+    were created, read from the database"""
+    totals = (
+        db.session.query(
+            PlaylistEntry.playlist_id,
+            func.count(PlaylistEntry.id).label("songs"),
+            func.sum(Media.duration).label("duration"),
+        )
+        .join(Media, Media.id == PlaylistEntry.media_id)
+        .group_by(PlaylistEntry.playlist_id)
+        .subquery()
+    )
+    rows = (
+        db.session.query(
+            Playlist.name,
+            func.coalesce(totals.c.songs, 0),
+            func.coalesce(totals.c.duration, 0.0),
+        )
+        .outerjoin(totals, totals.c.playlist_id == Playlist.id)
+        .order_by(Playlist.id)
+        .all()
+    )
+    return [
+        [index, playlist, songs, duration]
+        for index, (playlist, songs, duration) in enumerate(rows)
+    ]
+
+
+def get_playlists():
+    """Playlists from the cached index, rebuilt when missing"""
+    try:
+        playlists = redis_backend.get(PLAYLISTS_KEY)
+    except Exception as e:
+        logging.error(f"Could not read the playlist index: {e}")
+        return load_playlists()
+    if playlists is None:
+        playlists = load_playlists()
+        try:
+            redis_backend.set(PLAYLISTS_KEY, playlists, ex=PLAYLISTS_CACHE_TTL)
+        except Exception as e:
+            logging.error(f"Could not cache the playlist index: {e}")
+    return playlists
+
+
+def forget_playlists():
+    try:
+        with redis_backend.batch() as batch:
+            batch.delete(PLAYLISTS_KEY)
+    except Exception as e:
+        logging.error(f"Could not drop the playlist index: {e}")
+
+
+def media_changed(mapper, connection, target):
+    session = Session.object_session(target)
+    if session is not None:
+        session.info["playlists_changed"] = True
+
+
+for model in (Media, Playlist, PlaylistEntry):
+    for change in ("after_insert", "after_update", "after_delete"):
+        event.listen(model, change, media_changed)
+
+
+@event.listens_for(Session, "after_commit")
+def commit(session):
+    if session.info.pop("playlists_changed", False):
+        forget_playlists()
+
+
+@event.listens_for(Session, "after_rollback")
+def rollback(session):
+    session.info.pop("playlists_changed", None)
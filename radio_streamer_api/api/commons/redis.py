@@ -1,28 +1,282 @@
+"""
+Redis data access shared by the streamer and the API, the
+streamer keeps the same module as common/redis.py. tests/test_redis.py
+at the repository root fails when the two copies differ.
+
+Values are serialized with orjson, several keys or fields are read
+and written in one round trip and reads can be served for a few
+seconds from an in-process cache.
+"""
+import threading
+import time
+from collections import OrderedDict
 from typing import Union, Any
-import json
+
+import orjson
 import redis
-from ..config import REDIS_URL
+from ..config import REDIS_URL, REDIS_POOL_SIZE, REDIS_POOL_TIMEOUT, REDIS_CACHE_SIZE
+
+Key = Union[bytes, str]
+
+
+def dumps(data) -> bytes:
+    return orjson.dumps(data)
+
+
+def loads(data) -> Any:
+    return orjson.loads(data)
+
+
+class Batch:
+    def __init__(self, backend: "Redis", transaction: bool = True) -> None:
+        """
+        Writes queued and sent to redis in one round trip by
+        `execute()`, atomically when `transaction` is set.
+        """
+        self.backend = backend
+        self.pipe = backend.instance.pipeline(transaction=transaction)
+        self.keys = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.execute()
+        else:
+            self.pipe.reset()
+
+    def set(self, key: Key, data, ex: float = None):
+        self.pipe.set(key, dumps(data), ex=ex)
+        self.keys.append(key)
+        return self
+
+    def set_fields(self, key: Key, fields: dict, replace: bool = False):
+        if replace:
+            self.pipe.delete(key)
+        self.pipe.hset(key, mapping={name: dumps(value) for name, value in fields.items()})
+        self.keys.append(key)
+        return self
+
+    def delete(self, *keys: Key):
+        self.pipe.delete(*keys)
+        self.keys.extend(keys)
+        return self
+
+    def publish(self, channel: str, data):
+        self.pipe.publish(channel, dumps(data))
+        return self
+
+    def push(self, key: Key, *data):
+        self.pipe.rpush(key, *[dumps(item) for item in data])
+        return self
+
+    def execute(self) -> list:
+        try:
+            return self.pipe.execute()
+        finally:
+            self.backend.forget(*self.keys)
+            self.keys = []
 
 
 class Redis:
-    def __init__(self, url: str) -> None:
+    def __init__(
+        self,
+        url: str,
+        pool_size: int = REDIS_POOL_SIZE,
+        pool_timeout: float = REDIS_POOL_TIMEOUT,
+        cache_size: int = REDIS_CACHE_SIZE,
+    ) -> None:
         """
         Setup Redis instance
+
+        Connections come from a pool of `pool_size` shared by all
+        threads, waiting up to `pool_timeout` seconds for one when
+        all are in use. Reads given a `ttl` go through a cache of
+        at most `cache_size` values, kept that many seconds.
         """
-        self.instance = redis.from_url(url)
+        self.pool = redis.BlockingConnectionPool.from_url(
+            url, max_connections=pool_size, timeout=pool_timeout
+        )
+        self.instance = redis.Redis(connection_pool=self.pool)
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
 
-    def set(self, key: Union[bytes, str], data, ex: float = None):
+    def cached(self, key: tuple):
+        """
+        Return (True, value) for a cached read not yet expired,
+        (False, None) otherwise.
+        """
+        with self.lock:
+            entry = self.cache.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            return False, None
+        return True, entry[1]
+
+    def remember(self, key: tuple, value, ttl: float):
+        now = time.monotonic()
+        with self.lock:
+            self.cache.pop(key, None)
+            self.cache[key] = (now + ttl, value)
+            # Oldest entries first, as most reads use the same ttl
+            while self.cache and (
+                len(self.cache) > self.cache_size
+                or next(iter(self.cache.values()))[0] < now
+            ):
+                self.cache.popitem(last=False)
+
+    def forget(self, *keys: Key):
+        """
+        Drop cached reads of `keys`, written by this process.
+        """
+        keys = {key.encode() if isinstance(key, str) else key for key in keys}
+        with self.lock:
+            for cached in [cached for cached in self.cache if cached[1] in keys]:
+                del self.cache[cached]
+
+    def batch(self, transaction: bool = True) -> Batch:
+        """
+        Queue writes to send them in one round trip.
+        """
+        return Batch(self, transaction)
+
+    def set(self, key: Key, data, ex: float = None):
         """
         Serialize and store python object in
         redis store.
         """
-        serialized_data = json.dumps(data)
-        self.instance.set(key, serialized_data, ex=ex)
+        self.instance.set(key, dumps(data), ex=ex)
+        self.forget(key)
+
+    def set_many(self, mapping: dict, ex: float = None):
+        """
+        Store several objects in one round trip.
+        """
+        if ex is None:
+            self.instance.mset({key: dumps(data) for key, data in mapping.items()})
+            self.forget(*mapping)
+            return
+        with self.batch(transaction=False) as batch:
+            for key, data in mapping.items():
+                batch.set(key, data, ex=ex)
+
+    def set_fields(self, key: Key, fields: dict, replace: bool = False):
+        """
+        Store objects as the fields of the hash `key`, replacing
+        all its fields when `replace` is set.
+        """
+        with self.batch() as batch:
+            batch.set_fields(key, fields, replace)
+
+    def publish(self, channel: str, data):
+        """
+        Serialize and publish python object
+        to subscribers of `channel`.
+        """
+        self.instance.publish(channel, dumps(data))
+
+    def get(self, key: Key, default=None, ttl: float = None) -> Any:
+        """
+        Return the object stored at `key` or `default`, kept in
+        the process for `ttl` seconds when given.
+        """
+        return self.get_many([key], default, ttl)[0]
+
+    def get_many(self, keys: list, default=None, ttl: float = None) -> list:
+        """
+        Return the objects stored at `keys`, `default` for
+        missing ones, reading them in one round trip.
+        """
+        keys = [key.encode() if isinstance(key, str) else key for key in keys]
+        values = {}
+        if ttl:
+            for key in keys:
+                hit, value = self.cached((b"get", key))
+                if hit:
+                    values[key] = value
+        missing = [key for key in keys if key not in values]
+        if missing:
+            for key, data in zip(missing, self.instance.mget(missing)):
+                values[key] = default if data is None else loads(data)
+                if ttl:
+                    self.remember((b"get", key), values[key], ttl)
+        return [values[key] for key in keys]
+
+    def get_fields(self, key: Key, ttl: float = None) -> dict:
+        """
+        Return the fields of the hash `key` as objects, kept in
+        the process for `ttl` seconds when given.
+        """
+        key = key.encode() if isinstance(key, str) else key
+        if ttl:
+            hit, fields = self.cached((b"fields", key))
+            if hit:
+                return fields
+        fields = {
+            name.decode(): loads(data) for name, data in self.instance.hgetall(key).items()
+        }
+        if ttl:
+            self.remember((b"fields", key), fields, ttl)
+        return fields
+
+    def queued(self, key: Key, count: int = None) -> list:
+        """
+        Return the first `count` objects of the list `key`, all
+        of them by default.
+        """
+        end = -1 if count is None else count - 1
+        return [loads(item) for item in self.instance.lrange(key, 0, end)]
+
+    def dequeue(self, key: Key, count: int):
+        """
+        Drop the first `count` objects of the list `key`.
+        """
+        self.instance.ltrim(key, count, -1)
+
+    def set_schedule(self, key: str, entries: list, since: float, history: float):
+        """
+        Replace the entries of the schedule `key`, a sorted set of
+        serialized entries scored by their start time, from
+        timestamp `since` on with `entries` and drop those older
+        than `history` seconds, in one transaction.
+        """
+        pipe = self.instance.pipeline()
+        pipe.zremrangebyscore(key, since, "+inf")
+        pipe.zremrangebyscore(key, "-inf", since - history)
+        if entries:
+            pipe.zadd(key, {dumps(entry): entry["start"] for entry in entries})
+        pipe.execute()
+
+    def schedule_at(self, key: str, timestamp: float, count: int = 1) -> list:
+        """
+        Return the last `count` entries of the schedule `key`
+        starting at or before `timestamp`, latest first.
+        """
+        entries = self.instance.zrevrangebyscore(key, timestamp, "-inf", start=0, num=count)
+        return [loads(entry) for entry in entries]
+
+    def schedule_after(self, key: str, timestamp: float, count: int = 1) -> list:
+        """
+        Return the first `count` entries of the schedule `key`
+        starting after `timestamp`.
+        """
+        entries = self.instance.zrangebyscore(key, f"({timestamp}", "+inf", start=0, num=count)
+        return [loads(entry) for entry in entries]
+
+    def has_schedule(self, key: str) -> bool:
+        """
+        Whether anything was ever scheduled in `key`.
+        """
+        return bool(self.instance.exists(key))
+
 
-    def get(self, key: Union[bytes, str]) -> Any:
-        serialized_data = self.instance.get(key)
-        data = json.loads(serialized_data)
-        return data
+def station_key(key: str, station: str = "") -> str:
+    """
+    Namespace `key` for `station`, the default
+    station uses the plain key.
+    """
+    return f"{station}:{key}" if station else key
 
 
 redis_backend = Redis(REDIS_URL)
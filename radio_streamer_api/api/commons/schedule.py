@@ -0,0 +1,64 @@
+"""Lookups in the play schedule published by the streamer
+
+Every pass through a playlist the streamer stores the expected start
+time of each song and promotion in a redis sorted set scored by that
+time, so what plays at any moment is a binary search away and nothing
+has to be written as each track starts.
+"""
+import time
+from datetime import datetime, timezone
+
+from api.commons.redis import redis_backend, station_key
+
+# Entries looked at for what plays at a time, a song and the
+# voice-over promotion starting with it
+CANDIDATES = 3
+
+
+def parse_time(value=None) -> float:
+    """Epoch seconds of `value`, given as epoch seconds or an ISO 8601
+    date (UTC unless it has an offset), now when it is empty"""
+    if not value:
+        return time.time()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+
+def playing(entry, at: float) -> bool:
+    """Whether the schedule `entry` is heard at `at`"""
+    return not entry["duration"] or entry["start"] + entry["duration"] > at
+
+
+def describe(entries, at: float) -> dict:
+    """Song and thumbnail heard at `at` from the schedule `entries`
+    starting at or before it, latest first. The thumbnail is the
+    promotion's while one plays"""
+    heard = [entry for entry in entries if playing(entry, at)]
+    song = next((entry for entry in heard if not entry["promotion"]), None)
+    # Voice-over promotions start with the song they are played over
+    shown = next((entry for entry in heard if entry["promotion"]), song)
+    return {
+        "song_name": song["title"] if song else None,
+        "thumbnail": shown["thumbnail"] if shown else None,
+        "playlist": song["playlist"] if song else None,
+        "started_at": song["start"] if song else None,
+    }
+
+
+def now_playing(station: str = "", at: float = None) -> dict:
+    """Song and thumbnail heard on `station` at `at`"""
+    at = time.time() if at is None else at
+    entries = redis_backend.schedule_at(station_key("SCHEDULE", station), at, CANDIDATES)
+    return describe(entries, at)
+
+
+def up_next(station: str = "", at: float = None, count: int = 5) -> list:
+    """Next `count` songs and promotions scheduled on `station` after `at`"""
+    at = time.time() if at is None else at
+    return redis_backend.schedule_after(station_key("SCHEDULE", station), at, count)
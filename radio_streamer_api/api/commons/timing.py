@@ -0,0 +1,49 @@
+"""Per-request timings sent back in the Server-Timing header
+
+Time spent in parts of a request, such as authentication, is added
+up under a name and reported with the total time of the request, so
+it shows in the browser developer tools and in any proxy logging the
+header.
+"""
+import time
+from contextlib import contextmanager
+
+from flask import g
+
+
+def start():
+    g.timings = {}
+    g.started = time.perf_counter()
+
+
+def record(name, seconds):
+    """Add `seconds` to the time spent in `name` by this request"""
+    timings = g.setdefault("timings", {})
+    timings[name] = timings.get(name, 0.0) + seconds
+
+
+@contextmanager
+def timed(name):
+    """Record the time spent in the block, or decorated function, as `name`"""
+    began = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - began)
+
+
+def server_timing(response):
+    timings = g.pop("timings", {})
+    started = g.pop("started", None)
+    if started is not None:
+        timings["total"] = time.perf_counter() - started
+    if timings:
+        response.headers["Server-Timing"] = ", ".join(
+            f"{name};dur={seconds * 1000:.3f}" for name, seconds in timings.items()
+        )
+    return response
+
+
+def init_app(app):
+    app.before_request(start)
+    app.after_request(server_timing)
@@ -6,10 +6,45 @@ import os
 from datetime import timedelta
 
 REDIS_URL = "redis://redis:6379"
+# Redis connections shared by the threads of a worker
+REDIS_POOL_SIZE = 32
+# Seconds to wait for a free connection when all are in use
+REDIS_POOL_TIMEOUT = 5.0
+# Most values kept by the in-process redis read cache
+REDIS_CACHE_SIZE = 10000
 STORAGE_URL = ""
 ENV = os.getenv("FLASK_ENV")
 DEBUG = ENV == "development"
 SECRET_KEY = os.getenv("SECRET_KEY") or str(os.urandom(30))
 JWT_ACCESS_TOKEN_EXPIRES = timedelta(days=3)
+# Seconds a worker keeps the revocation state of a token
+REVOCATION_CACHE_TTL = 5
+# Seconds between writes of newly issued tokens to the database, with
+# 0 they are written while logging in
+TOKEN_FLUSH_INTERVAL = 1.0
+# Most tokens written to the database in one transaction
+TOKEN_FLUSH_BATCH = 500
 SQLALCHEMY_DATABASE_URI = "postgresql://postgres:postgres@db:5432/radio_api"
 SQLALCHEMY_TRACK_MODIFICATIONS = False
+PLAYLIST_CHANNEL = "CURRENT_PLAY_CHANGED"
+# Pub/sub channel the streamer announces schedule updates on
+SCHEDULE_CHANNEL = "SCHEDULE_CHANGED"
+# Seconds between keep-alive comments on now playing event streams
+EVENTS_KEEPALIVE = 15
+# URL of the process serving the now playing event streams with
+# gevent workers. Set on the API workers, streams are redirected there
+# rather than each holding one of their threads.
+EVENTS_URL = os.getenv("EVENTS_URL", "")
+# Most upcoming entries returned by the up next endpoint
+MAX_UP_NEXT = 50
+# Seconds the playlist index is cached, it is also dropped on changes
+PLAYLISTS_CACHE_TTL = 3600
+
+# Opus bitrates encoded at upload, the first one is played on air and
+# matches the STREAM_BITRATE of the streamer, which encodes it again
+RENDITION_BITRATES = ["64K", "40K"]
+INGEST_WORKERS = 2
+# Integrated loudness (LUFS) media is normalized to at ingest
+LOUDNESS_TARGET = -16.0
+# Highest sample peak (dBFS) allowed after applying the gain
+PEAK_CEILING = -1.0
@@ -1,5 +1,5 @@
-from api.models.models import User, Media
+from api.models.models import User, Media, Playlist, PlaylistEntry
 from api.models.blocklist import TokenBlocklist
 
 
-__all__ = ["User", "TokenBlocklist", "Media"]
+__all__ = ["User", "TokenBlocklist", "Media", "Playlist", "PlaylistEntry"]
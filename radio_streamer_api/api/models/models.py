@@ -27,11 +27,67 @@ class Media(db.Model):
     __tablename__ = 'media'
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(20))
-    playlist = db.Column(db.String(20))
     thumbnail_image_url = db.Column(db.String(255))
     audio_url = db.Column(db.String(255))
     misc = db.Column(db.PickleType, default=dict())
     setter_id = db.Column(db.Integer)
+    # Set by ingest once the audio has been encoded
+    duration = db.Column(db.Float)
+    # Integrated loudness (LUFS), sample peak (dBFS) and the gain (dB)
+    # normalizing it, measured at ingest
+    loudness = db.Column(db.Float)
+    peak = db.Column(db.Float)
+    gain = db.Column(db.Float)
+
+    entries = db.relationship(
+        "PlaylistEntry", back_populates="media", cascade="all, delete-orphan"
+    )
+
+    def __repr__(self):
+        return 'Id: {}, Title: {}'.format(self.id, self.title)
+
+
+class Playlist(db.Model):
+    """Named list of media played in order"""
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(20), unique=True, nullable=False)
+
+    entries = db.relationship(
+        "PlaylistEntry",
+        back_populates="playlist",
+        order_by="PlaylistEntry.position",
+        cascade="all, delete-orphan",
+    )
+
+    def __repr__(self):
+        return "<Playlist %s>" % self.name
+
+
+class PlaylistEntry(db.Model):
+    """Media at `position` in a playlist, a media can be in several"""
+
+    id = db.Column(db.Integer, primary_key=True)
+    playlist_id = db.Column(
+        db.Integer, db.ForeignKey("playlist.id", ondelete="CASCADE"), nullable=False
+    )
+    media_id = db.Column(
+        db.Integer, db.ForeignKey("media.id", ondelete="CASCADE"), nullable=False
+    )
+    position = db.Column(db.Integer, nullable=False)
+    # Title of the media, kept here so a track is found by playlist
+    # and title from the index
+    title = db.Column(db.String(20), nullable=False)
+
+    playlist = db.relationship("Playlist", back_populates="entries")
+    media = db.relationship("Media", back_populates="entries", lazy="joined")
+
+    __table_args__ = (
+        db.Index("ix_playlist_entry_playlist_title", "playlist_id", "title"),
+        db.Index(
+            "ix_playlist_entry_playlist_position", "playlist_id", "position", unique=True
+        ),
+    )
 
     def __repr__(self):
-        return 'Id: {}, Title: {}'.format(self.id, self.title)
\ No newline at end of file
+        return "<PlaylistEntry %s %s>" % (self.position, self.title)
\ No newline at end of file
@@ -0,0 +1,140 @@
+"""
+Benchmark of authenticated requests.
+
+Sends requests carrying an access token to an endpoint behind
+jwt_required and reports the requests per second when the revocation
+state of the token is read from the database on every request, as
+before, and from redis through the cache kept in the worker. Then
+logs in repeatedly with the issued tokens written to the database
+while logging in and queued for the token writer. Runs
+against a sqlite database and fakeredis, or the redis at --redis-url,
+with a simulated round trip time added to every database query and
+redis command.
+
+    python -m benchmarks.auth --requests 2000 --logins 100 --rtt 0.0005
+"""
+import argparse
+import json
+import os
+import time
+
+import redis
+from sqlalchemy import event
+
+from api.app import create_app
+from api.auth import views
+from api.auth import helpers
+from api.auth.helpers import is_token_revoked, is_token_revoked_in_database
+from api.commons.redis import redis_backend
+from api.extensions import db
+from api.models import User
+
+
+class RoundTrips:
+    def __init__(self, rtt: float) -> None:
+        """
+        Count the database queries and redis commands sent and
+        delay each one by `rtt` seconds.
+        """
+        self.rtt = rtt
+        self.count = 0
+        send = redis.connection.Connection.send_packed_command
+
+        def _send(connection, command, check_health=True):
+            self.trip()
+            return send(connection, command, check_health)
+
+        redis.connection.Connection.send_packed_command = _send
+
+    def trip(self, *args):
+        self.count += 1
+        if self.rtt:
+            time.sleep(self.rtt)
+
+
+def measure(client, path: str, headers: dict, requests: int, trips: RoundTrips) -> dict:
+    assert client.get(path, headers=headers).status_code == 200
+    before = trips.count
+    began = time.perf_counter()
+    for _ in range(requests):
+        client.get(path, headers=headers)
+    elapsed = time.perf_counter() - began
+    return {
+        "requests_per_second": requests / elapsed,
+        "round_trips": (trips.count - before) / requests,
+    }
+
+
+def measure_login(client, credentials: dict, logins: int, trips: RoundTrips) -> dict:
+    before = trips.count
+    began = time.perf_counter()
+    for _ in range(logins):
+        assert client.post("/auth/login", json=credentials).status_code == 200
+    elapsed = time.perf_counter() - began
+    return {
+        "logins_per_second": logins / elapsed,
+        "round_trips": (trips.count - before) / logins,
+    }
+
+
+def run(args) -> dict:
+    if args.redis_url:
+        redis_backend.instance = redis.from_url(args.redis_url)
+    else:
+        import fakeredis
+
+        redis_backend.instance = fakeredis.FakeRedis()
+    app = create_app(testing=True)
+    trips = RoundTrips(args.rtt)
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute", trips.trip)
+        admin = User.query.filter_by(is_admin=True).first()
+        path = f"/api/v1/users/{admin.id}"
+    client = app.test_client()
+    credentials = {
+        "email": os.environ.get("ADMIN_EMAIL") or "admin@admin.com",
+        "password": os.environ.get("ADMIN_PASS") or "admin",
+    }
+    # Queued tokens are flushed below, not by the background writer
+    helpers.writer.start = lambda app: None
+    resp = client.post("/auth/login", json=credentials)
+    headers = {"authorization": f"Bearer {resp.get_json()['access_token']}"}
+    with app.app_context():
+        helpers.flush_tokens()
+
+    results = {"config": vars(args)}
+    for name, check in (
+        ("database", lambda payload: is_token_revoked_in_database(payload["jti"])),
+        ("redis", is_token_revoked),
+    ):
+        views.is_token_revoked = check
+        results[name] = measure(client, path, headers, args.requests, trips)
+    views.is_token_revoked = is_token_revoked
+
+    results["login"] = {}
+    for name, interval in (("database", 0), ("queued", 1.0)):
+        app.config["TOKEN_FLUSH_INTERVAL"] = interval
+        results["login"][name] = measure_login(client, credentials, args.logins, trips)
+    with app.app_context():
+        began = time.perf_counter()
+        flushed = helpers.flush_tokens()
+        results["login"]["queued"]["flush_per_token_us"] = (
+            (time.perf_counter() - began) / max(flushed, 1) * 1e6
+        )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--logins", type=int, default=100)
+    parser.add_argument(
+        "--rtt", type=float, default=0.0, help="seconds added per round trip"
+    )
+    parser.add_argument("--redis-url", help="use this redis instead of fakeredis")
+    args = parser.parse_args()
+    print(json.dumps(run(args), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Benchmark of listing the playlists.
+
+Fills the catalog with --media media spread over --playlists
+playlists and reports the milliseconds to list the playlists with the
+GROUP BY query of the playlist index and from the index cached in
+redis, to read a playlist in order and to find a title in it, along
+with the query plans of the reads. Runs against a sqlite database and
+fakeredis, or the redis at --redis-url.
+
+    python -m benchmarks.playlists --media 100000 --playlists 200
+"""
+import argparse
+import json
+import random
+import time
+
+import redis
+
+from api.app import create_app
+from api.commons.playlists import get_playlists, load_playlists, playlist_entries
+from api.commons.redis import redis_backend
+from api.extensions import db
+from api.models import Media, Playlist, PlaylistEntry
+
+
+def plan(query) -> list:
+    """
+    Steps sqlite takes to run `query`.
+    """
+    statement = query.statement.compile(db.engine, compile_kwargs={"literal_binds": True})
+    rows = db.session.execute(db.text(f"EXPLAIN QUERY PLAN {statement}"))
+    return [row[-1] for row in rows]
+
+
+def measure(function, iterations: int) -> dict:
+    function()
+    began = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return {"ms": (time.perf_counter() - began) / iterations * 1000}
+
+
+def run(args) -> dict:
+    if args.redis_url:
+        redis_backend.instance = redis.from_url(args.redis_url)
+    else:
+        import fakeredis
+
+        redis_backend.instance = fakeredis.FakeRedis()
+    app = create_app(testing=True)
+    results = {"config": vars(args)}
+    with app.app_context():
+        # The sqlite database of the tests
+        db.drop_all()
+        db.create_all()
+        db.session.bulk_insert_mappings(
+            Playlist, [{"id": i + 1, "name": f"playlist {i}"} for i in range(args.playlists)]
+        )
+        db.session.bulk_insert_mappings(
+            Media,
+            [
+                {"id": i + 1, "title": f"song {i}", "duration": random.uniform(120, 400)}
+                for i in range(args.media)
+            ],
+        )
+        positions = [0] * args.playlists
+        entries = []
+        for i in range(args.media):
+            playlist = random.randrange(args.playlists)
+            entries.append(
+                {
+                    "playlist_id": playlist + 1,
+                    "media_id": i + 1,
+                    "position": positions[playlist],
+                    "title": f"song {i}",
+                }
+            )
+            positions[playlist] += 1
+        db.session.bulk_insert_mappings(PlaylistEntry, entries)
+        db.session.commit()
+        assert sum(p[2] for p in load_playlists()) == args.media
+
+        title = entries[-1]["title"]
+        playlist = f"playlist {entries[-1]['playlist_id'] - 1}"
+        results["group_by"] = measure(load_playlists, args.iterations)
+        results["cached"] = measure(get_playlists, args.iterations)
+        results["read_playlist"] = measure(
+            lambda: playlist_entries(playlist).all(), args.iterations
+        )
+        results["find_title"] = measure(
+            lambda: playlist_entries(playlist, title).all(), args.iterations
+        )
+        results["plans"] = {
+            "read_playlist": plan(playlist_entries(playlist)),
+            "find_title": plan(playlist_entries(playlist, title)),
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--media", type=int, default=100000)
+    parser.add_argument("--playlists", type=int, default=200)
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--redis-url", help="use this redis instead of fakeredis")
+    args = parser.parse_args()
+    print(json.dumps(run(args), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""initial schema
+
+Databases set up before migrations were added already have these
+tables, created by db.create_all(), maybe without the media columns
+added since. Only what is missing is created.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18 18:53:19.389215
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+# Measured at ingest, added to media after its first release
+MEDIA_MEASUREMENTS = ('duration', 'loudness', 'peak', 'gain')
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    tables = inspector.get_table_names()
+    if 'media' not in tables:
+        op.create_table('media',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('title', sa.String(length=20), nullable=True),
+        sa.Column('playlist', sa.String(length=20), nullable=True),
+        sa.Column('thumbnail_image_url', sa.String(length=255), nullable=True),
+        sa.Column('audio_url', sa.String(length=255), nullable=True),
+        sa.Column('misc', sa.PickleType(), nullable=True),
+        sa.Column('setter_id', sa.Integer(), nullable=True),
+        sa.Column('duration', sa.Float(), nullable=True),
+        sa.Column('loudness', sa.Float(), nullable=True),
+        sa.Column('peak', sa.Float(), nullable=True),
+        sa.Column('gain', sa.Float(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+        )
+    else:
+        columns = {column['name'] for column in inspector.get_columns('media')}
+        for name in MEDIA_MEASUREMENTS:
+            if name not in columns:
+                op.add_column('media', sa.Column(name, sa.Float(), nullable=True))
+    if 'user' not in tables:
+        op.create_table('user',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('email', sa.String(length=80), nullable=False),
+        sa.Column('is_admin', sa.Boolean(), nullable=True),
+        sa.Column('password', sa.String(length=255), nullable=False),
+        sa.Column('active', sa.Boolean(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('email')
+        )
+    if 'token_blocklist' not in tables:
+        op.create_table('token_blocklist',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('jti', sa.String(length=36), nullable=False),
+        sa.Column('token_type', sa.String(length=10), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('revoked', sa.Boolean(), nullable=False),
+        sa.Column('expires', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('jti')
+        )
+
+
+def downgrade():
+    op.drop_table('token_blocklist')
+    op.drop_table('user')
+    op.drop_table('media')
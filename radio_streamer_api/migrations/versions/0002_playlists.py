@@ -0,0 +1,74 @@
+"""playlists
+
+Moves the playlist of each media to a playlist table and an ordered
+membership table, so a media can be in several playlists and playlist
+reads are index range scans. Media keep their order in a playlist by
+id. Downgrading keeps a single playlist per media, the one it was
+first added to.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 18:53:43.763676
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('playlist',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=20), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+    op.create_table('playlist_entry',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('playlist_id', sa.Integer(), nullable=False),
+    sa.Column('media_id', sa.Integer(), nullable=False),
+    sa.Column('position', sa.Integer(), nullable=False),
+    sa.Column('title', sa.String(length=20), nullable=False),
+    sa.ForeignKeyConstraint(['media_id'], ['media.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['playlist_id'], ['playlist.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.execute(
+        "INSERT INTO playlist (name) "
+        "SELECT playlist FROM media WHERE playlist IS NOT NULL "
+        "GROUP BY playlist ORDER BY min(id)"
+    )
+    op.execute(
+        "INSERT INTO playlist_entry (playlist_id, media_id, position, title) "
+        "SELECT playlist.id, media.id, "
+        "ROW_NUMBER() OVER (PARTITION BY playlist.id ORDER BY media.id) - 1, "
+        "COALESCE(media.title, '') "
+        "FROM media JOIN playlist ON playlist.name = media.playlist"
+    )
+    # Built once the rows are in
+    op.create_index('ix_playlist_entry_playlist_position', 'playlist_entry', ['playlist_id', 'position'], unique=True)
+    op.create_index('ix_playlist_entry_playlist_title', 'playlist_entry', ['playlist_id', 'title'], unique=False)
+    with op.batch_alter_table('media') as batch_op:
+        batch_op.drop_column('playlist')
+
+
+def downgrade():
+    with op.batch_alter_table('media') as batch_op:
+        batch_op.add_column(sa.Column('playlist', sa.VARCHAR(length=20), nullable=True))
+    op.execute(
+        "UPDATE media SET playlist = ("
+        "SELECT playlist.name FROM playlist_entry "
+        "JOIN playlist ON playlist.id = playlist_entry.playlist_id "
+        "WHERE playlist_entry.media_id = media.id "
+        "ORDER BY playlist_entry.id LIMIT 1)"
+    )
+    op.drop_index('ix_playlist_entry_playlist_title', table_name='playlist_entry')
+    op.drop_index('ix_playlist_entry_playlist_position', table_name='playlist_entry')
+    op.drop_table('playlist_entry')
+    op.drop_table('playlist')
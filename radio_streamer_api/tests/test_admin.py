@@ -1,8 +1,17 @@
+import shutil
+import subprocess
 from io import BytesIO
 
 import pytest
 from flask import url_for
 
+from api.commons import ingest
+from api.api.resources import admin
+from api.commons.playlists import PLAYLISTS_KEY, add_to_playlist, playlist_entries
+from api.commons.redis import redis_backend
+from api.config import LOUDNESS_TARGET
+from api.models import Media, Playlist
+
 plist = "test"
 song = "test_song"
 
@@ -72,6 +81,75 @@ def test_get_plists(client, admin_headers, create_plist):
     data = resp.get_json()["playlists"]
     assert resp.status_code == 200 and plist in data[0]
 
+def test_plists_index(client, db, admin_headers, monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    monkeypatch.setattr(redis_backend, "instance", fakeredis.FakeRedis())
+    for title, playlist, duration in [
+        ("a", "rock", 100.0), ("b", "jazz", None), ("c", "rock", 20.5)
+    ]:
+        add_to_playlist(playlist, Media(title=title, duration=duration))
+    db.session.commit()
+    play_url = url_for('api.playlists')
+
+    resp = client.get(play_url, headers=admin_headers)
+    assert resp.get_json()["playlists"] == [[0, "rock", 2, 120.5], [1, "jazz", 1, 0.0]]
+    assert redis_backend.get(PLAYLISTS_KEY) is not None
+
+    # Writes drop the cached index
+    add_to_playlist("jazz", Media(title="d", duration=60.0))
+    db.session.commit()
+    assert redis_backend.get(PLAYLISTS_KEY) is None
+    resp = client.get(play_url, headers=admin_headers)
+    assert resp.get_json()["playlists"][1] == [1, "jazz", 2, 60.0]
+
+def test_plist_membership(client, db, admin_headers):
+    playlist_url = url_for('api.playlist')
+    for title in ("a", "b"):
+        client.post(playlist_url, headers=admin_headers, json={
+            "playlist": "rock",
+            "title": title,
+            "audio_url": "https://wwww.test.com/music.mp3",
+            "thumbnail_image_url": "https://wwww.test.com/music.jpg"
+        })
+    media = playlist_entries("rock", "a").one().media
+    add_to_playlist("jazz", media)
+    db.session.commit()
+
+    resp = client.get(url_for('api.playlist', playlist="rock"), headers=admin_headers)
+    results = resp.get_json()["results"]
+    assert [(r["title"], r["position"]) for r in results] == [("a", 0), ("b", 1)]
+    assert results[0]["id"] == media.id
+
+    # Removed from one playlist, kept in the other
+    resp = client.delete(url_for('api.playlist', playlist="rock", title="a"),
+                         headers=admin_headers)
+    assert resp.status_code == 200
+    assert Media.query.count() == 2
+    resp = client.get(url_for('api.playlist', playlist="rock"), headers=admin_headers)
+    assert [r["title"] for r in resp.get_json()["results"]] == ["b"]
+
+    resp = client.delete(url_for('api.playlist', playlist="jazz", title="*"),
+                         headers=admin_headers)
+    assert resp.status_code == 200
+    assert Media.query.count() == 1
+    assert Playlist.query.filter_by(name="jazz").first() is None
+
+def test_delete_shared_media(client, db, admin_headers, monkeypatch):
+    deleted = []
+    monkeypatch.setattr(admin.storage, "delete_media", deleted.append)
+    media = Media(title=song, misc={"aud_id": "aud", "thumb_id": "thumb"})
+    add_to_playlist(plist, media)
+    add_to_playlist("other", media)
+    db.session.commit()
+
+    media_url = url_for('api.media', title=song, playlist="other")
+    assert client.delete(media_url, headers=admin_headers).status_code == 200
+    assert deleted == [] and Media.query.count() == 1
+    media_url = url_for('api.media', title=song, playlist=plist)
+    assert client.delete(media_url, headers=admin_headers).status_code == 200
+    assert deleted == ["aud", "thumb"] and Media.query.count() == 0
+    assert client.delete(media_url, headers=admin_headers).status_code == 404
+
 # MEDIA RESOURCE TESTS
 
 @pytest.fixture
@@ -131,3 +209,39 @@ def test_get_media(client, create_media, admin_headers):
     media_url = url_for('api.media')
     resp = client.get(media_url, headers=admin_headers)
     assert resp.status_code == 400
+
+# INGEST TESTS
+
+@pytest.mark.skipif(not shutil.which("ffmpeg"), reason="ffmpeg not installed")
+def test_ingest_renditions(app, db, monkeypatch, tmp_path):
+    uploads = []
+
+    def upload_media(file_object, name, extension="mp3", playlist=""):
+        uploads.append((name, extension, file_object.read(8)))
+        return {"id": name, "name": name, "url": f"https://test.com/{name}.{extension}"}
+
+    monkeypatch.setattr(ingest.storage, "upload_media", upload_media)
+    source = tmp_path / "source.wav"
+    subprocess.run(
+        ["ffmpeg", "-v", "error", "-f", "lavfi", "-i", "sine=d=2", str(source)],
+        check=True,
+    )
+    media = Media(title=song, audio_url="https://test.com/raw.wav")
+    db.session.add(media)
+    db.session.commit()
+    media_id = media.id
+
+    ingest.ingest(app, media_id, str(source), plist)
+
+    media = Media.query.get(media_id)
+    assert not source.exists()
+    assert [u[:2] for u in uploads] == [
+        (f"{song}-{bitrate}", "opus") for bitrate in ingest.RENDITION_BITRATES
+    ]
+    assert all(data.startswith(b"OggS") for _, _, data in uploads)
+    assert abs(media.duration - 2) < 0.1
+    assert ingest.on_air_url(media) == f"https://test.com/{song}-64K.opus"
+    # Normalized to the target loudness, renditions carry the gain
+    assert abs(media.loudness + media.gain - LOUDNESS_TARGET) < 0.1
+    assert media.peak < 0
+    assert ingest.on_air_gain(media) == 0.0
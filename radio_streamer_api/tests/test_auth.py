@@ -1,3 +1,18 @@
+import json
+import time
+from collections import OrderedDict
+
+import pytest
+from flask_jwt_extended import decode_token
+from sqlalchemy import event
+
+from api.auth import helpers
+from api.auth.helpers import revocation_key, flush_tokens, TOKEN_QUEUE
+from api.auth.helpers import TOKEN_FLUSH_LOCK
+from api.commons.redis import redis_backend
+from api.models import TokenBlocklist, User
+
+
 def test_revoke_access_token(client, admin_headers):
     resp = client.delete("/auth/revoke_access", headers=admin_headers)
     assert resp.status_code == 200
@@ -12,3 +27,181 @@ def test_revoke_refresh_token(client, admin_refresh_headers):
 
     resp = client.post("/auth/refresh", headers=admin_refresh_headers)
     assert resp.status_code == 401
+
+
+@pytest.fixture
+def revocations(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    monkeypatch.setattr(redis_backend, "instance", fakeredis.FakeRedis())
+    monkeypatch.setattr(redis_backend, "cache", OrderedDict())
+    monkeypatch.setattr(helpers.writer, "start", lambda app: None)
+    return redis_backend
+
+
+def login(client, user):
+    resp = client.post(
+        "/auth/login",
+        data=json.dumps({"email": user.email, "password": "admin"}),
+        headers={"content-type": "application/json"},
+    )
+    tokens = resp.get_json()
+    return {
+        "content-type": "application/json",
+        "authorization": "Bearer %s" % tokens["access_token"],
+    }, decode_token(tokens["access_token"])
+
+
+def test_revocation_cached(client, db, admin_user, revocations):
+    headers, token = login(client, admin_user)
+    key = revocation_key(token["jti"])
+    assert revocations.get(key) is False
+    assert abs(revocations.instance.ttl(key) - (token["exp"] - time.time())) <= 2
+    flush_tokens()
+
+    # Answered from redis without the database
+    TokenBlocklist.query.filter_by(jti=token["jti"]).delete()
+    db.session.commit()
+    resp = client.get("/api/v1/users/%d" % admin_user.id, headers=headers)
+    assert resp.status_code == 200
+
+
+def test_revoke_cached_token(client, db, admin_user, revocations):
+    headers, token = login(client, admin_user)
+    resp = client.get("/api/v1/users/%d" % admin_user.id, headers=headers)
+    assert resp.status_code == 200
+
+    resp = client.delete("/auth/revoke_access", headers=headers)
+    assert resp.status_code == 200
+    assert revocations.get(revocation_key(token["jti"])) is True
+    resp = client.get("/api/v1/users/%d" % admin_user.id, headers=headers)
+    assert resp.status_code == 401
+
+
+def test_revocation_backfilled(client, db, admin_user, revocations):
+    headers, token = login(client, admin_user)
+    flush_tokens()
+    revocations.instance.flushall()
+    revocations.cache.clear()
+
+    resp = client.get("/api/v1/users/%d" % admin_user.id, headers=headers)
+    assert resp.status_code == 200
+    assert revocations.get(revocation_key(token["jti"])) is False
+
+
+def test_admin_claim(client, db, admin_user, revocations):
+    headers, token = login(client, admin_user)
+    assert token["is_admin"] is True
+
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", record)
+    try:
+        resp = client.get("/api/v1/playlist/none", headers=headers)
+    finally:
+        event.remove(db.engine, "before_cursor_execute", record)
+    assert resp.status_code == 200
+    assert not [statement for statement in statements if "user" in statement]
+    assert "auth;dur=" in resp.headers["Server-Timing"]
+
+
+def test_admin_claim_required(client, db, revocations):
+    user = User(email="user@user.com", password="admin")
+    db.session.add(user)
+    db.session.commit()
+    headers, token = login(client, user)
+    assert token["is_admin"] is False
+
+    resp = client.get("/api/v1/playlist/none", headers=headers)
+    assert resp.status_code == 401
+
+
+def test_tokens_queued(client, db, admin_user, revocations):
+    headers, token = login(client, admin_user)
+    assert len(revocations.queued(TOKEN_QUEUE, 10)) == 2
+    assert not TokenBlocklist.query.filter_by(jti=token["jti"]).count()
+    resp = client.get("/api/v1/users/%d" % admin_user.id, headers=headers)
+    assert resp.status_code == 200
+
+    assert flush_tokens() == 2
+    assert revocations.queued(TOKEN_QUEUE, 10) == []
+    assert TokenBlocklist.query.filter_by(user_id=admin_user.id).count() == 2
+    assert flush_tokens() == 0
+    assert not revocations.instance.exists(TOKEN_FLUSH_LOCK)
+
+
+def test_flush_lock_taken_over(client, db, admin_user, revocations, monkeypatch):
+    login(client, admin_user)
+    queued = revocations.queued
+
+    def expire(*args):
+        # The flush outlives its lock, taken by another writer
+        revocations.instance.set(TOKEN_FLUSH_LOCK, "other")
+        return queued(*args)
+
+    monkeypatch.setattr(revocations, "queued", expire)
+    assert flush_tokens() == 2
+    assert revocations.instance.get(TOKEN_FLUSH_LOCK) == b"other"
+    assert flush_tokens() == 0
+
+
+def test_revoke_queued_token(client, db, admin_user, revocations):
+    headers, token = login(client, admin_user)
+    resp = client.delete("/auth/revoke_access", headers=headers)
+    assert resp.status_code == 200
+    resp = client.get("/api/v1/users/%d" % admin_user.id, headers=headers)
+    assert resp.status_code == 401
+
+    flush_tokens()
+    assert TokenBlocklist.query.filter_by(jti=token["jti"]).one().revoked
+
+
+def delete_user(client, db, headers, user):
+    admin = User(email="other@admin.com", password="admin", is_admin=True)
+    db.session.add(admin)
+    db.session.commit()
+    admin_headers, _ = login(client, admin)
+    resp = client.delete("/api/v1/users/%d" % user.id, headers=admin_headers)
+    assert resp.status_code == 200
+
+
+def test_deleted_user_token(client, db, admin_user):
+    headers, token = login(client, admin_user)
+    resp = client.get("/api/v1/playlists", headers=headers)
+    assert resp.status_code == 200
+
+    delete_user(client, db, headers, admin_user)
+    assert not TokenBlocklist.query.filter_by(jti=token["jti"]).count()
+    resp = client.get("/api/v1/playlists", headers=headers)
+    assert resp.status_code == 401
+
+
+def test_deleted_user_queued_token(client, db, admin_user, revocations):
+    headers, token = login(client, admin_user)
+    resp = client.get("/api/v1/playlists", headers=headers)
+    assert resp.status_code == 200
+
+    delete_user(client, db, headers, admin_user)
+    assert revocations.get(revocation_key(token["jti"])) is True
+    resp = client.get("/api/v1/playlists", headers=headers)
+    assert resp.status_code == 401
+
+    # Dropped from the queue rather than written for a missing user
+    flush_tokens()
+    assert revocations.queued(TOKEN_QUEUE) == []
+    assert not TokenBlocklist.query.filter_by(jti=token["jti"]).count()
+
+
+def test_demoted_user_token(client, db, admin_user, revocations):
+    headers, token = login(client, admin_user)
+    flush_tokens()
+    resp = client.get("/api/v1/playlist/none", headers=headers)
+    assert resp.status_code == 200
+
+    admin_user.is_admin = False
+    db.session.commit()
+    resp = client.get("/api/v1/playlist/none", headers=headers)
+    assert resp.status_code == 401
+    assert TokenBlocklist.query.filter_by(jti=token["jti"]).one().revoked
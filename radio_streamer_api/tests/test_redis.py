@@ -0,0 +1,55 @@
+import pytest
+
+from api.commons.redis import Redis
+
+
+@pytest.fixture
+def backend():
+    fakeredis = pytest.importorskip("fakeredis")
+    backend = Redis("redis://localhost")
+    backend.instance = fakeredis.FakeRedis()
+    return backend
+
+def test_get_many(backend):
+    backend.set_many({"a": {"x": 1}, "b": [1, 2]})
+    assert backend.get_many(["a", "missing", "b"], default="") == [{"x": 1}, "", [1, 2]]
+    assert backend.get("missing") is None
+
+def test_fields(backend):
+    backend.set_fields("play", {"playlist": "pl", "songs": [["s", "url"]]})
+    backend.set_fields("play", {"playlist": "other"}, replace=True)
+    assert backend.get_fields("play") == {"playlist": "other"}
+
+def test_batch(backend):
+    pubsub = backend.instance.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe("changed")
+    with backend.batch() as batch:
+        batch.set("a", 1).set_fields("play", {"playlist": "pl"}).publish("changed", "pl")
+    assert backend.get("a") == 1
+    assert backend.get_fields("play") == {"playlist": "pl"}
+    messages = [pubsub.get_message(timeout=0.1) for _ in range(3)]
+    assert [m["data"] for m in messages if m] == [b'"pl"']
+
+def test_cached_reads(backend):
+    backend.set("a", 1)
+    assert backend.get("a", ttl=60) == 1
+    # Written by another process, the cached value is still served
+    backend.instance.set("a", b"2")
+    assert backend.get("a", ttl=60) == 1
+    assert backend.get("a") == 2
+    # Writes through the backend drop the cached value
+    backend.set("a", 3)
+    assert backend.get("a", ttl=60) == 3
+
+def test_cache_size(backend):
+    backend.cache_size = 2
+    for key in ("a", "b", "c"):
+        backend.get(key, ttl=60)
+    assert len(backend.cache) == 2
+
+def test_queue(backend):
+    with backend.batch() as batch:
+        batch.push("queue", {"a": 1}, {"b": 2}).push("queue", 3)
+    assert backend.queued("queue", 2) == [{"a": 1}, {"b": 2}]
+    backend.dequeue("queue", 2)
+    assert backend.queued("queue", 10) == [3]
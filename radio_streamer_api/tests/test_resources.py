@@ -1,3 +1,5 @@
+import json
+import time
 import pytest
 from flask import url_for
 
@@ -49,3 +51,100 @@ def test_delete_user(client, admin_user, admin_headers, user):
     # Check that user no longer exists
     u = User.query.get(uid)
     assert u == None
+
+
+@pytest.fixture
+def schedule(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    from api.commons.redis import redis_backend
+
+    monkeypatch.setattr(redis_backend, "instance", fakeredis.FakeRedis())
+    entries = [
+        {"start": 1000.0, "duration": 200.0, "title": "first", "thumbnail": "t1",
+         "playlist": "pl", "promotion": False},
+        {"start": 1198.0, "duration": 30.0, "title": "ad", "thumbnail": "ad-thumb",
+         "playlist": "promotions", "promotion": True},
+        {"start": 1198.0, "duration": 180.0, "title": "second", "thumbnail": "t2",
+         "playlist": "pl", "promotion": False},
+        {"start": 1376.0, "duration": 100.0, "title": "third", "thumbnail": "t3",
+         "playlist": "pl", "promotion": False},
+    ]
+    redis_backend.instance.zadd(
+        "studio:SCHEDULE", {json.dumps(entry): entry["start"] for entry in entries}
+    )
+    return entries
+
+def test_current_play_schedule(client, schedule):
+    url = url_for('api.current_play', station="studio", at=1100)
+    resp = client.get(url)
+    assert resp.status_code == 200
+    assert resp.get_json()["song_name"] == "first"
+    assert resp.get_json()["thumbnail"] == "t1"
+
+    # Voice-over promotion shows its thumbnail over the song
+    resp = client.get(url_for('api.current_play', station="studio", at=1200))
+    assert resp.get_json()["song_name"] == "second"
+    assert resp.get_json()["thumbnail"] == "ad-thumb"
+    assert resp.get_json()["started_at"] == 1198.0
+
+    resp = client.get(url_for('api.current_play', station="studio", at=1250))
+    assert resp.get_json()["thumbnail"] == "t2"
+
+    resp = client.get(url_for('api.current_play', station="studio", at=2000))
+    assert resp.get_json()["song_name"] is None
+
+    resp = client.get(url_for('api.current_play', station="studio", at="yesterday"))
+    assert resp.status_code == 400
+
+def test_up_next(client, schedule):
+    resp = client.get(url_for('api.up_next', station="studio", at=1100, count=2))
+    assert resp.status_code == 200
+    upcoming = resp.get_json()["upcoming"]
+    assert [entry["start"] for entry in upcoming] == [1198.0, 1198.0]
+
+    resp = client.get(url_for('api.up_next', station="studio", at="1970-01-01T00:21:00"))
+    assert [entry["title"] for entry in resp.get_json()["upcoming"]] == ["third"]
+
+    resp = client.get(url_for('api.up_next', station="studio", count=0))
+    assert resp.status_code == 400
+
+def test_current_play_events(client, monkeypatch, schedule):
+    from api.commons import events
+    from api.commons.redis import redis_backend
+
+    hub = events.NowPlayingHub(redis_backend, "SCHEDULE_CHANGED")
+    monkeypatch.setattr(events, "hub", hub)
+    now = time.time()
+    song = {"start": now - 10, "duration": 60.0, "title": "live", "thumbnail": "t-live",
+            "playlist": "pl", "promotion": False}
+    redis_backend.instance.zadd("studio:SCHEDULE", {json.dumps(song): song["start"]})
+
+    resp = client.get(url_for('api.current_play_events', station="studio"), buffered=False)
+    assert resp.status_code == 200
+    assert resp.mimetype == "text/event-stream"
+    stream = iter(resp.response)
+    event = next(stream).decode()
+    assert event.startswith("event: now-playing\n")
+    assert json.loads(event.split("data: ")[1])["song_name"] == "live"
+
+    # The next song starts shortly and is pushed when it does
+    following = dict(song, start=now + 0.5, title="next", thumbnail="t-next")
+    redis_backend.instance.zadd("studio:SCHEDULE", {json.dumps(following): following["start"]})
+    redis_backend.instance.publish("studio:SCHEDULE_CHANGED", json.dumps(following["start"]))
+    event = next(stream).decode()
+    assert json.loads(event.split("data: ")[1])["song_name"] == "next"
+    assert time.time() >= following["start"]
+    assert hub.feeds["studio"].listeners == 1
+    resp.close()
+    # Dropped with its last listener
+    assert "studio" not in hub.feeds
+
+    resp = client.get(url_for('api.current_play_events', station="nowhere"))
+    assert resp.status_code == 404
+    assert "nowhere" not in hub.feeds
+
+def test_current_play_events_redirected(client, app, monkeypatch):
+    monkeypatch.setitem(app.config, "EVENTS_URL", "http://events:8001/api/v1/current-play/events")
+    resp = client.get(url_for('api.current_play_events', station="studio"))
+    assert resp.status_code == 307
+    assert resp.headers["Location"] == "http://events:8001/api/v1/current-play/events?station=studio"
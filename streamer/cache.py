@@ -0,0 +1,366 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from streamer.client import HttpClient
+from streamer.metrics import CACHE_REQUESTS, DOWNLOAD_SECONDS
+from streamer.opus import is_opus
+
+
+def url_key(url: str) -> str:
+    return hashlib.sha1(url.encode()).hexdigest()
+
+
+class MediaCache:
+    def __init__(
+        self,
+        directory: str,
+        max_bytes: int,
+        revalidate_after: float,
+        chunk_size: int = 65536,
+        client: HttpClient = None,
+        save_interval: float = 5.0,
+    ) -> None:
+        """
+        Content addressed cache of transcoded media.
+
+        Encoded files are stored as `<sha256 of source>.opus` so the
+        same audio referenced from several urls or playlists is kept
+        once. Urls are mapped to their content together with the
+        validators (ETag/Last-Modified) used to revalidate them once
+        `revalidate_after` seconds have passed. Sources that already
+        are Ogg Opus, like the renditions made at ingest, are stored
+        as downloaded without transcoding, unless a loudness gain
+        has to be applied to them. Least recently used
+        files are evicted to keep the cache under `max_bytes`.
+
+        Downloads go through `client`, a shared HttpClient, straight
+        to disk so memory use does not depend on the size of the media.
+
+        The index is written in the background at most every
+        `save_interval` seconds once it changed. Files handed out by
+        fetch are pinned, never evicted, until given back with unpin.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.revalidate_after = revalidate_after
+        self.chunk_size = chunk_size
+        self.client = client or HttpClient(chunk_size=chunk_size)
+        self.index_path = os.path.join(directory, "index.json")
+        self.save_interval = save_interval
+        self.lock = threading.Lock()
+        # Held while writing the index, set when it has to be written
+        self.saving = threading.Lock()
+        self.changed = threading.Event()
+        # url key -> {"url", "content", "etag", "last_modified", "checked"}
+        self.urls = {}
+        # content hash -> {"size", "atime"}, least recently used first
+        self.entries = OrderedDict()
+        # url key -> fetch in progress, joined by other callers
+        self.fetching = {}
+        # content hash -> files handed out and not yet unpinned
+        self.pins = {}
+        self.load()
+        threading.Thread(target=self.keep_saved, name="cache-index", daemon=True).start()
+
+    def path(self, content: str) -> str:
+        return os.path.join(self.directory, f"{content}.opus")
+
+    @property
+    def size(self) -> int:
+        return sum(entry["size"] for entry in self.entries.values())
+
+    def load(self):
+        """
+        Recover the index from disk, reconciling it with the
+        files actually present in the cache directory.
+        """
+        try:
+            with open(self.index_path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {"urls": {}, "entries": {}}
+        present = {}
+        for item in os.scandir(self.directory):
+            name, ext = os.path.splitext(item.name)
+            if ext in (".src", ".tmp"):
+                # Leftovers of an interrupted download or transcode
+                os.remove(item.path)
+            elif ext == ".opus" and item.is_file():
+                stat = item.stat()
+                present[name] = {"size": stat.st_size, "atime": stat.st_mtime}
+        for content, entry in data["entries"].items():
+            if content in present:
+                present[content]["atime"] = entry["atime"]
+        self.entries = OrderedDict(
+            sorted(present.items(), key=lambda item: item[1]["atime"])
+        )
+        self.urls = {
+            key: meta
+            for key, meta in data["urls"].items()
+            if meta["content"] in self.entries
+        }
+        logging.debug(
+            f"Loaded cache index: {len(self.entries)} files, {self.size} bytes."
+        )
+
+    def save(self):
+        """
+        Write the index atomically.
+        """
+        with self.saving:
+            with self.lock:
+                self.changed.clear()
+                data = json.dumps({"urls": self.urls, "entries": self.entries})
+            tmp = f"{self.index_path}.tmp"
+            try:
+                with open(tmp, "w") as f:
+                    f.write(data)
+                os.replace(tmp, self.index_path)
+            except OSError as e:
+                logging.error(f"Could not save cache index: {e}")
+
+    def keep_saved(self):
+        """
+        Save the index a while after it changed, so a burst of
+        lookups writes it once.
+        """
+        while True:
+            self.changed.wait()
+            time.sleep(self.save_interval)
+            self.save()
+
+    def pin(self, content: str, count: int = 1):
+        """
+        Keep `content` from being evicted, must be called with the
+        lock held.
+        """
+        self.pins[content] = self.pins.get(content, 0) + count
+
+    def unpin(self, path: str):
+        """
+        Give back a file returned by fetch, it may be evicted once
+        no other caller holds it.
+        """
+        content = os.path.splitext(os.path.basename(path))[0]
+        with self.lock:
+            self.release(content)
+
+    def release(self, content: str):
+        """
+        Drop a pin of `content`, must be called with the lock held.
+        """
+        count = self.pins.get(content, 0) - 1
+        if count > 0:
+            self.pins[content] = count
+        else:
+            self.pins.pop(content, None)
+
+    def touch(self, content: str):
+        """
+        Mark `content` as most recently used.
+        """
+        self.entries[content]["atime"] = time.time()
+        self.entries.move_to_end(content)
+
+    def evict(self):
+        """
+        Remove least recently used files until the cache fits
+        its budget, never removing pinned files.
+        """
+        total = self.size
+        for content in list(self.entries):
+            if total <= self.max_bytes:
+                break
+            if content in self.pins:
+                continue
+            entry = self.entries.pop(content)
+            total -= entry["size"]
+            logging.debug(f"Evicting {content} from cache.")
+            try:
+                os.remove(self.path(content))
+            except OSError:
+                pass
+        self.urls = {
+            key: meta
+            for key, meta in self.urls.items()
+            if meta["content"] in self.entries
+        }
+
+    def download(self, url: str, headers: dict):
+        """
+        Download `url` to a temporary file and hash it. Returns the
+        first response, the content hash and the file path, the
+        last two None when `headers` matched and nothing changed.
+        """
+        fd, source = tempfile.mkstemp(suffix=".src", dir=self.directory)
+        os.close(fd)
+        try:
+            resp = self.client.download(url, source, headers)
+            if resp.status_code == 304:
+                os.remove(source)
+                return resp, None, None
+            digest = hashlib.sha256()
+            with open(source, "rb") as f:
+                for chunk in iter(lambda: f.read(self.chunk_size), b""):
+                    digest.update(chunk)
+        except Exception:
+            os.remove(source)
+            raise
+        return resp, digest.hexdigest(), source
+
+    def fetch(self, url: str, transcode, priority: int = 0, gain: float = 0.0) -> str:
+        """
+        Return the cached encoded file for `url` played `gain` dB
+        louder, downloading and calling `transcode(content, source,
+        destination, priority, gain=gain)`, which returns a future,
+        only when the content is unknown or has changed upstream. The
+        file is pinned for the caller, who unpins it once done with it.
+
+        Fetches of a url already being fetched join it rather than
+        downloading it again, raising the priority of its transcode
+        when they are more urgent.
+        """
+        # The same audio at another gain is another file
+        key = url_key(f"{url} {gain:+.1f}dB" if gain else url)
+        with self.lock:
+            meta = self.urls.get(key)
+            if meta and meta["content"] in self.entries:
+                if time.time() - meta["checked"] < self.revalidate_after:
+                    CACHE_REQUESTS.inc(result="hit")
+                    self.touch(meta["content"])
+                    self.pin(meta["content"])
+                    self.changed.set()
+                    return self.path(meta["content"])
+            else:
+                meta = None
+            flight = self.fetching.get(key)
+            if flight is None:
+                if meta:
+                    # Kept while revalidating, refresh releases it
+                    self.pin(meta["content"])
+                flight = self.fetching[key] = {
+                    "future": Future(),
+                    "priority": priority,
+                    "transcode": None,
+                    "callers": 1,
+                }
+                leading = True
+            else:
+                leading = False
+                flight["callers"] += 1
+                if priority < flight["priority"]:
+                    flight["priority"] = priority
+                    if flight["transcode"] is not None:
+                        job, content, source = flight["transcode"]
+                        if not job.done():
+                            # Joined by the transcoder, queued ahead
+                            transcode(content, source, self.path(content), priority, gain=gain)
+
+        if not leading:
+            CACHE_REQUESTS.inc(result="joined")
+            return flight["future"].result()
+        try:
+            path = self.refresh(key, url, meta, transcode, flight, gain)
+        except Exception as e:
+            flight["future"].set_exception(e)
+            raise
+        else:
+            flight["future"].set_result(path)
+            return path
+        finally:
+            with self.lock:
+                del self.fetching[key]
+
+    def refresh(self, key: str, url: str, meta: dict, transcode, flight: dict, gain: float) -> str:
+        """
+        Download `url`, revalidating `meta` when known, and store its
+        encoded content under `key`, for the fetch `flight`. The
+        content of `meta`, pinned by the caller, and content found
+        already cached are kept from eviction meanwhile.
+        """
+        # Contents kept from eviction until stored
+        pinned = [meta["content"]] if meta else []
+        try:
+            return self.store(key, url, meta, transcode, flight, gain, pinned)
+        finally:
+            with self.lock:
+                for content in pinned:
+                    self.release(content)
+
+    def store(self, key, url, meta, transcode, flight, gain, pinned) -> str:
+        """
+        Work of refresh, adding the contents it pins to `pinned`.
+        """
+        headers = {}
+        if meta:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+
+        started = time.monotonic()
+        try:
+            resp, content, source = self.download(url, headers)
+        except Exception as e:
+            logging.error(f"Could not download media: {e}")
+            raise
+
+        if resp.status_code == 304:
+            logging.debug(f"{url} not modified.")
+            CACHE_REQUESTS.inc(result="revalidated")
+            content = meta["content"]
+            etag = resp.headers.get("ETag", meta.get("etag"))
+            last_modified = resp.headers.get(
+                "Last-Modified", meta.get("last_modified")
+            )
+        else:
+            etag = resp.headers.get("ETag")
+            last_modified = resp.headers.get("Last-Modified")
+            CACHE_REQUESTS.inc(result="miss")
+            DOWNLOAD_SECONDS.observe(time.monotonic() - started)
+            if gain:
+                content = f"{content}{gain:+.1f}dB"
+            try:
+                with self.lock:
+                    known = content in self.entries
+                    if known:
+                        self.pin(content)
+                        pinned.append(content)
+                if not known and not gain and is_opus(source):
+                    logging.debug(f"{url} is ready to air.")
+                    os.replace(source, self.path(content))
+                elif not known:
+                    with self.lock:
+                        job = transcode(
+                            content, source, self.path(content), flight["priority"], gain=gain
+                        )
+                        flight["transcode"] = (job, content, source)
+                    job.result()
+            finally:
+                if os.path.exists(source):
+                    os.remove(source)
+
+        with self.lock:
+            if content not in self.entries:
+                size = os.path.getsize(self.path(content))
+                self.entries[content] = {"size": size, "atime": time.time()}
+            self.urls[key] = {
+                "url": url,
+                "content": content,
+                "etag": etag,
+                "last_modified": last_modified,
+                "checked": time.time(),
+            }
+            self.touch(content)
+            # Pinned for every caller of the fetch before any eviction
+            self.pin(content, flight["callers"])
+            self.evict()
+            self.changed.set()
+        return self.path(content)
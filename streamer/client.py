@@ -0,0 +1,207 @@
+import logging
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Failures worth retrying, a stalled or cut transfer included
+TRANSIENT = (
+    requests.ConnectionError,
+    requests.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+)
+
+
+class HttpClient:
+    def __init__(
+        self,
+        pool_size: int = 10,
+        timeout=(5.0, 30.0),
+        retries: int = 5,
+        backoff: float = 0.5,
+        backoff_max: float = 30.0,
+        range_min_bytes: int = 8 * 1024 * 1024,
+        range_parts: int = 4,
+        chunk_size: int = 65536,
+    ) -> None:
+        """
+        Shared HTTP client for media downloads.
+
+        Connections are kept alive in a pool of `pool_size` per host
+        so fetches skip the TCP and TLS handshakes, every request has
+        a (connect, read) `timeout` and failures are retried up to
+        `retries` times with jittered exponential backoff starting
+        at `backoff` seconds.
+
+        Files of at least `range_min_bytes` on servers accepting
+        ranges are fetched as `range_parts` parallel byte ranges, and
+        a transfer cut short resumes from the last byte written.
+        """
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.range_min_bytes = range_min_bytes
+        self.range_parts = range_parts
+        self.chunk_size = chunk_size
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(
+            max_workers=pool_size, thread_name_prefix="http-range"
+        )
+
+    def delay(self, attempt: int) -> float:
+        """
+        Seconds to wait before retry `attempt`, "full jitter" so
+        stations retrying together do not hit the origin at once.
+        """
+        return random.uniform(0, min(self.backoff_max, self.backoff * 2**attempt))
+
+    def retry(self, attempt: int, url: str, error):
+        """
+        Sleep before the next attempt or raise `error` after the last.
+        """
+        if attempt + 1 >= self.retries:
+            raise error
+        delay = self.delay(attempt)
+        logging.warning(f"GET {url} failed ({error}), retrying in {delay:.2f}s.")
+        time.sleep(delay)
+
+    def get(self, url: str, headers: dict = None) -> requests.Response:
+        """
+        Streamed GET of `url`, retrying connection errors, timeouts
+        and 5xx or 429 responses. Other responses are returned as is.
+        """
+        for attempt in range(self.retries):
+            try:
+                resp = self.session.get(
+                    url, headers=headers, stream=True, timeout=self.timeout
+                )
+            except TRANSIENT as e:
+                self.retry(attempt, url, e)
+                continue
+            if resp.status_code < 500 and resp.status_code != 429:
+                return resp
+            resp.close()
+            self.retry(
+                attempt,
+                url,
+                requests.HTTPError(f"{resp.status_code} {resp.reason}", response=resp),
+            )
+
+    def download(self, url: str, path: str, headers: dict = None) -> requests.Response:
+        """
+        Download `url` into the file at `path`. Returns the response
+        to the first request, closed, which is a 304 with nothing
+        written when `headers` made the request conditional.
+        """
+        resp = self.get(url, headers)
+        if resp.status_code == 304:
+            resp.close()
+            return resp
+        resp.raise_for_status()
+
+        size = int(resp.headers.get("Content-Length") or 0)
+        # Ranges of an encoded body would not line up with the file
+        resumable = "Content-Encoding" not in resp.headers
+        etag = resp.headers.get("ETag")
+        validator = etag if etag and not etag.startswith("W/") else None
+        validator = validator or resp.headers.get("Last-Modified")
+        if (
+            resumable
+            and size >= self.range_min_bytes
+            and resp.headers.get("Accept-Ranges") == "bytes"
+        ):
+            resp.close()
+            self.download_ranges(url, path, size, validator)
+        else:
+            self.download_stream(url, path, resp, validator if resumable else None)
+        return resp
+
+    def download_stream(self, url: str, path: str, resp, validator: str = None):
+        """
+        Write the body of `resp` to `path`, resuming from the last
+        byte written with a ranged request when the transfer is cut.
+        Without a `validator` it starts over instead.
+        """
+        written = 0
+        with open(path, "wb") as f:
+            for attempt in range(self.retries):
+                size = written + int(resp.headers.get("Content-Length") or 0)
+                try:
+                    with resp:
+                        for chunk in resp.iter_content(self.chunk_size):
+                            f.write(chunk)
+                            written += len(chunk)
+                    if written >= size or "Content-Encoding" in resp.headers:
+                        return
+                    # Connection closed before the whole body was sent
+                    raise requests.exceptions.ChunkedEncodingError("body cut short")
+                except TRANSIENT as e:
+                    self.retry(attempt, url, e)
+                headers = {}
+                if validator and written:
+                    headers = {"Range": f"bytes={written}-", "If-Range": validator}
+                    logging.debug(f"Resuming {url} at {written} bytes.")
+                resp = self.get(url, headers)
+                resp.raise_for_status()
+                if resp.status_code != 206:
+                    # Full body, either not resumable or changed upstream
+                    f.seek(0)
+                    f.truncate()
+                    written = 0
+
+    def download_ranges(self, url: str, path: str, size: int, validator: str = None):
+        """
+        Download the `size` bytes of `url` to `path` as parallel
+        byte ranges written in place.
+        """
+        with open(path, "wb") as f:
+            f.truncate(size)
+        part = -(-size // self.range_parts)
+        futures = [
+            self.executor.submit(
+                self.download_range, url, path, start, min(start + part, size) - 1, validator
+            )
+            for start in range(0, size, part)
+        ]
+        for future in futures:
+            future.result()
+
+    def download_range(self, url: str, path: str, start: int, end: int, validator: str = None):
+        """
+        Write bytes `start` to `end` (inclusive) of `url` at the same
+        offsets of `path`, resuming after the last byte written.
+        """
+        offset = start
+        fd = os.open(path, os.O_WRONLY)
+        try:
+            for attempt in range(self.retries):
+                headers = {"Range": f"bytes={offset}-{end}"}
+                if validator:
+                    headers["If-Range"] = validator
+                try:
+                    with self.get(url, headers) as resp:
+                        resp.raise_for_status()
+                        if resp.status_code != 206:
+                            raise requests.HTTPError(
+                                f"{url} changed during a ranged download", response=resp
+                            )
+                        for chunk in resp.iter_content(self.chunk_size):
+                            os.pwrite(fd, chunk, offset)
+                            offset += len(chunk)
+                except TRANSIENT as e:
+                    self.retry(attempt, url, e)
+                    continue
+                if offset > end:
+                    return
+                self.retry(
+                    attempt, url, requests.exceptions.ChunkedEncodingError("range cut short")
+                )
+        finally:
+            os.close(fd)
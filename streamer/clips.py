@@ -0,0 +1,167 @@
+import logging
+import mmap
+import os
+import subprocess as sp
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from streamer.metrics import CLIP_REQUESTS
+from streamer.mixer import Track, RATE, CHANNELS, decode_command
+
+
+class Clip:
+    def __init__(self, filename: str, pcm: np.ndarray) -> None:
+        """
+        Track playing audio already decoded to `pcm`, every read
+        is a view of it so playing allocates and copies nothing.
+        """
+        self.filename = filename
+        self.pcm = pcm
+        self.duration = len(pcm) / RATE
+        self.read_frames = 0
+        self.done = False
+
+    def __repr__(self):
+        return f"<Clip {self.filename}>"
+
+    @property
+    def remaining(self) -> float:
+        if self.done:
+            return 0.0
+        return (len(self.pcm) - self.read_frames) / RATE
+
+    def read(self, frames: int) -> np.ndarray:
+        samples = self.pcm[self.read_frames : self.read_frames + frames]
+        self.read_frames += len(samples)
+        if self.read_frames >= len(self.pcm):
+            self.done = True
+        return samples
+
+    def close(self):
+        self.done = True
+
+
+def map_pcm(path: str) -> np.ndarray:
+    """
+    Memory map a float32 PCM file read-only as frames.
+    """
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    mapped.madvise(mmap.MADV_WILLNEED)
+    return np.frombuffer(mapped, dtype="<f4").reshape(-1, CHANNELS)
+
+
+class ClipCache:
+    def __init__(
+        self, directory: str, max_bytes: int, max_seconds: float, min_plays: int = 2
+    ) -> None:
+        """
+        Decoded audio of the short files played over and over, such
+        as promotions and jingles.
+
+        Once a file of at most `max_seconds` has been played
+        `min_plays` times it is decoded in the background to
+        `directory` and memory mapped, later plays read from the
+        page cache instead of running a decoder. Least recently
+        played clips are dropped to keep under `max_bytes`, a clip
+        still playing stays mapped until it ends.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.min_plays = min_plays
+        os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        # Name of the encoded file -> [pcm path, mapped frames, size]
+        self.clips = OrderedDict()
+        self.plays = {}
+        self.pending = set()
+        self.size = 0
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="clips")
+        self.load()
+
+    def load(self):
+        """
+        Pick up clips decoded before a restart, mapped when played.
+        """
+        found = []
+        for item in os.scandir(self.directory):
+            if item.name.endswith(".tmp"):
+                os.remove(item.path)
+            elif item.name.endswith(".f32") and item.is_file():
+                stat = item.stat()
+                found.append((stat.st_mtime, item.name[:-4], item.path, stat.st_size))
+        with self.lock:
+            for _, name, path, size in sorted(found):
+                self.clips[name] = [path, None, size]
+                self.size += size
+            self.evict()
+
+    def evict(self):
+        """
+        Drop clips over the budget, must be called with the lock held.
+        """
+        while self.size > self.max_bytes and len(self.clips) > 1:
+            name, (path, _, size) = self.clips.popitem(last=False)
+            self.size -= size
+            try:
+                os.remove(path)
+            except OSError as e:
+                logging.error(f"Could not remove clip {name}: {e}")
+
+    def track(self, filename: str, duration: float = None):
+        """
+        Return a track playing `filename`, from memory when it is a
+        cached clip and decoding it otherwise.
+        """
+        name = os.path.basename(filename)
+        if not duration or duration > self.max_seconds:
+            return Track(filename, duration)
+        with self.lock:
+            entry = self.clips.get(name)
+            if entry is not None:
+                self.clips.move_to_end(name)
+        if entry is not None:
+            try:
+                if entry[1] is None:
+                    entry[1] = map_pcm(entry[0])
+                CLIP_REQUESTS.inc(result="hit")
+                return Clip(filename, entry[1])
+            except (OSError, ValueError) as e:
+                logging.error(f"Could not map clip {name}: {e}")
+        CLIP_REQUESTS.inc(result="miss")
+        with self.lock:
+            self.plays[name] = self.plays.get(name, 0) + 1
+            if self.plays[name] >= self.min_plays and name not in self.pending:
+                self.pending.add(name)
+                self.executor.submit(self.decode, filename, name)
+        return Track(filename, duration)
+
+    def decode(self, filename: str, name: str):
+        """
+        Decode `filename` to a PCM file and map it.
+        """
+        path = os.path.join(self.directory, f"{name}.f32")
+        tmp = f"{path}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                sp.run(decode_command(filename), stdout=f, stderr=sp.DEVNULL, check=True)
+            os.replace(tmp, path)
+            pcm = map_pcm(path)
+            with self.lock:
+                if name not in self.clips:
+                    self.clips[name] = [path, pcm, pcm.nbytes]
+                    self.size += pcm.nbytes
+                    self.evict()
+                self.plays.pop(name, None)
+            logging.debug(f"Cached clip {name}, {pcm.nbytes} bytes.")
+        except (OSError, ValueError, sp.CalledProcessError) as e:
+            logging.error(f"Could not cache clip {name}: {e}")
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        finally:
+            with self.lock:
+                self.pending.discard(name)
@@ -0,0 +1,56 @@
+import logging
+import threading
+import time
+
+from common.redis import loads
+
+
+class PlaylistWatcher:
+    def __init__(self, backend, channel: str) -> None:
+        """
+        Listen in the background for playlist change events
+        published by the API on `channel`.
+
+        `changed` is set when a playlist other than the one on air
+        is announced, the listener blocks on the socket so nothing
+        runs while no change happens.
+        """
+        self.backend = backend
+        self.channel = channel
+        self.changed = threading.Event()
+        # Monotonic time of the last announced change
+        self.announced = None
+        self.playing = None
+        self.thread = threading.Thread(
+            target=self.listen, name="playlist-watcher", daemon=True
+        )
+        self.thread.start()
+
+    def listen(self):
+        """
+        Subscribe to the change channel, reconnecting on errors.
+        """
+        reconnect = False
+        while True:
+            try:
+                pubsub = self.backend.instance.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                if reconnect:
+                    # Changes may have been missed while disconnected
+                    self.changed.set()
+                reconnect = True
+                for message in pubsub.listen():
+                    playlist = loads(message["data"])
+                    logging.debug(f"Playlist {playlist} announced.")
+                    if playlist != self.playing:
+                        self.announced = time.monotonic()
+                        self.changed.set()
+            except Exception as e:
+                logging.exception(e)
+                time.sleep(1)
+
+    def wait(self, timeout: float = None) -> bool:
+        """
+        Block until a change is announced.
+        """
+        return self.changed.wait(timeout)
@@ -0,0 +1,211 @@
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Seconds, from a fast cache read to a slow transcode
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _labels(names, values) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for name, value in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), registry=None) -> None:
+        """
+        A metric in the Prometheus text format, one value per
+        combination of `labelnames` values.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+        (registry or REGISTRY).register(self)
+
+    def key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def samples(self):
+        """
+        Yield (suffix, label names, label values, value).
+        """
+        with self.lock:
+            items = list(self.values.items())
+        for key, value in items:
+            yield "", self.labelnames, key, value
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        for suffix, names, values, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_labels(names, values)} {float(value)!r}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=BUCKETS, registry=None):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self.key(labels)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observe the seconds spent in the `with` block.
+        """
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - started, **labels)
+
+    def samples(self):
+        with self.lock:
+            items = [(key, (list(counts), total)) for key, (counts, total) in self.values.items()]
+        names = self.labelnames + ("le",)
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield "_bucket", names, key + (repr(float(bound)),), cumulative
+            cumulative += counts[-1]
+            yield "_bucket", names, key + ("+Inf",), cumulative
+            yield "_count", self.labelnames, key, cumulative
+            yield "_sum", self.labelnames, key, total
+
+
+class Collector(Metric):
+    def __init__(self, name, documentation, type, collect, labelnames=(), registry=None):
+        """
+        Metric read at scrape time: `collect()` returns a list of
+        (label values, value), e.g. counters kept by stations.
+        """
+        self.type = type
+        self.collect = collect
+        super().__init__(name, documentation, labelnames, registry)
+
+    def samples(self):
+        for key, value in self.collect():
+            yield "", self.labelnames, tuple(key), value
+
+
+class Registry:
+    def __init__(self) -> None:
+        self.metrics = []
+
+    def register(self, metric: Metric):
+        self.metrics.append(metric)
+
+    def render(self) -> str:
+        parts = []
+        for metric in self.metrics:
+            try:
+                parts.append(metric.render())
+            except Exception as e:
+                logging.exception(e)
+        return "\n".join(parts) + "\n"
+
+
+REGISTRY = Registry()
+
+DOWNLOAD_SECONDS = Histogram(
+    "streamer_download_seconds", "Time to download a media file from its origin."
+)
+CACHE_REQUESTS = Counter(
+    "streamer_cache_requests_total",
+    "Media cache lookups by result: hit, revalidated (304), miss or joined"
+    " (a fetch of the same url in progress).",
+    ["result"],
+)
+CLIP_REQUESTS = Counter(
+    "streamer_clip_cache_requests_total",
+    "Plays of short clips by whether their decoded audio was cached: hit or miss.",
+    ["result"],
+)
+TRANSCODE_SECONDS = Histogram(
+    "streamer_transcode_seconds", "Time spent running a transcode job."
+)
+TRANSCODE_WAIT_SECONDS = Histogram(
+    "streamer_transcode_wait_seconds", "Time a transcode job waited in the queue."
+)
+PROBE_SECONDS = Histogram(
+    "streamer_probe_seconds", "Time to read the duration of an encoded file."
+)
+PIPE_WRITE_SECONDS = Histogram(
+    "streamer_pipe_write_seconds",
+    "Time to write a block of audio to an encoder pipe.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+SWITCH_SECONDS = Histogram(
+    "streamer_playlist_switch_seconds",
+    "Time from a playlist change announcement to the new playlist being heard.",
+    ["station"],
+)
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes every few seconds would flood the log
+        pass
+
+
+def serve(port: int, host: str = "") -> ThreadingHTTPServer:
+    """
+    Serve the metrics on `port` from a background thread.
+    """
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logging.info(f"Serving metrics on port {port}.")
+    return server
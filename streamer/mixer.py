@@ -0,0 +1,281 @@
+import logging
+import subprocess as sp
+
+import numpy as np
+
+RATE = 48000
+CHANNELS = 2
+# Bytes of one float32 frame
+FRAME_BYTES = CHANNELS * 4
+
+
+def decode_command(filename: str) -> list:
+    """
+    ffmpeg command decoding `filename` to float32 PCM on stdout.
+    """
+    return [
+        "ffmpeg",
+        "-v",
+        "error",
+        "-i",
+        filename,
+        "-f",
+        "f32le",
+        "-ac",
+        str(CHANNELS),
+        "-ar",
+        str(RATE),
+        "-",
+    ]
+
+
+class Track:
+    def __init__(self, filename: str, duration: float = None) -> None:
+        """
+        Decoded audio of a prepared file, read as float32 PCM at
+        RATE with CHANNELS channels from an ffmpeg decoder.
+
+        `duration` (seconds), when known, tells how much is left
+        before the end so the next track can be started in time.
+        """
+        self.filename = filename
+        self.duration = duration
+        self.read_frames = 0
+        self.done = False
+        # Reused by every read, blocks are read straight into it
+        self.buffer = bytearray()
+        self.process = sp.Popen(
+            decode_command(filename),
+            stdout=sp.PIPE,
+            # Killed decoders of faded out tracks complain of broken pipes
+            stderr=sp.DEVNULL,
+            bufsize=0,
+        )
+
+    def __repr__(self):
+        return f"<Track {self.filename}>"
+
+    @property
+    def remaining(self) -> float:
+        """
+        Seconds of audio not yet read, infinite when unknown.
+        """
+        if self.done:
+            return 0.0
+        if not self.duration:
+            return float("inf")
+        return self.duration - self.read_frames / RATE
+
+    def read(self, frames: int) -> np.ndarray:
+        """
+        Return up to `frames` frames, fewer once the end is reached.
+        The frames are only valid until the next read.
+        """
+        size = frames * FRAME_BYTES
+        if len(self.buffer) < size:
+            self.buffer = bytearray(size)
+        view = memoryview(self.buffer)
+        read = 0
+        while read < size:
+            count = self.process.stdout.readinto(view[read:size])
+            if not count:
+                self.close()
+                break
+            read += count
+        read -= read % FRAME_BYTES
+        self.read_frames += read // FRAME_BYTES
+        return np.frombuffer(self.buffer, dtype="<f4", count=read // 4).reshape(-1, CHANNELS)
+
+    def close(self):
+        if self.done:
+            return
+        self.done = True
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.stdout.close()
+        self.process.wait()
+
+
+class Ramp:
+    def __init__(self, level: float = 1.0) -> None:
+        """
+        Gain moving linearly towards a target level.
+        """
+        self.level = level
+        self.target = level
+        self.step = 0.0
+
+    def to(self, target: float, seconds: float):
+        """
+        Reach `target` in `seconds`, right away when 0.
+        """
+        samples = int(seconds * RATE)
+        self.target = target
+        if samples <= 0:
+            self.level = target
+            self.step = 0.0
+        else:
+            self.step = (target - self.level) / samples
+
+    def fill(self, out: np.ndarray, index: np.ndarray):
+        """
+        Write the gain of the next `len(out)` samples to `out`
+        and advance. `index` holds 1, 2, 3...
+        """
+        if not self.step:
+            out.fill(self.level)
+            return
+        np.multiply(index[: len(out)], self.step, out=out)
+        out += self.level
+        if self.step > 0:
+            np.minimum(out, self.target, out=out)
+        else:
+            np.maximum(out, self.target, out=out)
+        self.level = float(out[-1])
+        if self.level == self.target:
+            self.step = 0.0
+
+
+class Voice:
+    def __init__(self, track, level: float = 1.0, ducks: bool = False) -> None:
+        """
+        A track playing in the mixer. Music voices follow the
+        music bus, which is lowered while a voice that `ducks`
+        the music, like a voice-over, is playing.
+        """
+        self.track = track
+        self.gain = Ramp(level)
+        self.ducks = ducks
+
+    @property
+    def silent(self) -> bool:
+        """
+        Faded out for good.
+        """
+        return self.gain.level == 0 and self.gain.target == 0
+
+
+class Mixer:
+    def __init__(
+        self,
+        frame: int = 960,
+        frames: int = 1,
+        duck_level: float = 0.25,
+        duck_seconds: float = 0.5,
+        max_voices: int = 4,
+    ) -> None:
+        """
+        Mix decoded tracks into blocks of `frames` frames of `frame`
+        samples each: crossfades between songs, and overlays such as
+        jingles or voice-over promotions, which duck the music to
+        `duck_level` over `duck_seconds`.
+
+        Every buffer is allocated up front and the number of voices
+        is capped at `max_voices`, so a block costs at most a fixed
+        number of vectorized operations on fixed size arrays.
+        """
+        self.size = frame * frames
+        self.seconds = self.size / RATE
+        self.duck_level = duck_level
+        self.duck_seconds = duck_seconds
+        self.max_voices = max_voices
+        self.music = []
+        self.overlays = []
+        self.bus = Ramp(1.0)
+        self.out = np.zeros((self.size, CHANNELS), dtype=np.float32)
+        # Bytes of `out`, handed to the encoder without a copy
+        self.block = self.out.data.cast("B")
+        self.scratch = np.zeros((self.size, CHANNELS), dtype=np.float32)
+        self.envelope = np.zeros(self.size, dtype=np.float32)
+        self.bus_envelope = np.zeros(self.size, dtype=np.float32)
+        self.index = np.arange(1, self.size + 1, dtype=np.float32)
+
+    @property
+    def voices(self) -> int:
+        return len(self.music) + len(self.overlays)
+
+    def _limit(self):
+        """
+        Drop the oldest fading music voices over `max_voices`.
+        """
+        while self.voices > self.max_voices and len(self.music) > 1:
+            voice = self.music.pop(0)
+            logging.debug(f"Mixer dropping {voice.track}.")
+            voice.track.close()
+
+    def start(self, track, fade: float = 0.0):
+        """
+        Make `track` the music, crossfading from what is playing
+        over `fade` seconds.
+        """
+        playing = any(not voice.silent for voice in self.music)
+        for voice in self.music:
+            voice.gain.to(0.0, fade)
+        voice = Voice(track, 0.0 if playing and fade else 1.0)
+        voice.gain.to(1.0, fade if playing else 0.0)
+        self.music.append(voice)
+        self._limit()
+
+    def overlay(self, track, duck: bool = False):
+        """
+        Play `track` over the music, lowering it when `duck`.
+        """
+        self.overlays.append(Voice(track, ducks=duck))
+        while self.voices > self.max_voices and self.overlays:
+            self.overlays.pop(0).track.close()
+        self._limit()
+
+    def stop(self, fade: float = 0.0):
+        """
+        Fade everything out over `fade` seconds.
+        """
+        for voice in self.music + self.overlays:
+            voice.gain.to(0.0, fade)
+
+    def _add(self, voice, bus=None) -> bool:
+        """
+        Add the next block of `voice` to the output, returns
+        False once it has ended.
+        """
+        samples = voice.track.read(self.size)
+        count = len(samples)
+        if count:
+            envelope = self.envelope[:count]
+            fading = bool(voice.gain.step)
+            voice.gain.fill(envelope, self.index)
+            if fading:
+                # Equal power curve, crossfades keep a steady level
+                envelope *= np.pi / 2
+                np.sin(envelope, out=envelope)
+            if bus is not None:
+                envelope *= bus[:count]
+            scratch = self.scratch[:count]
+            np.multiply(samples, envelope[:, None], out=scratch)
+            self.out[:count] += scratch
+        if voice.track.done or voice.silent:
+            voice.track.close()
+            return False
+        return True
+
+    def mix(self) -> memoryview:
+        """
+        Return the next block as interleaved float32 PCM,
+        silence when nothing is playing. The block is only
+        valid until the next call.
+        """
+        self.out.fill(0.0)
+        ducking = any(voice.ducks for voice in self.overlays)
+        target = self.duck_level if ducking else 1.0
+        if self.bus.target != target:
+            self.bus.to(target, self.duck_seconds)
+        self.bus.fill(self.bus_envelope, self.index)
+        self.music = [voice for voice in self.music if self._add(voice, self.bus_envelope)]
+        self.overlays = [voice for voice in self.overlays if self._add(voice)]
+        np.clip(self.out, -1.0, 1.0, out=self.out)
+        return self.block
+
+    def close(self):
+        for voice in self.music + self.overlays:
+            voice.track.close()
+        self.music = []
+        self.overlays = []
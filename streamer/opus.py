@@ -0,0 +1,160 @@
+import json
+import logging
+import os
+import struct
+import threading
+import time
+
+from streamer.metrics import PROBE_SECONDS
+
+# Opus granule positions always count 48kHz samples
+OPUS_RATE = 48000
+PAGE_HEADER = struct.Struct("<4sBBqIIIB")
+# Bytes read from the end of a file when looking for the last page,
+# an Ogg page is at most 65307 bytes long.
+TAIL_SIZE = 65536 * 2
+
+
+def _pages(data: bytes, start: int = 0):
+    """
+    Yield (offset, header_type, granule, serial, body_offset, body_size)
+    for every Ogg page found in `data` from `start`.
+    """
+    offset = data.find(b"OggS", start)
+    while offset != -1 and offset + PAGE_HEADER.size <= len(data):
+        (
+            _,
+            version,
+            header_type,
+            granule,
+            serial,
+            _,
+            _,
+            segments,
+        ) = PAGE_HEADER.unpack_from(data, offset)
+        lacing_end = offset + PAGE_HEADER.size + segments
+        body_size = sum(data[offset + PAGE_HEADER.size : lacing_end])
+        if version != 0 or lacing_end + body_size > len(data):
+            # Capture pattern inside packet data or a truncated page
+            offset = data.find(b"OggS", offset + 1)
+            continue
+        yield offset, header_type, granule, serial, lacing_end, body_size
+        offset = data.find(b"OggS", lacing_end + body_size)
+
+
+def opus_duration(path: str) -> float:
+    """
+    Return the duration in seconds of an Ogg Opus file, computed
+    from the granule position of its last page minus the
+    pre-skip stored in the OpusHead header.
+    """
+    with open(path, "rb") as f:
+        head = f.read(4096)
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(max(0, size - TAIL_SIZE))
+        tail = f.read()
+
+    first = next(_pages(head), None)
+    if first is None:
+        raise ValueError(f"{path} is not an Ogg file")
+    _, _, _, serial, body, _ = first
+    if head[body : body + 8] != b"OpusHead":
+        raise ValueError(f"{path} is not an Ogg Opus file")
+    pre_skip = struct.unpack_from("<H", head, body + 10)[0]
+
+    granule = -1
+    for _, _, page_granule, page_serial, _, _ in _pages(tail):
+        # -1 marks pages where no packet finishes
+        if page_serial == serial and page_granule != -1:
+            granule = page_granule
+    if granule < 0:
+        raise ValueError(f"{path} has no audio pages")
+    return max(0, granule - pre_skip) / OPUS_RATE
+
+
+def is_opus(path: str) -> bool:
+    """
+    Tell whether `path` is already an Ogg Opus file.
+    """
+    with open(path, "rb") as f:
+        head = f.read(512)
+    first = next(_pages(head), None)
+    return first is not None and head[first[4] : first[4] + 8] == b"OpusHead"
+
+
+class DurationIndex:
+    def __init__(self, path: str, save_interval: float = 5.0) -> None:
+        """
+        Persistent memo of opus file durations keyed by
+        file path and modification time.
+
+        Files gone from disk, e.g. evicted from the media cache, are
+        dropped from it. It is written in the background at most
+        every `save_interval` seconds once it changed.
+        """
+        self.path = path
+        self.save_interval = save_interval
+        self.lock = threading.Lock()
+        # Held while writing the index, set when it has to be written
+        self.saving = threading.Lock()
+        self.changed = threading.Event()
+        try:
+            with open(path) as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            entries = {}
+        self.entries = {
+            filename: entry for filename, entry in entries.items() if os.path.exists(filename)
+        }
+        threading.Thread(target=self.keep_saved, name="duration-index", daemon=True).start()
+
+    def get(self, filename: str) -> float:
+        """
+        Return the duration of `filename`, reading it from the
+        file only if it is new or changed since last time.
+        """
+        filename = os.path.abspath(filename)
+        mtime = os.path.getmtime(filename)
+        with self.lock:
+            entry = self.entries.get(filename)
+        if entry and entry[0] == mtime:
+            return entry[1]
+        with PROBE_SECONDS.time():
+            duration = opus_duration(filename)
+        with self.lock:
+            self.entries[filename] = [mtime, duration]
+        self.changed.set()
+        return duration
+
+    def save(self):
+        """
+        Write the index atomically to disk, without the files
+        gone since.
+        """
+        with self.saving:
+            self.changed.clear()
+            with self.lock:
+                filenames = list(self.entries)
+            gone = [filename for filename in filenames if not os.path.exists(filename)]
+            with self.lock:
+                for filename in gone:
+                    self.entries.pop(filename, None)
+                data = json.dumps(self.entries)
+            tmp = f"{self.path}.tmp"
+            try:
+                with open(tmp, "w") as f:
+                    f.write(data)
+                os.replace(tmp, self.path)
+            except OSError as e:
+                logging.error(f"Could not save duration index: {e}")
+
+    def keep_saved(self):
+        """
+        Save the index a while after it changed, so durations read
+        in a burst are written once.
+        """
+        while True:
+            self.changed.wait()
+            time.sleep(self.save_interval)
+            self.save()
@@ -0,0 +1,106 @@
+import logging
+import threading
+import time
+
+from streamer.metrics import PIPE_WRITE_SECONDS
+
+
+class Pacer:
+    def __init__(self, session, lookahead: float = 2.0, chunk_seconds: float = 0.25) -> None:
+        """
+        Feed audio to an encoder session in real time.
+
+        Every chunk written has an audible time on a monotonic clock,
+        computed from the total duration of the audio written before
+        it, so timing errors never accumulate. At most `lookahead`
+        seconds of audio are written ahead of the clock, in chunks
+        of about `chunk_seconds`.
+        """
+        self.session = session
+        self.lookahead = lookahead
+        self.chunk_seconds = chunk_seconds
+        # Monotonic time at which audio position 0 is heard
+        self.clock = None
+        # Seconds of audio written so far
+        self.position = 0.0
+        self.underruns = 0
+        self.overruns = 0
+
+    def now(self) -> float:
+        """
+        Current audible position in seconds of audio.
+        """
+        if self.clock is None:
+            return self.position
+        return time.monotonic() - self.clock
+
+    def wall(self, position: float) -> float:
+        """
+        Wall clock time (epoch seconds) at which the audio
+        at `position` is heard.
+        """
+        return time.time() + position - self.now()
+
+    @property
+    def buffered(self) -> float:
+        """
+        Seconds of audio written but not yet heard.
+        """
+        return max(0.0, self.position - self.now())
+
+    def at(self, position: float, callback):
+        """
+        Call `callback` once the audio at `position` is heard.
+        """
+        delay = 0.0
+        if self.clock is not None:
+            delay = max(0.0, self.clock + position - time.monotonic())
+        timer = threading.Timer(delay, callback)
+        timer.daemon = True
+        timer.start()
+        return timer
+
+    def write(self, chunk: bytes, seconds: float, stop=None) -> bool:
+        """
+        Write `chunk`, `seconds` of audio, once it falls within the
+        look-ahead window. Returns False without writing it when
+        the `stop` event is set while waiting.
+        """
+        if self.clock is None:
+            # Nothing queued, the chunk is heard as soon as it is written
+            self.clock = time.monotonic() - self.position
+        elif self.now() - self.position > self.chunk_seconds:
+            # Writing fell behind what is being heard
+            self.underruns += 1
+            logging.warning(
+                f"Buffer underrun, {self.now() - self.position:.2f}s of dead air."
+            )
+            self.clock = time.monotonic() - self.position
+
+        delay = self.clock + self.position - self.lookahead - time.monotonic()
+        if delay > 0:
+            if stop is not None:
+                stop.wait(delay)
+            else:
+                time.sleep(delay)
+        if stop is not None and stop.is_set():
+            return False
+
+        began = time.monotonic()
+        # A restarted encoder loses the chunk, raw audio needs no headers
+        self.session.send(chunk)
+        elapsed = time.monotonic() - began
+        PIPE_WRITE_SECONDS.observe(elapsed)
+        if elapsed > self.chunk_seconds:
+            # Encoder is not draining what is already queued
+            self.overruns += 1
+            logging.warning("Buffer overrun, encoder write stalled.")
+        self.position += seconds
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "buffered": self.buffered,
+            "underruns": self.underruns,
+            "overruns": self.overruns,
+        }
@@ -0,0 +1,150 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from config import PREFETCH_DEPTH, PREFETCH_WORKERS, PREFETCH_MAX_BYTES
+from streamer.transcode import ON_AIR, PREFETCH
+
+
+class Prefetcher:
+    def __init__(
+        self,
+        fetch,
+        depth: int = PREFETCH_DEPTH,
+        workers: int = PREFETCH_WORKERS,
+        max_bytes: int = PREFETCH_MAX_BYTES,
+        release=None,
+    ) -> None:
+        """
+        Download and transcode upcoming songs in the background.
+
+        `fetch(playlist, song, url, gain, priority)` does the actual work
+        and returns the path of the encoded file. Only paths are kept
+        in memory, so memory use is bounded by the number of workers
+        while disk use is bounded by `max_bytes` of unplayed files, jobs
+        not done yet counting as the average size of those fetched.
+
+        Files handed out by get are given back by the caller with
+        `release(path)` once played, the prefetcher releases those of
+        finished jobs it drops.
+        """
+        self.fetch = fetch
+        self.release = release or (lambda path: None)
+        self.depth = depth
+        self.max_bytes = max_bytes
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="prefetch"
+        )
+        # Songs needed right away do not queue behind prefetch jobs
+        self.on_air = ThreadPoolExecutor(max_workers=1, thread_name_prefix="on-air")
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+        # Bytes a job is expected to add until it is done, the average
+        # size of the files fetched so far
+        self.expected_bytes = max_bytes // max(depth, 1)
+        self.fetched = 0
+
+    def _ready_bytes(self) -> int:
+        """
+        Size of prefetched files that are done but not yet played.
+        """
+        total = 0
+        for future in self.jobs.values():
+            if future.done() and not future.cancelled() and not future.exception():
+                try:
+                    total += os.path.getsize(future.result())
+                except OSError:
+                    pass
+        return total
+
+    def prefetch(self, *key) -> str:
+        """
+        Fetch a song and fold the size of its file into the
+        expected size of the next ones.
+        """
+        path = self.fetch(*key, PREFETCH)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return path
+        with self.lock:
+            self.fetched += 1
+            self.expected_bytes += (size - self.expected_bytes) / self.fetched
+        return path
+
+    def dropped(self, future):
+        """
+        Release the file of a job whose result is not used, once
+        it is done.
+        """
+
+        def release(future):
+            if not future.cancelled() and future.exception() is None:
+                self.release(future.result())
+
+        future.add_done_callback(release)
+
+    def schedule(self, upcoming):
+        """
+        Start fetching `upcoming`, a list of (playlist, song, url, gain)
+        tuples in play order. Only the first `depth` entries are
+        fetched and jobs for songs no longer upcoming are dropped.
+        """
+        wanted = list(OrderedDict.fromkeys(upcoming))[: self.depth]
+        with self.lock:
+            for key in list(self.jobs):
+                # Running jobs are left to finish so the same file
+                # is never written by two threads at once.
+                future = self.jobs[key]
+                if key not in wanted and (future.cancel() or future.done()):
+                    del self.jobs[key]
+                    self.dropped(future)
+            unfinished = sum(not future.done() for future in self.jobs.values())
+            budget = self.max_bytes - self._ready_bytes() - unfinished * self.expected_bytes
+            for key in wanted:
+                if key in self.jobs:
+                    continue
+                if budget < self.expected_bytes:
+                    logging.debug("Prefetch budget exhausted.")
+                    break
+                logging.debug(f"Prefetching {key[0]}-{key[1]}")
+                self.jobs[key] = self.executor.submit(self.prefetch, *key)
+                budget -= self.expected_bytes
+
+    def urgent(self, playlist, song, url, gain: float = 0.0):
+        """
+        Return a future of the encoded file for a song needed next,
+        its running prefetch job or a new job at on air priority, so
+        the caller can keep the stream going until it is done.
+        """
+        key = (playlist, song, url, gain)
+        with self.lock:
+            future = self.jobs.get(key)
+            # A prefetch job still queued is taken out of the queue
+            if future is None or future.cancel() or future.cancelled():
+                logging.debug(f"Fetching {playlist}-{song} for on air.")
+                future = self.jobs[key] = self.on_air.submit(self.fetch, *key, ON_AIR)
+        return future
+
+    def get(self, playlist, song, url, gain: float = 0.0) -> str:
+        """
+        Return the encoded file for a song from its job, started at
+        on air priority when there is none, waiting for it to finish
+        and raising its error if it failed. A failed job already went
+        through the client's retries, the song is then skipped.
+        Callers keep the stream going until the job of urgent is done.
+        """
+        key = (playlist, song, url, gain)
+        future = self.urgent(*key)
+        with self.lock:
+            if self.jobs.get(key) is future:
+                del self.jobs[key]
+        return future.result()
+
+    def clear(self):
+        """
+        Drop all queued jobs, e.g. when the playlist changes.
+        """
+        self.schedule([])
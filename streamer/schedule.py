@@ -0,0 +1,95 @@
+import math
+import random
+from collections import namedtuple
+
+# Songs played between two promotions
+PROMOTION_EVERY = 6
+
+# One song or promotion of a pass through a playlist
+Slot = namedtuple("Slot", "playlist name url thumbnail gain duration promotion")
+
+
+def entry_gain(entry) -> float:
+    """
+    Loudness gain (dB) of a song or promotion entry,
+    entries set by older API versions have none.
+    """
+    return entry[3] if len(entry) > 3 else 0.0
+
+
+def entry_duration(entry):
+    """
+    Duration (seconds) of a song or promotion entry as measured
+    at ingest, None when unknown.
+    """
+    return entry[4] if len(entry) > 4 else None
+
+
+def plan(playlist, songs, played, promotions, choose=random.choice) -> list:
+    """
+    Return the slots of one pass through `songs`, `played` songs
+    after the station started, with a promotion picked by `choose`
+    after every PROMOTION_EVERY songs.
+    """
+    slots = []
+    for offset, song in enumerate(songs, 1):
+        slots.append(
+            Slot(playlist, song[0], song[1], song[2], entry_gain(song), entry_duration(song), False)
+        )
+        if promotions and (played + offset) % PROMOTION_EVERY == 0:
+            promotion = choose(promotions)
+            slots.append(
+                Slot(
+                    "promotions",
+                    promotion[0],
+                    promotion[1],
+                    promotion[2],
+                    entry_gain(promotion),
+                    entry_duration(promotion),
+                    True,
+                )
+            )
+    return slots
+
+
+def upcoming(slots, index):
+    """
+    Return (playlist, song, url, gain) for the slots following
+    `slots[index]`, wrapping around to the songs of the next pass.
+    """
+    following = slots[index + 1 :] + [slot for slot in slots[: index + 1] if not slot.promotion]
+    return [(slot.playlist, slot.name, slot.url, slot.gain) for slot in following]
+
+
+def timetable(slots, start: float, crossfade: float, block: float, voice_over: bool = False):
+    """
+    Return the expected start time of each slot as a list of
+    dicts, the first one starting at `start`.
+
+    A track is followed once no more than `crossfade` seconds of
+    it are left, checked every `block` seconds of audio, and
+    voice-over promotions start with the song after them without
+    delaying it. The timetable stops at the first slot of unknown
+    duration, as nothing after it can be placed.
+    """
+    entries = []
+    at = start
+    for slot in slots:
+        entries.append(
+            {
+                "start": at,
+                "duration": slot.duration,
+                "title": slot.name,
+                "thumbnail": slot.thumbnail,
+                "playlist": slot.playlist,
+                "promotion": slot.promotion,
+            }
+        )
+        if not slot.duration:
+            break
+        if slot.promotion and voice_over:
+            continue
+        # Blocks written before the track is down to the crossfade
+        blocks = max(0, math.ceil((slot.duration - crossfade) / block - 1e-9))
+        at += blocks * block
+    return entries
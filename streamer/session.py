@@ -0,0 +1,78 @@
+import fcntl
+import logging
+import subprocess as sp
+
+# fcntl.F_SETPIPE_SZ only exists from python 3.10
+F_SETPIPE_SZ = getattr(fcntl, "F_SETPIPE_SZ", 1031)
+
+
+class EncoderSession:
+    def __init__(self, command, pipe_size: int = 65536) -> None:
+        """
+        Long lived ffmpeg process encoding the PCM written to it
+        and publishing it on one output (RTSP) session.
+
+        The station mixer writes one continuous stream, so the
+        output stays continuous across songs and playlist switches.
+        """
+        self.command = command
+        self.pipe_size = pipe_size
+        self.process = None
+        self.restarts = 0
+        self.start()
+
+    def start(self):
+        """
+        Spawn the encoder process.
+        """
+        logging.debug("Starting encoder session.")
+        self.process = sp.Popen(self.command, stdin=sp.PIPE)
+        try:
+            # A small pipe keeps little queued audio in front
+            # of the mixer so switches are heard quickly.
+            fcntl.fcntl(self.process.stdin.fileno(), F_SETPIPE_SZ, self.pipe_size)
+        except OSError as e:
+            logging.debug(f"Could not resize encoder pipe: {e}")
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def restart(self):
+        """
+        Replace a dead encoder process, only used when the
+        session was lost (e.g. the RTSP server went away).
+        """
+        self.close()
+        self.restarts += 1
+        logging.warning(f"Restarting encoder session ({self.restarts}).")
+        self.start()
+
+    def send(self, chunk: bytes) -> bool:
+        """
+        Write audio to the session. Returns False when the encoder
+        had died and was restarted without writing the chunk.
+        """
+        if self.alive:
+            try:
+                self.process.stdin.write(chunk)
+                self.process.stdin.flush()
+                return True
+            except (BrokenPipeError, ValueError) as e:
+                logging.exception(e)
+        self.restart()
+        return False
+
+    def close(self):
+        """
+        Stop the encoder process.
+        """
+        if self.process is None:
+            return
+        try:
+            self.process.stdin.close()
+        except (BrokenPipeError, ValueError):
+            pass
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
@@ -0,0 +1,304 @@
+import logging
+import os
+import threading
+import time
+
+from config import (
+    PACING_LOOKAHEAD,
+    PACING_CHUNK_SECONDS,
+    PLAYLIST_CHANNEL,
+    CROSSFADE_SECONDS,
+    MIXER_FRAME,
+    DUCK_LEVEL,
+    DUCK_SECONDS,
+    PROMOTION_VOICE_OVER,
+    SCHEDULE_CHANNEL,
+    SCHEDULE_TOLERANCE,
+    SCHEDULE_HISTORY,
+)
+from common.redis import redis_backend, station_key
+from streamer.prefetch import Prefetcher
+from streamer.session import EncoderSession
+from streamer.pacing import Pacer
+from streamer.events import PlaylistWatcher
+from streamer.mixer import Mixer, Track, RATE
+from streamer.metrics import SWITCH_SECONDS
+from streamer.schedule import plan, upcoming, timetable
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+def process_usage(pid: int) -> dict:
+    """
+    Return cpu seconds and resident bytes used by process `pid`.
+    """
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open(f"/proc/{pid}/statm") as f:
+            resident = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return {"cpu": 0.0, "rss": 0}
+    # utime and stime are the 14th and 15th fields of stat
+    cpu = (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+    return {"cpu": cpu, "rss": resident * PAGE_SIZE}
+
+
+class Station:
+    def __init__(
+        self, name: str, command, prepare, durations, clips=None, release=None
+    ) -> None:
+        """
+        One radio station: a playlist loop mixing songs into its
+        own encoder session, with redis keys namespaced by `name`.
+
+        `prepare(playlist, song, url)` returns the encoded file of a
+        song and `durations` gives its length, both are shared by all
+        stations so each song is downloaded and encoded once. Short
+        clips played often are decoded once when `clips`, a shared
+        ClipCache, is given. Files are given back with `release(path)`
+        once playing, so they may be evicted from the cache.
+        """
+        self.name = name
+        self.durations = durations
+        self.tracks = clips.track if clips is not None else Track
+        self.session = EncoderSession(command)
+        self.pacer = Pacer(self.session, PACING_LOOKAHEAD, PACING_CHUNK_SECONDS)
+        self.mixer = Mixer(
+            MIXER_FRAME,
+            max(1, round(PACING_CHUNK_SECONDS * RATE / MIXER_FRAME)),
+            DUCK_LEVEL,
+            DUCK_SECONDS,
+        )
+        self.release = release or (lambda path: None)
+        self.prefetcher = Prefetcher(prepare, release=self.release)
+        self.watcher = PlaylistWatcher(redis_backend, self.key(PLAYLIST_CHANNEL))
+        # Expected start times of the slots of the current pass
+        self.expected = []
+        self.thread = None
+
+    def __repr__(self):
+        return f"<Station {self.name or 'default'}>"
+
+    def key(self, key: str) -> str:
+        return station_key(key, self.name)
+
+    def current_play(self):
+        """
+        Return the (playlist, songs, promotions) scheduled by the
+        API, or None when nothing is scheduled.
+        """
+        # CURRENT_PLAY is a hash set by the API with the fields
+        # playlist: <playlist>
+        # songs: [(name, song_url, thumbnail_url, gain, duration)..]
+        # promotions: [(name, song_url, thumbnail_url, gain, duration)..]
+        current = redis_backend.get_fields(self.key("CURRENT_PLAY"))
+        if not current.get("songs"):
+            return None
+        return current["playlist"], current["songs"], current.get("promotions") or []
+
+    def now_playing(self, title=None, announced=None):
+        """
+        Return a callback run when a track becomes audible. When
+        the track starts a playlist `announced` at that monotonic
+        time, the switch latency is recorded.
+        """
+
+        def _now_playing():
+            logging.debug(f"{self} now playing {title}.")
+            if announced is not None:
+                SWITCH_SECONDS.observe(
+                    time.monotonic() - announced, station=self.name or "default"
+                )
+
+        return _now_playing
+
+    def publish_schedule(self, slots, start: float, duration: float = None, index: int = 0):
+        """
+        Publish the expected start times of the slots from
+        `slots[index]` on, that one heard at `start` (epoch seconds)
+        for `duration` seconds, replacing the rest of the schedule.
+        Listeners look up what plays at any time in it instead of
+        being told every track.
+        """
+        following = slots[index:]
+        if following and duration:
+            following[0] = following[0]._replace(duration=duration)
+        entries = timetable(
+            following, start, CROSSFADE_SECONDS, self.mixer.seconds, PROMOTION_VOICE_OVER
+        )
+        redis_backend.set_schedule(self.key("SCHEDULE"), entries, start, SCHEDULE_HISTORY)
+        redis_backend.publish(self.key(SCHEDULE_CHANNEL), start)
+        # Expected start of each slot, None when it cannot be placed
+        self.expected = [None] * index + [entry["start"] for entry in entries]
+        self.expected += [None] * (len(slots) - len(self.expected))
+
+    def feed(self, until) -> bool:
+        """
+        Write mixed audio while `until()` holds, returns False
+        when interrupted by a playlist change.
+        """
+        while until():
+            if not self.pacer.write(
+                self.mixer.mix(), self.mixer.seconds, self.watcher.changed
+            ):
+                return False
+        return True
+
+    def play(self, filename, on_start):
+        """
+        Crossfade into one song or promotion and play it until the
+        next one has to start, returns False when interrupted by a
+        playlist change, the next track then fades in right away.
+        """
+        track = self.tracks(filename, self.durations.get(filename))
+        self.pacer.at(self.pacer.position, on_start)
+        self.mixer.start(track, CROSSFADE_SECONDS)
+        return self.feed(lambda: track.remaining > CROSSFADE_SECONDS)
+
+    def voice_over(self, filename, on_start):
+        """
+        Play a promotion over the music, lowering it meanwhile.
+        """
+        self.pacer.at(self.pacer.position, on_start)
+        self.mixer.overlay(self.tracks(filename, self.durations.get(filename)), duck=True)
+
+    def wait_for(self, slot):
+        """
+        Fade out and keep the stream alive with silence while the
+        file of `slot` is fetched when it was not prefetched, e.g.
+        for the first track of a new playlist. Returns False when
+        interrupted by a playlist change before it is done.
+        """
+        future = self.prefetcher.urgent(slot.playlist, slot.name, slot.url, slot.gain)
+        if future.done():
+            return True
+        logging.debug(f"{self} waiting for {slot.name}.")
+        self.mixer.stop(CROSSFADE_SECONDS)
+        return self.feed(lambda: not future.done())
+
+    def idle(self, timeout: float):
+        """
+        Fade out and keep the stream alive with silence until a
+        change is announced or `timeout` seconds have passed.
+        """
+        self.mixer.stop(CROSSFADE_SECONDS)
+        end = time.monotonic() + timeout
+        self.feed(lambda: time.monotonic() < end)
+
+    def start(self):
+        """
+        Run the station loop in its own thread.
+        """
+        self.thread = threading.Thread(
+            target=self.run, name=f"station-{self.name or 'default'}", daemon=True
+        )
+        self.thread.start()
+
+    def run(self):
+        """
+        Run and execute the station loop.
+        """
+        watcher = self.watcher
+        last_playlist = ""
+        announced = None
+        played = 0
+        # Files handed out by the prefetcher and not yet released
+        held = []
+        logging.debug(f"Starting {self}")
+        while True:
+            try:
+                while True:
+                    watcher.changed.clear()
+                    current = self.current_play()
+                    if current is None:
+                        # Nothing scheduled, idle until the API announces a playlist
+                        logging.debug(f"{self} waiting for a playlist.")
+                        self.publish_schedule([], time.time())
+                        self.idle(60)
+                        continue
+                    playlist, songs, promotions = current
+
+                    if playlist != last_playlist:
+                        logging.debug(f"{self} switching to playlist {playlist}.")
+                        last_playlist = playlist
+                        watcher.playing = playlist
+                        announced, watcher.announced = watcher.announced, None
+
+                    slots = plan(playlist, songs, played, promotions)
+                    self.expected = []
+                    for index, slot in enumerate(slots):
+                        try:
+                            if not self.wait_for(slot):
+                                # The new playlist starts without waiting
+                                # for this track, left to finish in the
+                                # background
+                                self.prefetcher.clear()
+                                break
+                            filename = self.prefetcher.get(
+                                slot.playlist, slot.name, slot.url, slot.gain
+                            )
+                        except Exception as e:
+                            if not slot.promotion:
+                                raise
+                            logging.exception(e)
+                            continue
+                        held.append(filename)
+                        self.prefetcher.schedule(upcoming(slots, index))
+
+                        start = self.pacer.wall(self.pacer.position)
+                        expected = self.expected[index] if self.expected else None
+                        if expected is None or abs(start - expected) > SCHEDULE_TOLERANCE:
+                            # First track of the pass, or the schedule is off
+                            self.publish_schedule(
+                                slots, start, self.durations.get(filename), index
+                            )
+
+                        if slot.promotion:
+                            logging.debug("Playing Promotion")
+                        else:
+                            logging.debug(f"Setting {slot.name} as playing.")
+                            played += 1
+                        on_start = self.now_playing(slot.name, announced)
+                        announced = None
+                        if slot.promotion and PROMOTION_VOICE_OVER:
+                            self.voice_over(filename, on_start)
+                        else:
+                            self.play(filename, on_start)
+                        # Earlier tracks are read from their open files by now
+                        while len(held) > 1:
+                            self.release(held.pop(0))
+
+                        if watcher.changed.is_set():
+                            # Playlist changed, the new one is faded in
+                            # right away on the same encoder session.
+                            self.prefetcher.clear()
+                            break
+            except Exception as e:
+                logging.exception(e)
+                # Avoid spinning while e.g. redis is unreachable
+                time.sleep(1)
+
+    def stats(self) -> dict:
+        """
+        Resource usage of the station: cpu seconds of its loop
+        thread and of its encoder process, and the encoder's
+        resident memory.
+        """
+        loop_cpu = 0.0
+        if self.thread is not None and self.thread.is_alive():
+            try:
+                clock = time.pthread_getcpuclockid(self.thread.ident)
+                loop_cpu = time.clock_gettime(clock)
+            except OSError:
+                pass
+        encoder = process_usage(self.session.process.pid)
+        return {
+            "loop_cpu": loop_cpu,
+            "encoder_cpu": encoder["cpu"],
+            "encoder_rss": encoder["rss"],
+            "restarts": self.session.restarts,
+            "voices": self.mixer.voices,
+            **self.pacer.stats(),
+        }
@@ -1,159 +1,257 @@
+import atexit
 import logging
-import random
 import time
 import os
-import subprocess as sp
 
-import requests
-
-from config import RTSP_STREAM, CACHE_FILE_TIME
+from config import (
+    RTSP_STREAM,
+    CACHE_DIR,
+    CACHE_FILE_TIME,
+    CACHE_MAX_BYTES,
+    CACHE_SAVE_INTERVAL,
+    CHUNK_SIZE,
+    DURATION_INDEX,
+    STATIONS,
+    STATS_INTERVAL,
+    TRANSCODE_WORKERS,
+    HLS_DIR,
+    HLS_VARIANTS,
+    STREAM_BITRATE,
+    METRICS_PORT,
+    HTTP_POOL_SIZE,
+    HTTP_TIMEOUT,
+    HTTP_RETRIES,
+    HTTP_BACKOFF,
+    HTTP_BACKOFF_MAX,
+    RANGE_MIN_BYTES,
+    RANGE_PARTS,
+    CLIP_DIR,
+    CLIP_MAX_BYTES,
+    CLIP_MAX_SECONDS,
+    CLIP_MIN_PLAYS,
+)
 from common.redis import redis_backend
+from streamer.opus import DurationIndex
+from streamer.cache import MediaCache
+from streamer.clips import ClipCache
+from streamer.client import HttpClient
+from streamer.metrics import Collector, serve
+from streamer.mixer import RATE, CHANNELS
+from streamer.station import Station, process_usage
+from streamer.transcode import TranscodeService, ON_AIR
 
 # Command to stream music to rtsp-simple-server instance with ffmpeg
+# Real time pacing is done by streamer.pacing so ffmpeg runs without -re.
+# The mixed PCM of a station is encoded once and the encoded stream is
+# copied to every output of the tee muxer.
 COMMAND = [
     "ffmpeg",
-    "-re",
-    "-stream_loop",
-    "-1",
+    "-f",
+    "f32le",
+    "-ar",
+    str(RATE),
+    "-ac",
+    str(CHANNELS),
     "-i",
     "-",
-    "-acodec",
-    "rawaudio",
-    "-c",
-    "copy",
+    "-c:a",
+    "libopus",
+    "-b:a",
+    STREAM_BITRATE,
     "-vn",
+    "-map",
+    "0:a",
     "-f",
-    "rtsp",
-    RTSP_STREAM,
+    "tee",
+    f"[f=rtsp]{RTSP_STREAM}",
 ]
 
 logging.basicConfig(level=logging.DEBUG)
 
 # Local cache directory
-if not os.path.exists("static/"):
-    os.mkdir("static/")
+if not os.path.exists(CACHE_DIR):
+    os.mkdir(CACHE_DIR)
+
+client = HttpClient(
+    HTTP_POOL_SIZE,
+    HTTP_TIMEOUT,
+    HTTP_RETRIES,
+    HTTP_BACKOFF,
+    HTTP_BACKOFF_MAX,
+    RANGE_MIN_BYTES,
+    RANGE_PARTS,
+    CHUNK_SIZE,
+)
+cache = MediaCache(
+    CACHE_DIR, CACHE_MAX_BYTES, CACHE_FILE_TIME, CHUNK_SIZE, client, CACHE_SAVE_INTERVAL
+)
+# The index is otherwise written a few seconds after it changes
+atexit.register(cache.save)
+durations = DurationIndex(DURATION_INDEX, CACHE_SAVE_INTERVAL)
+atexit.register(durations.save)
+clips = ClipCache(CLIP_DIR, CLIP_MAX_BYTES, CLIP_MAX_SECONDS, CLIP_MIN_PLAYS)
+
+
+def transcode_command(source, destination, gain=0.0):
+    """
+    Command transcoding `source` to STREAM_BITRATE opus at `destination`,
+    applying the static loudness `gain` (dB) measured at ingest.
+    """
+    filters = ["-af", f"volume={gain}dB"] if gain else []
+    return [
+        "ffmpeg",
+        "-y",
+        "-i",
+        source,
+        *filters,
+        "-c:a",
+        "libopus",
+        "-b:a",
+        STREAM_BITRATE,
+        "-f",
+        "opus",
+        destination,
+    ]
 
 
-def get_from_url(playlist, song, song_url):
+transcoder = TranscodeService(transcode_command, TRANSCODE_WORKERS)
+
+
+def get_from_url(playlist, song, song_url, gain=0.0, priority=ON_AIR):
     """
     Get song from url or local cache
     and store in opus format.
     """
-    filename = f"static/{playlist}-{song}"
-    filename2 = f"static/{playlist}-{song}.opus"
-    logging.debug(f"Retrieving {filename}")
-    # Download if file doesnt exists or is stale
-    if (
-        not os.path.exists(filename)
-        or (time.time() - os.path.getmtime(filename)) > CACHE_FILE_TIME
-    ):
-        logging.debug(f"Downloading {filename}")
-        for _ in range(5):
-            # Retry up to five times
-            resp = requests.get(song_url)
-            if resp.ok:
-                data = resp.content
-                with open(filename, "wb") as f:
-                    f.write(data)
-                com = [
-                    "ffmpeg",
-                    "-y",
-                    "-i",
-                    filename,
-                    "-c:a",
-                    "libopus",
-                    "-b:a",
-                    "40K",
-                    filename2,
-                ]
-                sp.check_output(com)
-                break
-        else:
-            msg = f"Could not download media: {resp.reason}"
-            logging.error(msg)
-            resp.raise_for_status()
-    with open(filename2, "rb") as f:
-        return f.read(), filename2
+    logging.debug(f"Retrieving {playlist}-{song}")
+    return cache.fetch(song_url, transcoder.submit, priority, gain)
 
 
-def run():
+def prepare_song(playlist, song, song_url, gain=0.0, priority=ON_AIR):
+    """
+    Fetch a song and index its duration so
+    neither happens on the hot path.
+    """
+    filename = get_from_url(playlist, song, song_url, gain, priority)
+    durations.get(filename)
+    return filename
+
+
+def hls_output(directory, segment_seconds, list_size):
+    """
+    Tee output writing a rolling HLS playlist to `directory`.
+
+    Opus is only allowed in fragmented mp4 segments, old segments
+    are deleted as they leave the playlist.
     """
-    Run and execute main server loop.
+    os.makedirs(directory, exist_ok=True)
+    options = [
+        "f=hls",
+        f"hls_time={segment_seconds}",
+        f"hls_list_size={list_size}",
+        "hls_flags=delete_segments+independent_segments+program_date_time",
+        "hls_segment_type=fmp4",
+    ]
+    return f"[{':'.join(options)}]{os.path.join(directory, 'index.m3u8')}"
+
+
+def command(rtsp_url, name=""):
+    """
+    Return the encoder command publishing to `rtsp_url` and,
+    when HLS_DIR is set, to the HLS variants of station `name`.
     """
-    PIPE = sp.Popen(COMMAND, stdin=sp.PIPE)
-    last_playlist = ""
-    promotions = []
-    played = 0
-    logging.debug("Starting")
+    outputs = [f"[f=rtsp]{rtsp_url}"]
+    if HLS_DIR:
+        for variant, (segment_seconds, list_size) in HLS_VARIANTS.items():
+            directory = os.path.join(HLS_DIR, name or "default", variant)
+            outputs.append(hls_output(directory, segment_seconds, list_size))
+    return COMMAND[:-1] + ["|".join(outputs)]
+
+
+def report(stations):
+    """
+    Log and store per station resource usage every STATS_INTERVAL
+    seconds, cpu figures are converted to a share of one core.
+    """
+    last = {}
+    last_time = time.monotonic()
     while True:
+        time.sleep(STATS_INTERVAL)
+        now = time.monotonic()
+        elapsed = now - last_time
+        last_time = now
+        process = process_usage(os.getpid())
+        reported = {}
+        for station in stations:
+            stats = station.stats()
+            cpu = stats["loop_cpu"] + stats["encoder_cpu"]
+            stats["cpu_share"] = (cpu - last.get(station, cpu)) / elapsed
+            last[station] = cpu
+            stats["process_rss"] = process["rss"]
+            logging.info(f"{station} usage: {stats}")
+            reported[station.key("STATION_STATS")] = stats
         try:
-            while True:
-                # CURRENT_PLAY is a list in the following format
-                # [<playlist>, [(name, song_url, thumbnail_url)..]]
-                try:
-                    playlist, songs = redis_backend.get("CURRENT_PLAY")
-                except:
-                    continue
-
-                try:
-                    # Get ads
-                    promotions = redis_backend.get("CURRENT_PROMOTIONS")
-                except Exception as e:
-                    logging.exception(e)
-
-                for song_name, url, thumb_url in songs:
-                    logging.debug(f"Setting {song_name} as playing.")
-                    played += 1
-                    song_data = get_from_url(playlist, song_name, url)
-                    logging.debug(song_data[0][:10])
-                    logging.debug("Setting Thumbnail.")
-                    redis_backend.set("CURRENT_THUMB", thumb_url)
-                    redis_backend.set("CURRENT_SONG", song_name)
-                    PIPE.stdin.write(song_data[0])
-                    fp = os.path.abspath(song_data[1])
-                    sl = float(
-                        sp.Popen(
-                            f'ffprobe -i {fp} \
-                              -show_entries format=duration\
-                                -v quiet -of csv="p=0"',
-                            shell=True,
-                            stdout=sp.PIPE,
-                        ).stdout.read()
-                    )
-                    sleep = sl * 0.97
-                    logging.debug(
-                        f"Waiting for {song_name} \
-                                  to finish play {sleep}."
-                    )
-                    playlist, songs = redis_backend.get("CURRENT_PLAY")
-
-                    if playlist != last_playlist:
-                        # Playlist changed
-                        PIPE.kill()
-                        PIPE = sp.Popen(COMMAND, stdin=sp.PIPE)
-                        break
-
-                    if (played % 6) == 0:
-                        # Play a random ad
-                        logging.debug("Playing Promotion")
-                        try:
-                            name, url, thumb_url = random.choice(promotions)
-                            song_data = get_from_url("promotions", name, url)
-                            PIPE.stdin.write(song_data[0])
-                            redis_backend.set("CURRENT_THUMB", thumb_url)
-                            fp = os.path.abspath(song_data[1])
-                            sl = float(
-                                sp.Popen(
-                                    f'ffprobe -i {fp} -show_entries \
-                                        format=duration -v quiet -of csv="p=0"',
-                                    shell=True,
-                                    stdout=sp.PIPE,
-                                ).stdout.read()
-                            )
-                            sleep = sl * 0.95
-                            time.sleep(sleep)
-                        except Exception as e:
-                            logging.exception(e)
-                last_playlist = playlist
+            redis_backend.set_many(reported)
         except Exception as e:
             logging.exception(e)
+        logging.info(f"Transcoder: {transcoder.stats()}")
+
+
+def register_metrics(stations):
+    """
+    Expose figures kept by the stations and the transcoder,
+    read when the metrics are scraped.
+    """
+
+    def per_station(read):
+        return lambda: [((station.name or "default",), read(station)) for station in stations]
+
+    Collector(
+        "streamer_buffer_seconds",
+        "Seconds of audio written ahead of what is being heard.",
+        "gauge",
+        per_station(lambda station: station.pacer.buffered),
+        ["station"],
+    )
+    Collector(
+        "streamer_pipe_write_stalls_total",
+        "Encoder pipe writes that took longer than the audio they carried.",
+        "counter",
+        per_station(lambda station: station.pacer.overruns),
+        ["station"],
+    )
+    Collector(
+        "streamer_underruns_total",
+        "Times the encoder ran out of audio.",
+        "counter",
+        per_station(lambda station: station.pacer.underruns),
+        ["station"],
+    )
+    Collector(
+        "streamer_encoder_restarts_total",
+        "Restarts of the ffmpeg encoder process.",
+        "counter",
+        per_station(lambda station: station.session.restarts),
+        ["station"],
+    )
+    Collector(
+        "streamer_transcode_queued",
+        "Transcode jobs waiting for a worker.",
+        "gauge",
+        lambda: [((), transcoder.stats()["queued"])],
+    )
+
+
+def run():
+    """
+    Run and execute main server loop,
+    playing every configured station.
+    """
+    stations = [
+        Station(name, command(rtsp_url, name), prepare_song, durations, clips, cache.unpin)
+        for name, rtsp_url in STATIONS
+    ]
+    register_metrics(stations)
+    serve(METRICS_PORT)
+    for station in stations:
+        station.start()
+    report(stations)
@@ -0,0 +1,160 @@
+import itertools
+import logging
+import os
+import queue
+import subprocess as sp
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+from streamer.metrics import TRANSCODE_SECONDS, TRANSCODE_WAIT_SECONDS
+
+# Job priorities, lower runs first
+ON_AIR = 0
+PREFETCH = 10
+
+
+class TranscodeService:
+    def __init__(self, command, workers: int = None, history: int = 100) -> None:
+        """
+        Shared pool of encoder processes.
+
+        `command(source, destination, **options)` returns the ffmpeg
+        command of a job. At most `workers` (one per core by default) run at
+        once, queued jobs are taken by priority so a track needed on
+        air overtakes prefetch work, and a job submitted while one
+        with the same key is in flight joins it instead of encoding
+        the same source twice.
+        """
+        self.command = command
+        self.workers = workers or os.cpu_count() or 1
+        self.queue = queue.PriorityQueue()
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.counter = itertools.count()
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        # (key, seconds waited in queue, seconds running) of recent jobs
+        self.timings = deque(maxlen=history)
+        for i in range(self.workers):
+            threading.Thread(
+                target=self.work, name=f"transcode-{i}", daemon=True
+            ).start()
+
+    def submit(
+        self, key: str, source: str, destination: str, priority: int = PREFETCH, **options
+    ) -> Future:
+        """
+        Queue encoding `source` to `destination` and return a future
+        resolved once `destination` exists. `options` are passed on
+        to the command.
+        """
+        with self.lock:
+            job = self.jobs.get(key)
+            if job is None:
+                job = {
+                    "source": source,
+                    "destination": destination,
+                    "options": options,
+                    "priority": priority,
+                    "queued": time.monotonic(),
+                    "started": False,
+                    "future": Future(),
+                }
+                self.jobs[key] = job
+            elif job["started"] or priority >= job["priority"]:
+                return job["future"]
+            # New job or a queued one raised in priority, workers
+            # skip the stale queue entry left behind.
+            job["priority"] = priority
+            self.queue.put((priority, next(self.counter), key))
+        return job["future"]
+
+    def transcode(
+        self, key: str, source: str, destination: str, priority: int = PREFETCH, **options
+    ):
+        """
+        Encode `source` to `destination`, blocking until done.
+        """
+        return self.submit(key, source, destination, priority, **options).result()
+
+    def work(self):
+        """
+        Worker loop running queued jobs.
+        """
+        while True:
+            priority, _, key = self.queue.get()
+            with self.lock:
+                job = self.jobs.get(key)
+                if job is None or job["started"] or job["priority"] != priority:
+                    continue
+                job["started"] = True
+                self.running += 1
+            started = time.monotonic()
+            try:
+                self.run(job["source"], job["destination"], **job["options"])
+            except Exception as e:
+                logging.exception(e)
+                with self.lock:
+                    self.failed += 1
+                job["future"].set_exception(e)
+            else:
+                job["future"].set_result(job["destination"])
+            finally:
+                finished = time.monotonic()
+                TRANSCODE_SECONDS.observe(finished - started)
+                TRANSCODE_WAIT_SECONDS.observe(started - job["queued"])
+                with self.lock:
+                    self.running -= 1
+                    self.completed += 1
+                    del self.jobs[key]
+                    self.timings.append(
+                        (key, started - job["queued"], finished - started)
+                    )
+                logging.debug(
+                    f"Transcoded {key} in {finished - started:.2f}s "
+                    f"after {started - job['queued']:.2f}s queued."
+                )
+
+    def run(self, source: str, destination: str, **options):
+        """
+        Encode into a temporary file next to `destination`
+        and move it in place once complete.
+        """
+        fd, partial = tempfile.mkstemp(
+            suffix=".tmp", dir=os.path.dirname(destination) or "."
+        )
+        os.close(fd)
+        try:
+            sp.run(
+                self.command(source, partial, **options),
+                stdout=sp.DEVNULL,
+                stderr=sp.PIPE,
+                check=True,
+            )
+            os.replace(partial, destination)
+        except Exception:
+            os.remove(partial)
+            raise
+
+    def stats(self) -> dict:
+        """
+        Queue depth and timing of recent jobs.
+        """
+        with self.lock:
+            queued = len(self.jobs) - self.running
+            timings = list(self.timings)
+        waits = [wait for _, wait, _ in timings]
+        runs = [run for _, _, run in timings]
+        return {
+            "queued": queued,
+            "running": self.running,
+            "completed": self.completed,
+            "failed": self.failed,
+            "avg_wait": sum(waits) / len(waits) if waits else 0.0,
+            "avg_run": sum(runs) / len(runs) if runs else 0.0,
+            "max_run": max(runs, default=0.0),
+        }
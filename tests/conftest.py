@@ -0,0 +1,96 @@
+"""Fixtures of the streamer tests, run offline from the repository root
+
+    python -m pytest tests
+
+Media are generated with ffmpeg and served by a local HTTP server
+standing in for the media storage.
+"""
+import hashlib
+import shutil
+import subprocess as sp
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+
+def generate(path, *options, seconds: float = 1.0):
+    """Write `seconds` of a sine wave to `path` encoded with `options`"""
+    sp.run(
+        ["ffmpeg", "-v", "error", "-y", "-f", "lavfi", "-i", f"sine=d={seconds}", *options, str(path)],
+        check=True,
+    )
+    return path
+
+
+@pytest.fixture(scope="session")
+def media(tmp_path_factory):
+    """Paths of generated media by name"""
+    if shutil.which("ffmpeg") is None:
+        pytest.skip("ffmpeg is not installed")
+    directory = tmp_path_factory.mktemp("media")
+    return {
+        "wav": generate(directory / "song.wav"),
+        "opus": generate(directory / "song.opus", "-c:a", "libopus", seconds=2.5),
+        "vorbis": generate(directory / "song.ogg", "-c:a", "libvorbis"),
+    }
+
+
+class Origin(BaseHTTPRequestHandler):
+    """Media storage serving `files` with ETags and byte ranges"""
+
+    def do_GET(self):
+        self.server.requests.append((self.path, dict(self.headers)))
+        data = self.server.files.get(self.path)
+        if data is None:
+            self.send_error(404)
+            return
+        etag = '"%s"' % hashlib.sha1(data).hexdigest()
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        start, end = 0, len(data) - 1
+        ranged = self.headers.get("Range")
+        if ranged and self.headers.get("If-Range", etag) == etag:
+            first, _, last = ranged.split("=")[1].partition("-")
+            start, end = int(first), int(last) if last else end
+        else:
+            ranged = None
+        body = data[start : end + 1]
+        self.send_response(206 if ranged else 200)
+        if ranged:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", etag)
+        self.end_headers()
+        cuts = self.server.cuts.get(self.path)
+        cut = cuts.pop(0) if cuts else None
+        if cut is not None:
+            # Connection lost partway through the body
+            self.wfile.write(body[:cut])
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def origin():
+    """Local server of `origin.files`, path -> bytes. The next
+    transfers of a path are cut after as many bytes as listed in
+    `origin.cuts[path]`, None sends them whole"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Origin)
+    server.daemon_threads = True
+    server.files = {}
+    server.cuts = {}
+    server.requests = []
+    server.url = f"http://127.0.0.1:{server.server_port}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,173 @@
+import os
+import time
+
+import pytest
+
+from streamer.cache import MediaCache
+from streamer.client import HttpClient
+
+from tests.conftest import generate
+
+
+def never(*args, **kwargs):
+    pytest.fail("Ogg Opus sources are stored as downloaded")
+
+
+@pytest.fixture
+def songs(media, tmp_path):
+    """Three Ogg Opus songs of about the same size"""
+    return {
+        name: generate(tmp_path / f"{name}.opus", "-c:a", "libopus", "-metadata", f"title={name}")
+        .read_bytes()
+        for name in ("a", "b", "c")
+    }
+
+
+@pytest.fixture
+def directory(tmp_path):
+    directory = tmp_path / "cache"
+    directory.mkdir()
+    return str(directory)
+
+
+def cache_of(directory, max_bytes=10**8, revalidate_after=60.0):
+    return MediaCache(
+        directory, max_bytes, revalidate_after, client=HttpClient(retries=1), save_interval=3600
+    )
+
+
+def played(cache, url):
+    """Fetch `url` and give its file back as once played"""
+    path = cache.fetch(url, never)
+    cache.unpin(path)
+    return path
+
+
+def test_lru_eviction(origin, songs, directory):
+    for name, data in songs.items():
+        origin.files[f"/{name}.opus"] = data
+    largest = max(len(data) for data in songs.values())
+    cache = cache_of(directory, max_bytes=2 * largest)
+
+    a = played(cache, f"{origin.url}/a.opus")
+    b = played(cache, f"{origin.url}/b.opus")
+    assert open(a, "rb").read() == songs["a"]
+    # A hit makes a the most recently used, b is evicted for c
+    assert played(cache, f"{origin.url}/a.opus") == a
+    c = played(cache, f"{origin.url}/c.opus")
+    assert os.path.exists(a) and os.path.exists(c)
+    assert not os.path.exists(b)
+    assert cache.size <= 2 * largest
+
+    requests = len(origin.requests)
+    played(cache, f"{origin.url}/b.opus")
+    assert len(origin.requests) == requests + 1
+
+
+def test_pinned(origin, songs, directory):
+    for name, data in songs.items():
+        origin.files[f"/{name}.opus"] = data
+    cache = cache_of(directory, max_bytes=max(len(data) for data in songs.values()))
+
+    # Prefetched but not played yet, a is kept over the budget
+    a = cache.fetch(f"{origin.url}/a.opus", never)
+    b = played(cache, f"{origin.url}/b.opus")
+    assert os.path.exists(a) and os.path.exists(b)
+    cache.unpin(a)
+    played(cache, f"{origin.url}/c.opus")
+    assert not os.path.exists(a) and not os.path.exists(b)
+
+
+def test_index_reloaded(origin, songs, directory):
+    origin.files["/a.opus"] = origin.files["/copy.opus"] = songs["a"]
+    cache = cache_of(directory)
+    path = played(cache, f"{origin.url}/a.opus")
+    # The same content under another url is stored once
+    assert played(cache, f"{origin.url}/copy.opus") == path
+    assert len(cache.entries) == 1
+
+    # Hits do not write the index, it is saved in the background
+    cache.save()
+    index = os.path.join(directory, "index.json")
+    saved = os.path.getmtime(index)
+    time.sleep(0.01)
+    played(cache, f"{origin.url}/a.opus")
+    assert cache.changed.is_set()
+    assert os.path.getmtime(index) == saved
+    cache.save()
+    assert not cache.changed.is_set()
+
+    # Leftovers of an interrupted download are removed
+    leftover = os.path.join(directory, "partial.src")
+    open(leftover, "wb").close()
+    cache = cache_of(directory)
+    assert not os.path.exists(leftover)
+    assert cache.size == len(songs["a"])
+    requests = len(origin.requests)
+    assert played(cache, f"{origin.url}/a.opus") == path
+    assert len(origin.requests) == requests
+
+
+def test_index_saved(origin, songs, directory):
+    origin.files["/a.opus"] = songs["a"]
+    cache = MediaCache(directory, 10**8, 60.0, client=HttpClient(retries=1), save_interval=0.05)
+    played(cache, f"{origin.url}/a.opus")
+    time.sleep(0.2)
+    assert cache_of(directory).urls == cache.urls
+
+
+def test_index_reconciled(origin, songs, directory):
+    origin.files["/a.opus"] = songs["a"]
+    cache = cache_of(directory)
+    path = played(cache, f"{origin.url}/a.opus")
+    cache.save()
+    os.remove(path)
+
+    # Urls of files gone from the directory are forgotten
+    cache = cache_of(directory)
+    assert not cache.entries and not cache.urls
+    assert cache.fetch(f"{origin.url}/a.opus", never) == path
+    assert os.path.exists(path)
+
+
+def test_revalidation(origin, songs, directory):
+    origin.files["/a.opus"] = songs["a"]
+    cache = cache_of(directory, revalidate_after=0.0)
+    path = cache.fetch(f"{origin.url}/a.opus", never)
+    _, headers = origin.requests[-1]
+    assert "If-None-Match" not in headers
+
+    # Not modified, nothing is downloaded again
+    assert cache.fetch(f"{origin.url}/a.opus", never) == path
+    _, headers = origin.requests[-1]
+    assert headers["If-None-Match"]
+    assert open(path, "rb").read() == songs["a"]
+
+    # Changed upstream, the new content replaces it
+    origin.files["/a.opus"] = songs["b"]
+    changed = cache.fetch(f"{origin.url}/a.opus", never)
+    assert changed != path
+    assert open(changed, "rb").read() == songs["b"]
+
+
+def test_pinned_while_revalidating(origin, songs, directory):
+    origin.files["/a.opus"] = songs["a"]
+    cache = cache_of(directory, revalidate_after=0.0)
+    path = played(cache, f"{origin.url}/a.opus")
+    download = cache.download
+
+    def evicting(url, headers):
+        # Another station's fetch evicts while the request is out
+        with cache.lock:
+            cache.max_bytes = 0
+            cache.evict()
+        return download(url, headers)
+
+    cache.download = evicting
+    assert played(cache, f"{origin.url}/a.opus") == path
+    _, headers = origin.requests[-1]
+    assert headers["If-None-Match"]
+    assert os.path.exists(path)
+    assert not cache.pins
+    cache.evict()
+    assert not os.path.exists(path)
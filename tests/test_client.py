@@ -0,0 +1,87 @@
+import os
+
+import pytest
+import requests
+
+from streamer.client import HttpClient
+
+
+@pytest.fixture
+def data():
+    return os.urandom(200_000)
+
+
+@pytest.fixture
+def client():
+    return HttpClient(retries=3, backoff=0.01, range_min_bytes=10**9, chunk_size=4096)
+
+
+def ranges(origin):
+    return [headers.get("Range") for _, headers in origin.requests]
+
+
+def test_download(origin, data, client, tmp_path):
+    origin.files["/a"] = data
+    path = tmp_path / "a"
+    resp = client.download(f"{origin.url}/a", str(path))
+    assert resp.status_code == 200
+    assert path.read_bytes() == data
+    assert ranges(origin) == [None]
+
+
+def test_resume(origin, data, client, tmp_path):
+    origin.files["/a"] = data
+    origin.cuts["/a"] = [50_000]
+    path = tmp_path / "a"
+    client.download(f"{origin.url}/a", str(path))
+    assert path.read_bytes() == data
+    # Only the missing bytes are asked for again
+    first, resumed = ranges(origin)
+    assert first is None
+    assert 0 < int(resumed[len("bytes=") : -1]) <= 50_000
+    _, headers = origin.requests[-1]
+    assert headers["If-Range"].startswith('"')
+
+
+def test_not_modified(origin, data, client, tmp_path):
+    origin.files["/a"] = data
+    path = tmp_path / "a"
+    etag = client.download(f"{origin.url}/a", str(path)).headers["ETag"]
+    os.remove(path)
+    resp = client.download(f"{origin.url}/a", str(path), {"If-None-Match": etag})
+    assert resp.status_code == 304
+    assert not path.exists()
+
+
+def test_ranges(origin, data, client, tmp_path):
+    origin.files["/a"] = data
+    client.range_min_bytes = 1000
+    path = tmp_path / "a"
+    client.download(f"{origin.url}/a", str(path))
+    assert path.read_bytes() == data
+    assert sorted(ranges(origin)[1:]) == [
+        "bytes=0-49999",
+        "bytes=100000-149999",
+        "bytes=150000-199999",
+        "bytes=50000-99999",
+    ]
+
+
+def test_range_resumed(origin, data, client, tmp_path):
+    origin.files["/a"] = data
+    client.range_min_bytes = 1000
+    client.range_parts = 1
+    path = tmp_path / "a"
+    # The first request only tells the size, the range is cut
+    origin.cuts["/a"] = [None, 120_000]
+    client.download(f"{origin.url}/a", str(path))
+    assert path.read_bytes() == data
+    first, whole, resumed = ranges(origin)
+    assert (first, whole) == (None, "bytes=0-199999")
+    start = int(resumed[len("bytes=") :].split("-")[0])
+    assert 0 < start <= 120_000 and resumed.endswith("-199999")
+
+
+def test_missing(origin, client, tmp_path):
+    with pytest.raises(requests.HTTPError):
+        client.download(f"{origin.url}/missing", str(tmp_path / "missing"))
@@ -0,0 +1,68 @@
+import json
+import os
+import struct
+
+import pytest
+
+from streamer.opus import OPUS_RATE, DurationIndex, is_opus, opus_duration
+
+from tests.conftest import generate
+
+
+def test_opus_duration(media):
+    assert opus_duration(str(media["opus"])) == pytest.approx(2.5, abs=0.001)
+    assert is_opus(str(media["opus"]))
+
+
+def test_pre_skip(media, tmp_path):
+    data = bytearray(media["opus"].read_bytes())
+    body = data.find(b"OpusHead")
+    pre_skip = struct.unpack_from("<H", data, body + 10)[0]
+    assert pre_skip > 0
+    # Page checksums are not verified, the header is patched in place
+    struct.pack_into("<H", data, body + 10, pre_skip + OPUS_RATE // 2)
+    patched = tmp_path / "patched.opus"
+    patched.write_bytes(bytes(data))
+    assert opus_duration(str(patched)) == pytest.approx(2.0, abs=0.001)
+
+
+def test_long_file(media, tmp_path):
+    # Several pages of audio, the last one is read from the tail
+    song = generate(tmp_path / "long.opus", "-c:a", "libopus", seconds=90)
+    assert opus_duration(str(song)) == pytest.approx(90, abs=0.001)
+
+
+@pytest.mark.parametrize("name", ["wav", "vorbis"])
+def test_not_opus(media, name):
+    assert not is_opus(str(media[name]))
+    with pytest.raises(ValueError):
+        opus_duration(str(media[name]))
+
+
+def test_duration_index(media, tmp_path, monkeypatch):
+    index = DurationIndex(str(tmp_path / "durations.json"), save_interval=3600)
+    assert index.get(str(media["opus"])) == pytest.approx(2.5, abs=0.001)
+    # Written in the background, not by the thread asking
+    assert not (tmp_path / "durations.json").exists()
+    index.save()
+
+    # Reloaded from disk without reading the file again
+    index = DurationIndex(str(tmp_path / "durations.json"))
+    monkeypatch.setattr("streamer.opus.opus_duration", pytest.fail)
+    assert index.get(str(media["opus"])) == pytest.approx(2.5, abs=0.001)
+
+
+def test_duration_index_pruned(media, tmp_path):
+    song = tmp_path / "evicted.opus"
+    song.write_bytes(media["opus"].read_bytes())
+    index = DurationIndex(str(tmp_path / "durations.json"), save_interval=3600)
+    index.get(str(song))
+    index.get(str(media["opus"]))
+    index.save()
+
+    # Gone from the media cache, it is dropped on the next save and load
+    os.remove(song)
+    assert list(DurationIndex(str(tmp_path / "durations.json")).entries) == [str(media["opus"])]
+    index.save()
+    with open(tmp_path / "durations.json") as f:
+        assert list(json.load(f)) == [str(media["opus"])]
@@ -0,0 +1,90 @@
+import threading
+
+import pytest
+
+from streamer.prefetch import Prefetcher
+from streamer.transcode import ON_AIR, PREFETCH
+
+
+class Fetch:
+    """Stand-in for prepare_song, recording its calls"""
+
+    def __init__(self, error=None):
+        self.calls = []
+        self.threads = []
+        self.error = error
+
+    def __call__(self, playlist, song, url, gain, priority):
+        self.calls.append((song, priority))
+        self.threads.append(threading.current_thread().name)
+        if self.error is not None:
+            raise self.error
+        return f"/{song}.opus"
+
+
+def key(song):
+    return ("pl", song, f"http://media/{song}", 0.0)
+
+
+def finished(prefetcher):
+    for future in list(prefetcher.jobs.values()):
+        future.exception()
+
+
+def test_prefetched():
+    fetch = Fetch()
+    prefetcher = Prefetcher(fetch, depth=2)
+    prefetcher.schedule([key("a"), key("b"), key("c")])
+    prefetcher.executor.shutdown()
+    assert sorted(fetch.calls) == [("a", PREFETCH), ("b", PREFETCH)]
+    assert prefetcher.get(*key("a")) == "/a.opus"
+    assert len(fetch.calls) == 2
+
+
+def test_failed_job_raised():
+    fetch = Fetch(error=IOError("unreachable"))
+    prefetcher = Prefetcher(fetch)
+    prefetcher.schedule([key("a")])
+    prefetcher.executor.shutdown()
+    # Not fetched again on the station thread
+    with pytest.raises(IOError):
+        prefetcher.get(*key("a"))
+    assert fetch.calls == [("a", PREFETCH)]
+
+
+def test_released():
+    released = []
+    prefetcher = Prefetcher(Fetch(), release=released.append)
+    prefetcher.schedule([key("a"), key("b")])
+    prefetcher.executor.shutdown()
+    prefetcher.schedule([key("b")])
+    assert released == ["/a.opus"]
+
+
+def test_budget(tmp_path):
+    def fetch(playlist, song, url, gain, priority):
+        path = tmp_path / f"{song}.opus"
+        path.write_bytes(b"\0" * 1000)
+        return str(path)
+
+    prefetcher = Prefetcher(fetch, depth=10, max_bytes=2500)
+    prefetcher.schedule([key("a")])
+    finished(prefetcher)
+    assert prefetcher.expected_bytes == 1000
+
+    # One file ready, room for one more of the same size
+    prefetcher.schedule([key("a")] + [key(song) for song in "bcdefg"])
+    finished(prefetcher)
+    assert sorted(key[1] for key in prefetcher.jobs) == ["a", "b"]
+
+
+def test_not_prefetched():
+    fetch = Fetch()
+    prefetcher = Prefetcher(fetch)
+    future = prefetcher.urgent(*key("a"))
+    assert prefetcher.urgent(*key("a")) is future
+    assert prefetcher.get(*key("a")) == "/a.opus"
+    # Fetched off the station thread, which keeps the stream going
+    assert fetch.calls == [("a", ON_AIR)]
+    assert fetch.threads[0].startswith("on-air")
+    assert not prefetcher.jobs
@@ -0,0 +1,57 @@
+import os
+
+import pytest
+
+from common.redis import Redis, station_key
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The API image is built from its own directory and keeps a copy
+COPIES = ("common/redis.py", "radio_streamer_api/api/commons/redis.py")
+
+
+def code(path):
+    """Module without its docstring, which names the other copy,
+    and with the config imported from the same place"""
+    with open(os.path.join(ROOT, path)) as f:
+        source = f.read()
+    source = source.split('"""', 2)[2]
+    return source.replace("from ..config import", "from config import")
+
+
+def test_copies_match():
+    streamer, api = (code(path) for path in COPIES)
+    assert streamer == api, "common/redis.py and api/commons/redis.py differ"
+
+
+@pytest.fixture
+def backend():
+    fakeredis = pytest.importorskip("fakeredis")
+    backend = Redis("redis://localhost")
+    backend.instance = fakeredis.FakeRedis()
+    return backend
+
+
+def test_schedule(backend):
+    key = station_key("SCHEDULE", "studio")
+    assert key == "studio:SCHEDULE"
+    assert not backend.has_schedule(key)
+    entries = [{"start": start, "title": str(start)} for start in (100.0, 200.0, 300.0)]
+    backend.set_schedule(key, entries, 100.0, 1000.0)
+    assert backend.has_schedule(key)
+    assert backend.schedule_at(key, 250.0, 2) == entries[1::-1]
+    assert backend.schedule_after(key, 100.0, 5) == entries[1:]
+
+    # Replaced from 200 on, entries older than the history are dropped
+    backend.set_schedule(key, [{"start": 250.0, "title": "new"}], 200.0, 50.0)
+    assert [entry["title"] for entry in backend.schedule_after(key, 0.0, 5)] == ["new"]
+
+
+def test_current_play(backend):
+    pubsub = backend.instance.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe("CURRENT_PLAY_CHANGED")
+    with backend.batch() as batch:
+        batch.set_fields("CURRENT_PLAY", {"playlist": "pl", "songs": [["s", "url"]]}, replace=True)
+        batch.publish("CURRENT_PLAY_CHANGED", "pl")
+    assert backend.get_fields("CURRENT_PLAY") == {"playlist": "pl", "songs": [["s", "url"]]}
+    messages = [pubsub.get_message(timeout=0.1) for _ in range(2)]
+    assert [m["data"] for m in messages if m] == [b'"pl"']
@@ -0,0 +1,114 @@
+import threading
+import time
+
+import pytest
+
+from streamer.cache import MediaCache
+from streamer.client import HttpClient
+from streamer.transcode import ON_AIR, PREFETCH, TranscodeService
+
+
+@pytest.fixture
+def log(tmp_path):
+    return tmp_path / "jobs.log"
+
+
+@pytest.fixture
+def service(log):
+    """One worker copying sources, logging the name of each job run"""
+
+    def command(source, destination, name="", delay=0.0, **options):
+        return ["sh", "-c", f"sleep {delay}; echo {name} >> {log}; cp {source} {destination}"]
+
+    return TranscodeService(command, workers=1)
+
+
+def jobs(log):
+    return log.read_text().split() if log.exists() else []
+
+
+def source(tmp_path, name):
+    path = tmp_path / f"{name}.src"
+    path.write_text(name)
+    return str(path)
+
+
+def test_joined(service, log, tmp_path):
+    destination = str(tmp_path / "a.opus")
+    first = service.submit("a", source(tmp_path, "a"), destination, name="a", delay=0.2)
+    second = service.submit("a", source(tmp_path, "a"), destination, name="a")
+    assert second is first
+    assert service.transcode("a", source(tmp_path, "a"), destination, name="a") == destination
+    assert jobs(log) == ["a"]
+    assert service.stats()["completed"] == 1
+
+
+def test_priority_raised(service, log, tmp_path):
+    def submit(name, priority, **options):
+        return service.submit(
+            name, source(tmp_path, name), str(tmp_path / f"{name}.opus"), priority, name=name, **options
+        )
+
+    busy = submit("busy", PREFETCH, delay=0.3)
+    time.sleep(0.1)
+    later = submit("later", PREFETCH)
+    needed = submit("needed", PREFETCH)
+    # Needed on air, it overtakes the prefetch job queued before it
+    assert submit("needed", ON_AIR) is needed
+    for future in (busy, later, needed):
+        future.result(timeout=5)
+    assert jobs(log) == ["busy", "needed", "later"]
+
+
+def test_failure(tmp_path):
+    service = TranscodeService(lambda source, destination: ["false"], workers=1)
+    with pytest.raises(Exception):
+        service.transcode("a", source(tmp_path, "a"), str(tmp_path / "a.opus"))
+    assert service.stats()["failed"] == 1
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_fetch_joined(origin, media, service, log, tmp_path):
+    origin.files["/song.wav"] = media["wav"].read_bytes()
+    directory = tmp_path / "cache"
+    directory.mkdir()
+    cache = MediaCache(str(directory), 10**8, 60.0, client=HttpClient(retries=1))
+
+    def transcode(content, source, destination, priority, gain=0.0):
+        return service.submit(content, source, destination, priority, name="song", delay=0.3)
+
+    url = f"{origin.url}/song.wav"
+    paths = []
+    prefetch = threading.Thread(target=lambda: paths.append(cache.fetch(url, transcode, PREFETCH)))
+    prefetch.start()
+    time.sleep(0.1)
+    # Asked for on air while the prefetch is running, it waits for it
+    paths.append(cache.fetch(url, transcode, ON_AIR))
+    prefetch.join()
+    assert paths[0] == paths[1]
+    assert [path for path, _ in origin.requests] == ["/song.wav"]
+    assert jobs(log) == ["song"]
+
+
+def test_fetch_raised(origin, media, service, log, tmp_path):
+    origin.files["/song.wav"] = media["wav"].read_bytes()
+    directory = tmp_path / "cache"
+    directory.mkdir()
+    cache = MediaCache(str(directory), 10**8, 60.0, client=HttpClient(retries=1))
+
+    def transcode(content, source, destination, priority, gain=0.0):
+        return service.submit(content, source, destination, priority, name="song")
+
+    busy = service.submit("busy", source(tmp_path, "busy"), str(tmp_path / "busy.opus"), name="busy", delay=0.3)
+    later = service.submit("later", source(tmp_path, "later"), str(tmp_path / "later.opus"), name="later")
+    url = f"{origin.url}/song.wav"
+    prefetch = threading.Thread(target=cache.fetch, args=(url, transcode, PREFETCH))
+    prefetch.start()
+    while not any(flight["transcode"] for flight in list(cache.fetching.values())):
+        time.sleep(0.01)
+    # Joining the queued transcode on air puts it ahead of the prefetch work
+    cache.fetch(url, transcode, ON_AIR)
+    prefetch.join()
+    later.result(timeout=5)
+    assert busy.done()
+    assert jobs(log) == ["busy", "song", "later"]